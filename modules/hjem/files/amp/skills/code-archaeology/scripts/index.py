@@ -3,17 +3,32 @@
 from __future__ import annotations
 
 import argparse
+import bisect
 import hashlib
 import json
 import os
+import posixpath
 import re
+import shutil
 import subprocess
 import sys
+import tempfile
 import time
+from array import array
+from concurrent.futures import FIRST_COMPLETED, Executor, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
 from dataclasses import dataclass, field
 from datetime import datetime, timezone
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Set, Tuple
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from kg_store import (
+    GraphData, META_FILE, ROLLUP_TYPES, append_journal, atomic_write, current_version, diff_ops,
+    journal_bytes, journal_limit, load_graph, load_json, publish_snapshot, publish_view, read_current,
+    stage_view, view_dir, write_json,
+)
+from rules import RULE_TAGS, run_rules
+from text_search import SEARCH_DIR, write_search_index
 
 
 SKIP_DIRS = {
@@ -66,6 +81,184 @@ BUILD_FILES = {
 
 ENTRY_STEMS = {"main", "index", "app", "server", "routes", "cli", "cmd"}
 
+EXTRACTOR_VERSION = "6"
+
+DEFAULT_CACHE_MAX_MB = 512
+
+IGNORE_FILE = ".archaeologyignore"
+GITIGNORE_FILE = ".gitignore"
+WALK_CHUNK_DIRS = 32
+
+QUERY_CACHE_DIR = "query_cache"
+
+LINE_OFFSETS_DIR = "line_offsets"
+REFS_DIR = "refs"
+
+MAX_JOURNAL_COMMITS = 50
+
+COMPACT_RATIO = 0.5
+
+PAGERANK_DAMPING = 0.85
+
+PAGERANK_MAX_ITER = 100
+
+PAGERANK_TOLERANCE = 1e-6
+
+DEPENDENCY_EDGE_TYPES = ("imports", "calls", "inherits", "defines", "tests")
+
+EVIDENCE_KEYS = ("path", "start_line", "end_line")
+
+HISTORY_FILE = "history.json"
+
+DEFAULT_HISTORY_MAX_COMMITS = 5000
+
+DEFAULT_CO_CHANGE_MIN_SUPPORT = 3
+
+CO_CHANGE_MAX_FILES = 30
+
+
+PACKAGE_MANIFESTS = {
+    "package.json", "pyproject.toml", "setup.py", "go.mod", "Cargo.toml", "pom.xml",
+    "build.gradle", "build.gradle.kts", "composer.json", "Gemfile", "mix.exs",
+}
+
+SUMMARY_VERSION = "1"
+
+SUMMARY_INDEX_FILE = "summaries.json"
+
+SUMMARY_TOP_FILES = 20
+
+SUMMARY_TOP_SYMBOLS = 15
+
+OVERVIEW_TOP = 10
+
+SUMMARY_SYMBOL_TYPES = ("class", "interface", "type", "function", "method")
+
+CO_CHANGE_MAX_PAIRS = 200000
+
+CALL_SITE_RE = re.compile(r"\b([A-Za-z_][A-Za-z0-9_]+)\s*\(")
+
+CROSS_CALL_IMPORTED_WEIGHT = 0.8
+
+CROSS_CALL_UNIMPORTED_WEIGHT = 0.4
+
+CROSS_CALL_MAX_CANDIDATES = 5
+
+CODE_TOKEN_RE = re.compile(r"[A-Za-z_]\w*|\d+(?:\.\d+)?|\"(?:\\.|[^\"\\])*\"|'(?:\\.|[^'\\])*'|[^\s\w]")
+
+KEYWORDS = {
+    "if", "else", "elif", "for", "while", "do", "switch", "case", "break", "continue",
+    "return", "yield", "def", "func", "fn", "function", "class", "struct", "try", "except",
+    "catch", "finally", "raise", "throw", "new", "in", "not", "and", "or", "is", "None",
+    "null", "nil", "true", "false", "True", "False", "self", "this", "await", "async",
+    "with", "as", "import", "from", "let", "const", "var", "lambda", "pass", "defer", "go",
+}
+
+MINHASH_PERMUTATIONS = 64
+
+MINHASH_BANDS = 16
+
+MINHASH_SHINGLE = 5
+
+MINHASH_MIN_TOKENS = 40
+
+MINHASH_PRIME = (1 << 61) - 1
+
+DUPLICATE_THRESHOLD = 0.8
+
+DUPLICATE_MAX_BUCKET = 50
+
+DOTTED_IMPORT_LANGS = {"python", "java", "kotlin", "scala", "elixir"}
+
+PYTHON_FROM_NAMES_RE = re.compile(r"^from\s+(\S+)\s+import\s+\(?\s*([\w\s,]+)")
+
+OPTIONAL_IMPORT_SUFFIX = "?"
+
+INDEX_STEMS = {"__init__", "index", "default", "mod"}
+
+DEFAULT_MAX_FILE_KB = 1024
+
+SNIFF_BYTES = 8192
+
+MINIFIED_LINE_LENGTH = 1000
+
+GENERATED_SUFFIXES = (
+    "_pb2.py", "_pb2_grpc.py", "_pb2.pyi", ".pb.go", ".pb.gw.go",
+    ".pb.cc", ".pb.h", "_grpc.pb.go", ".g.dart", ".designer.cs",
+    "package-lock.json", "pnpm-lock.yaml", "composer.lock",
+)
+
+MINIFIED_SUFFIXES = (".min.js", ".min.mjs", ".min.css", ".bundle.js")
+
+GENERATED_MARKERS = (
+    b"@generated", b"do not edit", b"code generated by", b"auto-generated",
+    b"autogenerated", b"generated by the protocol buffer compiler",
+)
+
+TEST_DIR_RE = re.compile(r"(?:^|/)(?:tests?|specs?|__tests__)/")
+
+TEST_FILE_PATTERNS: Dict[str, re.Pattern] = {
+    "python": re.compile(r"^(?:test_.*|.*_test|conftest)\.py$"),
+    "javascript": re.compile(r"\.(?:test|spec)\.[cm]?jsx?$"),
+    "typescript": re.compile(r"\.(?:test|spec)\.[cm]?tsx?$"),
+    "go": re.compile(r"_test\.go$"),
+    "java": re.compile(r"^Test\w*\.java$|\w(?:Test|Tests|IT)\.java$"),
+    "kotlin": re.compile(r"\w(?:Test|Tests)\.kts?$"),
+    "scala": re.compile(r"\w(?:Test|Spec|Suite)\.scala$"),
+    "ruby": re.compile(r"^test_.*\.rb$|_(?:spec|test)\.rb$"),
+    "elixir": re.compile(r"_test\.exs$"),
+    "php": re.compile(r"\wTest\.php$"),
+    "swift": re.compile(r"\w(?:Test|Tests)\.swift$"),
+    "c": re.compile(r"^test_.*\.c$|_test\.c$"),
+    "cpp": re.compile(r"^test_.*\.(?:cc|cpp|cxx)$|_(?:test|unittest)\.(?:cc|cpp|cxx)$"),
+    "rust": re.compile(r"^tests?\.rs$"),
+}
+
+TEST_MARKERS: Dict[str, re.Pattern] = {
+    "python": re.compile(r"^\s*(?:import (?:pytest|unittest)\b|from (?:pytest|unittest)\b|class \w+\(.*TestCase\):)", re.M),
+    "javascript": re.compile(r"""^\s*(?:describe|it|test)(?:\.\w+)?\s*\(\s*['"`]|from ['"](?:vitest|@jest/globals)['"]""", re.M),
+    "typescript": re.compile(r"""^\s*(?:describe|it|test)(?:\.\w+)?\s*\(\s*['"`]|from ['"](?:vitest|@jest/globals)['"]""", re.M),
+    "java": re.compile(r"^import (?:static )?org\.(?:junit|testng)\b", re.M),
+    "kotlin": re.compile(r"^import (?:org\.junit|kotlin\.test|io\.kotest)\b", re.M),
+    "scala": re.compile(r"^import org\.scalatest\b|extends (?:Any)?(?:FunSuite|FlatSpec|WordSpec)\b", re.M),
+    "ruby": re.compile(r"""^\s*(?:RSpec\.describe\b|require ['"](?:rspec|minitest/autorun)['"])|< Minitest::Test\b""", re.M),
+    "elixir": re.compile(r"^\s*use ExUnit\.Case\b", re.M),
+    "php": re.compile(r"extends (?:\\?PHPUnit\\Framework\\)?TestCase\b"),
+    "swift": re.compile(r"^import XCTest\b", re.M),
+}
+
+TEST_LANGS = set(TEST_FILE_PATTERNS) | set(TEST_MARKERS)
+
+TEST_NAME_PATTERNS: Dict[str, re.Pattern] = {
+    "python": re.compile(r"^(?:test|Test)"),
+    "go": re.compile(r"^(?:Test|Benchmark|Fuzz|Example)"),
+    "java": re.compile(r"^(?:test[A-Z_]|Test)|\w(?:Test|Tests|IT)$"),
+    "kotlin": re.compile(r"^(?:test[A-Z_]|Test)|\w(?:Test|Tests)$"),
+    "scala": re.compile(r"\w(?:Test|Spec|Suite)$"),
+    "ruby": re.compile(r"^test_"),
+    "php": re.compile(r"^test"),
+    "swift": re.compile(r"^test"),
+}
+
+TEST_ANNOTATION_PATTERNS: Dict[str, re.Pattern] = {
+    "java": re.compile(r"@(?:Test|ParameterizedTest|RepeatedTest|TestFactory)\b"),
+    "kotlin": re.compile(r"@(?:Test|ParameterizedTest)\b"),
+    "scala": re.compile(r"@Test\b"),
+    "rust": re.compile(r"#\[(?:\w+::)?test\b"),
+}
+
+TEST_CALL_PATTERNS: Dict[str, re.Pattern] = {
+    "javascript": re.compile(r"""^\s*(?:it|test)(?:\.(?:only|skip|concurrent))?\s*\(\s*(['"`])(.+?)\1"""),
+    "typescript": re.compile(r"""^\s*(?:it|test)(?:\.(?:only|skip|concurrent))?\s*\(\s*(['"`])(.+?)\1"""),
+    "ruby": re.compile(r"""^\s*it\s*\(?\s*(['"])(.+?)\1"""),
+    "elixir": re.compile(r"""^\s*test\s+(")(.+?)\1"""),
+    "scala": re.compile(r"""^\s*test\s*\(\s*(")(.+?)\1"""),
+}
+
+TEST_SYMBOL_TYPES = ("function", "method", "class")
+
+TEST_ANNOTATION_LOOKBACK = 3
+
 IMPORT_PATTERNS: Dict[str, List[re.Pattern]] = {
     "python": [
         re.compile(r"^import\s+(\S+)"),
@@ -219,9 +412,10 @@ class NodeRecord:
     tags: list = field(default_factory=list)
     confidence: float = 0.7
     evidence: list = field(default_factory=list)
+    metrics: dict = field(default_factory=dict)
 
     def to_dict(self) -> Dict[str, Any]:
-        return {
+        obj = {
             "id": self.id,
             "type": self.type,
             "name": self.name,
@@ -232,6 +426,20 @@ class NodeRecord:
             "confidence": self.confidence,
             "evidence": self.evidence,
         }
+        if self.metrics:
+            obj["metrics"] = self.metrics
+        return obj
+
+    @classmethod
+    def from_dict(cls, obj: Dict[str, Any]) -> "NodeRecord":
+        return cls(
+            id=obj["id"], type=obj.get("type", ""), name=obj.get("name", ""),
+            path=obj.get("path", ""), lang=obj.get("lang", ""),
+            summary=obj.get("summary", ""), tags=list(obj.get("tags", [])),
+            confidence=obj.get("confidence", 0.7),
+            evidence=list(obj.get("evidence", [])),
+            metrics=dict(obj.get("metrics", {})),
+        )
 
 
 @dataclass
@@ -251,6 +459,13 @@ class EdgeRecord:
             "weight": self.weight,
         }
 
+    @classmethod
+    def from_dict(cls, obj: Dict[str, Any]) -> "EdgeRecord":
+        return cls(
+            source=obj["source"], target=obj["target"], type=obj.get("type", ""),
+            evidence=list(obj.get("evidence", [])), weight=obj.get("weight", 0.7),
+        )
+
 
 @dataclass
 class FileRecord:
@@ -269,29 +484,511 @@ class FileRecord:
             "last_indexed": self.last_indexed,
         }
 
+    @classmethod
+    def from_dict(cls, obj: Dict[str, Any]) -> "FileRecord":
+        return cls(
+            path=obj["path"], hash=obj["hash"], lang=obj.get("lang", ""),
+            loc=obj.get("loc", 0), last_indexed=obj.get("last_indexed", ""),
+        )
+
+
+@dataclass
+class HistoryIndex:
+    head: str = ""
+    since: str = ""
+    max_commits: int = 0
+    commits: int = 0
+    pair_error: int = 0
+    files: Dict[str, Dict[str, int]] = field(default_factory=dict)
+    pairs: Dict[Tuple[str, str], int] = field(default_factory=dict)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "head": self.head,
+            "since": self.since,
+            "max_commits": self.max_commits,
+            "commits": self.commits,
+            "pair_error": self.pair_error,
+            "files": self.files,
+            "pairs": [[a, b, n] for (a, b), n in sorted(self.pairs.items())],
+        }
+
+    @classmethod
+    def from_dict(cls, obj: Dict[str, Any]) -> "HistoryIndex":
+        return cls(
+            head=obj.get("head", ""), since=obj.get("since", ""),
+            max_commits=obj.get("max_commits", 0), commits=obj.get("commits", 0),
+            pair_error=obj.get("pair_error", 0),
+            files=dict(obj.get("files", {})),
+            pairs={(a, b): n for a, b, n in obj.get("pairs", [])},
+        )
+
+
+@dataclass
+class PreviousGraph:
+    data: GraphData = field(default_factory=GraphData)
+    files: Dict[str, FileRecord] = field(default_factory=dict)
+    nodes_by_path: Dict[str, List[Dict[str, Any]]] = field(default_factory=dict)
+    edges_by_path: Dict[str, List[Dict[str, Any]]] = field(default_factory=dict)
+    meta: Dict[str, Any] = field(default_factory=dict)
+    view: Optional[Path] = None
+
+
+class IdTable:
+    def __init__(self) -> None:
+        self.index: Dict[str, int] = {}
+        self.names: List[str] = []
+
+    def intern(self, name: str) -> int:
+        i = self.index.get(name)
+        if i is None:
+            i = len(self.names)
+            self.index[name] = i
+            self.names.append(name)
+        return i
+
+
+class EdgeTable:
+    def __init__(self, ids: IdTable) -> None:
+        self.ids = ids
+        self.types: List[str] = []
+        self.type_codes: Dict[str, int] = {}
+        self.source = array("I")
+        self.target = array("I")
+        self.kind = array("B")
+        self.weight = array("d")
+        self.evidence_start = array("I")
+        self.evidence_count = array("H")
+        self.evidence_path = array("I")
+        self.evidence_lines = array("I")
+        self.extra_evidence: Dict[int, List[Dict[str, Any]]] = {}
+        self.keys: Set[int] = set()
+
+    def __len__(self) -> int:
+        return len(self.source)
+
+    def __iter__(self) -> Iterator[EdgeRecord]:
+        for i in range(len(self.source)):
+            yield self.record(i)
+
+    def type_code(self, edge_type: str) -> int:
+        code = self.type_codes.get(edge_type)
+        if code is None:
+            code = len(self.types)
+            self.types.append(edge_type)
+            self.type_codes[edge_type] = code
+        return code
+
+    def add(self, edge: EdgeRecord) -> bool:
+        return self.insert(
+            self.ids.intern(edge.source), self.ids.intern(edge.target), self.type_code(edge.type),
+            edge.weight, edge.evidence,
+        )
+
+    def insert(self, source: int, target: int, kind: int, weight: float, evidence: List[Dict[str, Any]]) -> bool:
+        key = (source << 40) | (target << 8) | kind
+        if key in self.keys:
+            return False
+        self.keys.add(key)
+        self.append(source, target, kind, weight, evidence)
+        return True
+
+    def append(self, source: int, target: int, kind: int, weight: float, evidence: List[Dict[str, Any]]) -> None:
+        index = len(self.source)
+        self.source.append(source)
+        self.target.append(target)
+        self.kind.append(kind)
+        self.weight.append(weight)
+        self.evidence_start.append(len(self.evidence_path))
+        columnar = len(evidence) < 1 << 16 and all(
+            tuple(ev) == EVIDENCE_KEYS and type(ev["start_line"]) is int and type(ev["end_line"]) is int
+            and ev["start_line"] >= 0 and ev["end_line"] >= 0
+            for ev in evidence
+        )
+        if not columnar:
+            self.evidence_count.append(0)
+            self.extra_evidence[index] = evidence
+            return
+        self.evidence_count.append(len(evidence))
+        for ev in evidence:
+            self.evidence_path.append(self.ids.intern(ev["path"]))
+            self.evidence_lines.append(ev["start_line"])
+            self.evidence_lines.append(ev["end_line"])
+
+    def evidence(self, i: int) -> List[Dict[str, Any]]:
+        if i in self.extra_evidence:
+            return self.extra_evidence[i]
+        names = self.ids.names
+        start = self.evidence_start[i]
+        return [
+            {
+                "path": names[self.evidence_path[k]],
+                "start_line": self.evidence_lines[2 * k],
+                "end_line": self.evidence_lines[2 * k + 1],
+            }
+            for k in range(start, start + self.evidence_count[i])
+        ]
+
+    def record(self, i: int) -> EdgeRecord:
+        names = self.ids.names
+        return EdgeRecord(
+            source=names[self.source[i]], target=names[self.target[i]], type=self.types[self.kind[i]],
+            evidence=self.evidence(i), weight=self.weight[i],
+        )
+
+    def triples(self) -> Iterator[Tuple[str, str, str]]:
+        names = self.ids.names
+        for s, t, k in zip(self.source, self.target, self.kind):
+            yield names[s], names[t], self.types[k]
+
+    def retain(self, indices: Iterable[int]) -> None:
+        table = EdgeTable(self.ids)
+        table.types, table.type_codes = self.types, self.type_codes
+        for i in indices:
+            source, target, kind = self.source[i], self.target[i], self.kind[i]
+            key = (source << 40) | (target << 8) | kind
+            if key in table.keys:
+                continue
+            table.keys.add(key)
+            table.append(source, target, kind, self.weight[i], self.evidence(i))
+        self.__dict__.update(table.__dict__)
+
 
 @dataclass
 class IndexState:
     nodes: List[NodeRecord] = field(default_factory=list)
-    edges: List[EdgeRecord] = field(default_factory=list)
     files: List[FileRecord] = field(default_factory=list)
-    node_ids: Set[str] = field(default_factory=set)
-    edge_keys: Set[Tuple[str, str, str]] = field(default_factory=set)
+    ids: IdTable = field(default_factory=IdTable)
+    edges: EdgeTable = field(init=False)
+    node_index: Dict[int, NodeRecord] = field(default_factory=dict)
+    skipped: Dict[str, int] = field(default_factory=dict)
+    line_offsets: Dict[str, array] = field(default_factory=dict)
+    refs: Dict[str, Tuple[List[str], List[List[Any]]]] = field(default_factory=dict)
+    signatures: Dict[str, List[int]] = field(default_factory=dict)
+
+    def __post_init__(self) -> None:
+        self.edges = EdgeTable(self.ids)
+
+    def get_node(self, node_id: str) -> Optional[NodeRecord]:
+        i = self.ids.index.get(node_id)
+        return self.node_index.get(i) if i is not None else None
 
     def add_node(self, node: NodeRecord) -> bool:
-        if node.id in self.node_ids:
+        i = self.ids.intern(node.id)
+        if i in self.node_index:
             return False
-        self.node_ids.add(node.id)
+        node.id = self.ids.names[i]
+        self.node_index[i] = node
         self.nodes.append(node)
         return True
 
     def add_edge(self, edge: EdgeRecord) -> bool:
-        key = (edge.source, edge.target, edge.type)
-        if key in self.edge_keys:
+        return self.edges.add(edge)
+
+
+class IgnoreMatcher:
+    def __init__(self) -> None:
+        self.rules: List[Tuple[str, re.Pattern, bool, bool]] = []
+
+    def add_lines(self, lines: List[str], base: str = "") -> None:
+        for line in lines:
+            rule = compile_ignore_pattern(line)
+            if rule is not None:
+                pattern, negate, dir_only = rule
+                self.rules.append((base, pattern, negate, dir_only))
+
+    def add_file(self, path: Path, base: str = "") -> None:
+        try:
+            self.add_lines(path.read_text(errors="replace").splitlines(), base)
+        except (OSError, PermissionError):
+            return
+
+    def match_one(self, rel: str, is_dir: bool) -> bool:
+        return bool(self.decide(rel, is_dir))
+
+    def decide(self, rel: str, is_dir: bool) -> Optional[bool]:
+        ignored = None
+        for base, pattern, negate, dir_only in self.rules:
+            if dir_only and not is_dir:
+                continue
+            if base:
+                if not rel.startswith(base + "/"):
+                    continue
+                candidate = rel[len(base) + 1:]
+            else:
+                candidate = rel
+            if pattern.match(candidate):
+                ignored = not negate
+        return ignored
+
+    def matches(self, rel: str, is_dir: bool = False) -> bool:
+        if not self.rules:
             return False
-        self.edge_keys.add(key)
-        self.edges.append(edge)
-        return True
+        parts = rel.split("/")
+        for i in range(1, len(parts)):
+            if self.match_one("/".join(parts[:i]), True):
+                return True
+        return self.match_one(rel, is_dir)
+
+
+def compile_ignore_pattern(line: str) -> Optional[Tuple[re.Pattern, bool, bool]]:
+    line = line.rstrip()
+    if not line or line.startswith("#"):
+        return None
+    negate = line.startswith("!")
+    if negate:
+        line = line[1:]
+    dir_only = line.endswith("/")
+    line = line.rstrip("/")
+    anchored = "/" in line
+    line = line.lstrip("/")
+    if not line:
+        return None
+
+    out = []
+    i = 0
+    while i < len(line):
+        if line.startswith("**/", i):
+            out.append("(?:.*/)?")
+            i += 3
+        elif line.startswith("/**", i) and i + 3 == len(line):
+            out.append("(?:/.*)?")
+            i += 3
+        elif line.startswith("**", i):
+            out.append(".*")
+            i += 2
+        elif line[i] == "*":
+            out.append("[^/]*")
+            i += 1
+        elif line[i] == "?":
+            out.append("[^/]")
+            i += 1
+        elif line[i] == "[" and "]" in line[i + 1:]:
+            end = line.index("]", i + 1)
+            body = line[i + 1:end].replace("\\", "\\\\")
+            if body.startswith("!"):
+                body = "^" + body[1:]
+            out.append(f"[{body}]")
+            i = end + 1
+        else:
+            out.append(re.escape(line[i]))
+            i += 1
+    regex = "".join(out)
+    prefix = "" if anchored else "(?:.*/)?"
+    return re.compile(f"^{prefix}{regex}$"), negate, dir_only
+
+
+@dataclass
+class FilePolicy:
+    max_bytes: int = DEFAULT_MAX_FILE_KB * 1024
+    ignore: IgnoreMatcher = field(default_factory=IgnoreMatcher)
+
+    def check(
+        self,
+        filepath: Path,
+        rel: str,
+        lang: str,
+        size: Optional[int] = None,
+        reader: Optional[Callable[[], bytes]] = None,
+    ) -> str:
+        if self.ignore.matches(rel):
+            return "ignored"
+        name = filepath.name.lower()
+        if name.endswith(GENERATED_SUFFIXES):
+            return "generated"
+        if name.endswith(MINIFIED_SUFFIXES):
+            return "minified"
+        try:
+            if size is None:
+                size = filepath.stat().st_size
+            if self.max_bytes and size > self.max_bytes:
+                return "oversized"
+            if reader is not None:
+                head = reader()[:SNIFF_BYTES]
+            else:
+                with open(filepath, "rb") as f:
+                    head = f.read(SNIFF_BYTES)
+        except (OSError, PermissionError):
+            return "unreadable"
+        if b"\0" in head:
+            return "binary"
+        lowered = head[:1024].lower()
+        if any(marker in lowered for marker in GENERATED_MARKERS):
+            return "generated"
+        if lang != "markdown":
+            lines = head.split(b"\n")
+            if len(head) == SNIFF_BYTES:
+                lines = lines[:-1] or lines
+            if max(len(line) for line in lines) > MINIFIED_LINE_LENGTH:
+                return "minified"
+        return ""
+
+
+def load_file_policy(root: Path, max_file_kb: int, source: Optional["GitRevision"] = None) -> FilePolicy:
+    policy = FilePolicy(max_bytes=max_file_kb * 1024)
+    if source is None:
+        policy.ignore.add_file(root / IGNORE_FILE)
+    elif IGNORE_FILE in source.entries:
+        policy.ignore.add_lines(source.read(IGNORE_FILE).decode("utf-8", errors="replace").splitlines())
+    return policy
+
+
+class GitRevision:
+    def __init__(self, root: Path, commit: str) -> None:
+        self.root = root
+        self.commit = commit
+        self.entries: Dict[str, Tuple[str, int]] = {}
+        self.proc: Optional[subprocess.Popen] = None
+        self.last: Tuple[str, bytes] = ("", b"")
+
+    def list_files(self) -> Optional[List[Path]]:
+        try:
+            result = subprocess.run(
+                ["git", "ls-tree", "-r", "-l", "-z", self.commit],
+                cwd=str(self.root),
+                capture_output=True,
+                timeout=60,
+            )
+        except (FileNotFoundError, subprocess.TimeoutExpired):
+            return None
+        if result.returncode != 0:
+            return None
+        for entry in result.stdout.decode("utf-8", errors="surrogateescape").split("\0"):
+            info, sep, rel = entry.partition("\t")
+            fields = info.split()
+            if not sep or len(fields) != 4 or fields[1] != "blob" or fields[0] == "120000":
+                continue
+            if any(part in SKIP_DIRS for part in rel.split("/")[:-1]):
+                continue
+            if rel != IGNORE_FILE and not is_source_name(posixpath.basename(rel)):
+                continue
+            self.entries[rel] = (fields[2], int(fields[3]) if fields[3].isdigit() else 0)
+        return [self.root / rel for rel in self.entries]
+
+    def blob_ids(self) -> Dict[str, str]:
+        return {rel: oid for rel, (oid, _) in self.entries.items()}
+
+    def request(self, oid: str) -> int:
+        if self.proc is None:
+            self.proc = subprocess.Popen(
+                ["git", "cat-file", "--batch"],
+                cwd=str(self.root),
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+            )
+        assert self.proc.stdin is not None and self.proc.stdout is not None
+        self.proc.stdin.write(oid.encode() + b"\n")
+        self.proc.stdin.flush()
+        header = self.proc.stdout.readline().split()
+        if len(header) != 3 or header[1] != b"blob":
+            return -1
+        return int(header[2])
+
+    def read(self, rel: str) -> bytes:
+        if self.last[0] == rel:
+            return self.last[1]
+        entry = self.entries.get(rel)
+        if entry is None:
+            return b""
+        size = self.request(entry[0])
+        if size < 0:
+            return b""
+        assert self.proc is not None and self.proc.stdout is not None
+        data = self.proc.stdout.read(size)
+        self.proc.stdout.read(1)
+        self.last = (rel, data)
+        return data
+
+    def read_head(self, rel: str, limit: int = 256) -> bytes:
+        if self.last[0] == rel:
+            return self.last[1][:limit]
+        entry = self.entries.get(rel)
+        if entry is None:
+            return b""
+        size = self.request(entry[0])
+        if size < 0:
+            return b""
+        assert self.proc is not None and self.proc.stdout is not None
+        head = self.proc.stdout.read(min(size, limit))
+        remaining = size - len(head) + 1
+        while remaining > 0:
+            chunk = self.proc.stdout.read(min(remaining, 1 << 16))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+        return head
+
+    def close(self) -> None:
+        if self.proc is not None:
+            if self.proc.stdin is not None:
+                self.proc.stdin.close()
+            self.proc.wait()
+            self.proc = None
+
+
+class ExtractionCache:
+    def __init__(self, cache_dir: Path, max_bytes: int) -> None:
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, file_hash: str, extractor: str, lang: str) -> str:
+        raw = f"{file_hash}:{lang}:{extractor}:{EXTRACTOR_VERSION}"
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def entry_path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}.json"
+
+    def get(self, file_hash: str, extractor: str, lang: str) -> Optional[Dict[str, Any]]:
+        path = self.entry_path(self.key(file_hash, extractor, lang))
+        try:
+            data = json.loads(path.read_text())
+            os.utime(path)
+        except (OSError, json.JSONDecodeError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return data
+
+    def put(self, file_hash: str, extractor: str, lang: str, data: Dict[str, Any]) -> None:
+        path = self.entry_path(self.key(file_hash, extractor, lang))
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=str(path.parent), suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                json.dump(data, f, separators=(",", ":"))
+            os.replace(tmp, path)
+        except OSError:
+            return
+
+    def prune(self) -> int:
+        entries = []
+        total = 0
+        for path in self.cache_dir.glob("*/*.json"):
+            try:
+                st = path.stat()
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+        removed = 0
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                path.unlink()
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        return removed
+
+
+def default_cache_dir() -> Path:
+    base = os.environ.get("XDG_CACHE_HOME") or str(Path.home() / ".cache")
+    return Path(base) / "code-archaeology" / "extract"
 
 
 def make_node_id(node_type: str, path: str, name: str = "") -> str:
@@ -301,6 +998,13 @@ def make_node_id(node_type: str, path: str, name: str = "") -> str:
     return f"{prefix}:{path}"
 
 
+def rebase_id(node_id: str, old_path: str, new_path: str) -> str:
+    prefix, _, rest = node_id.partition(":")
+    if rest == old_path or rest.startswith(old_path + ":"):
+        return f"{prefix}:{new_path}{rest[len(old_path):]}"
+    return node_id
+
+
 def sha256_file(filepath: Path) -> str:
     h = hashlib.sha256()
     try:
@@ -312,12 +1016,29 @@ def sha256_file(filepath: Path) -> str:
     return h.hexdigest()
 
 
-def detect_lang(filepath: Path) -> str:
+def git_blob_hash(filepath: Path, algo: str = "sha1") -> str:
+    try:
+        size = filepath.stat().st_size
+        h = hashlib.new(algo)
+        h.update(f"blob {size}\0".encode())
+        with open(filepath, "rb") as f:
+            for chunk in iter(lambda: f.read(65536), b""):
+                h.update(chunk)
+    except (OSError, PermissionError):
+        return ""
+    return h.hexdigest()
+
+
+def detect_lang(filepath: Path, reader: Optional[Callable[[], bytes]] = None) -> str:
     ext = filepath.suffix.lower()
     if ext in LANG_MAP:
         return LANG_MAP[ext]
     try:
-        first_line = filepath.read_text(errors="replace").split("\n", 1)[0]
+        if reader is not None:
+            first_line = reader()[:256].split(b"\n", 1)[0].decode(errors="replace")
+        else:
+            with open(filepath, "rb") as f:
+                first_line = f.readline(256).decode(errors="replace")
         if first_line.startswith("#!"):
             for lang_hint, lang_name in [
                 ("python", "python"), ("node", "javascript"), ("ruby", "ruby"),
@@ -338,6 +1059,27 @@ def count_lines(filepath: Path) -> int:
         return 0
 
 
+def read_bytes(filepath: Path) -> bytes:
+    try:
+        return filepath.read_bytes()
+    except (OSError, PermissionError):
+        return b""
+
+
+def line_offsets(data: bytes) -> array:
+    offsets = array("Q", [0])
+    offsets.extend(m.end() for m in re.finditer(b"\n", data))
+    if offsets[-1] != len(data):
+        offsets.append(len(data))
+    return offsets
+
+
+def blob_hash_algo(blob_ids: Optional[Dict[str, str]]) -> str:
+    if blob_ids and len(next(iter(blob_ids.values()))) == 64:
+        return "sha256"
+    return "sha1"
+
+
 def read_lines(filepath: Path) -> List[str]:
     try:
         return filepath.read_text(errors="replace").splitlines()
@@ -360,6 +1102,23 @@ def is_entry_point(filepath: Path, root: Path) -> bool:
     return False
 
 
+def is_test_file(rel: str, lang: str, text: str) -> bool:
+    if lang not in TEST_LANGS:
+        return False
+    pattern = TEST_FILE_PATTERNS.get(lang)
+    if pattern is not None and pattern.search(posixpath.basename(rel)):
+        return True
+    if TEST_DIR_RE.search(rel):
+        return True
+    marker = TEST_MARKERS.get(lang)
+    return marker is not None and marker.search(text) is not None
+
+
+def is_source_name(name: str) -> bool:
+    ext = os.path.splitext(name)[1].lower()
+    return (ext in LANG_MAP if ext else not name.startswith(".")) or name in BUILD_FILES
+
+
 def list_files_git(root: Path) -> Optional[List[Path]]:
     try:
         result = subprocess.run(
@@ -381,50 +1140,396 @@ def list_files_git(root: Path) -> Optional[List[Path]]:
         return None
 
 
-def list_files_walk(root: Path) -> List[Path]:
-    paths = []
-    for dirpath, dirnames, filenames in os.walk(root):
-        dirnames[:] = [d for d in dirnames if d not in SKIP_DIRS]
-        for fname in filenames:
-            paths.append(Path(dirpath) / fname)
-    return paths
+class DirWalker:
+    def __init__(self, root: Path, ignore: Optional[IgnoreMatcher] = None, jobs: int = 1) -> None:
+        self.root = root
+        self.ignore = ignore or IgnoreMatcher()
+        self.jobs = max(1, jobs)
+        self.entries: Dict[str, int] = {}
+
+    def list_files(self) -> List[Path]:
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            pending = {pool.submit(self.walk, [("", ())])}
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    files, spill = future.result()
+                    self.entries.update(files)
+                    pending.update(pool.submit(self.walk, [item]) for item in spill)
+        return [self.root / rel for rel in sorted(self.entries)]
+
+    def walk(
+        self, stack: List[Tuple[str, Tuple[IgnoreMatcher, ...]]],
+    ) -> Tuple[Dict[str, int], List[Tuple[str, Tuple[IgnoreMatcher, ...]]]]:
+        files: Dict[str, int] = {}
+        for _ in range(WALK_CHUNK_DIRS):
+            if not stack:
+                break
+            rel_dir, rules = stack.pop()
+            stack.extend(self.scan(rel_dir, rules, files))
+        return files, stack
+
+    def scan(
+        self, rel_dir: str, rules: Tuple[IgnoreMatcher, ...], files: Dict[str, int],
+    ) -> List[Tuple[str, Tuple[IgnoreMatcher, ...]]]:
+        try:
+            with os.scandir(self.root / rel_dir if rel_dir else self.root) as it:
+                entries = list(it)
+        except OSError:
+            return []
+        prefix = rel_dir + "/" if rel_dir else ""
+        for entry in entries:
+            if entry.name == GITIGNORE_FILE:
+                local = IgnoreMatcher()
+                local.add_file(Path(entry.path), rel_dir)
+                if local.rules:
+                    rules = rules + (local,)
+                break
 
+        subdirs = []
+        for entry in entries:
+            name = entry.name
+            rel = prefix + name
+            try:
+                if entry.is_symlink():
+                    continue
+                if entry.is_dir():
+                    if name not in SKIP_DIRS and not self.ignored(rules, rel, True):
+                        subdirs.append((rel, rules))
+                    continue
+                if not entry.is_file():
+                    continue
+                if not is_source_name(name):
+                    continue
+                if self.ignored(rules, rel, False):
+                    continue
+                files[rel] = entry.stat().st_size
+            except OSError:
+                continue
+        return subdirs
+
+    def ignored(self, rules: Tuple[IgnoreMatcher, ...], rel: str, is_dir: bool) -> bool:
+        ignored = False
+        for matcher in (*rules, self.ignore):
+            verdict = matcher.decide(rel, is_dir)
+            if verdict is not None:
+                ignored = verdict
+        return ignored
 
-def git_changed_files(root: Path, ref: str) -> Optional[List[Path]]:
+
+def git_blob_ids(root: Path) -> Optional[Dict[str, str]]:
     try:
-        result = subprocess.run(
-            ["git", "diff", "--name-only", ref],
+        staged = subprocess.run(
+            ["git", "ls-files", "-s", "-z"],
+            cwd=str(root),
+            capture_output=True,
+            text=True,
+            timeout=30,
+        )
+        dirty = subprocess.run(
+            ["git", "diff", "--relative", "--name-only", "-z"],
             cwd=str(root),
             capture_output=True,
             text=True,
             timeout=30,
         )
-        if result.returncode != 0:
-            return None
-        paths = []
-        for line in result.stdout.splitlines():
-            line = line.strip()
-            if line:
-                paths.append(root / line)
-        return paths
     except (FileNotFoundError, subprocess.TimeoutExpired):
         return None
+    if staged.returncode != 0 or dirty.returncode != 0:
+        return None
+    dirty_paths = {p for p in dirty.stdout.split("\0") if p}
+    blob_ids = {}
+    pending = set()
+    for entry in staged.stdout.split("\0"):
+        info, sep, rel = entry.partition("\t")
+        if not sep:
+            continue
+        fields = info.split()
+        if len(fields) != 3 or fields[2] != "0" or rel in dirty_paths:
+            pending.add(rel)
+            continue
+        blob_ids[rel] = fields[1]
+    blob_ids.update(git_hash_objects(root, pending))
+    return blob_ids
 
 
-def load_existing_hashes(output_dir: Path) -> Dict[str, str]:
-    files_path = output_dir / "files.jsonl"
-    if not files_path.exists():
+def git_hash_objects(root: Path, paths: Iterable[str]) -> Dict[str, str]:
+    paths = sorted(p for p in paths if "\n" not in p and (root / p).is_file() and not (root / p).is_symlink())
+    if not paths:
         return {}
-    hashes = {}
-    for line in files_path.read_text().splitlines():
-        line = line.strip()
-        if line:
-            try:
-                obj = json.loads(line)
-                hashes[obj["path"]] = obj["hash"]
-            except (json.JSONDecodeError, KeyError):
+    try:
+        result = subprocess.run(
+            ["git", "hash-object", "--stdin-paths"],
+            cwd=str(root),
+            input="".join(f"{root.resolve() / p}\n" for p in paths),
+            capture_output=True,
+            text=True,
+            timeout=60,
+        )
+    except (FileNotFoundError, subprocess.TimeoutExpired):
+        return {}
+    ids = result.stdout.split()
+    if result.returncode != 0 or len(ids) != len(paths):
+        return {}
+    return dict(zip(paths, ids))
+
+
+def git_head(root: Path, rev: str = "HEAD") -> str:
+    try:
+        result = subprocess.run(
+            ["git", "rev-parse", "--verify", "--quiet", f"{rev}^{{commit}}"],
+            cwd=str(root),
+            capture_output=True,
+            text=True,
+            timeout=10,
+        )
+    except (FileNotFoundError, subprocess.TimeoutExpired):
+        return ""
+    return result.stdout.strip() if result.returncode == 0 else ""
+
+
+def git_changes(root: Path, ref: str, rev: str = "") -> Optional[Tuple[List[Path], Dict[str, str]]]:
+    try:
+        result = subprocess.run(
+            ["git", "diff", "--relative", "-M", "--name-status", "-z", ref] + ([rev] if rev else []),
+            cwd=str(root),
+            capture_output=True,
+            text=True,
+            timeout=30,
+        )
+    except (FileNotFoundError, subprocess.TimeoutExpired):
+        return None
+    if result.returncode != 0:
+        return None
+    paths = []
+    renames: Dict[str, str] = {}
+    tokens = result.stdout.split("\0")
+    i = 0
+    while i < len(tokens):
+        status = tokens[i]
+        if not status:
+            i += 1
+            continue
+        if status[0] in "RC":
+            old_rel, new_rel = tokens[i + 1], tokens[i + 2]
+            if status[0] == "R":
+                renames[new_rel] = old_rel
+            paths.append(root / new_rel)
+            i += 3
+            continue
+        if status[0] != "D":
+            paths.append(root / tokens[i + 1])
+        i += 2
+    return paths, renames
+
+
+def git_is_ancestor(root: Path, rev: str, head: str = "HEAD") -> bool:
+    try:
+        result = subprocess.run(
+            ["git", "merge-base", "--is-ancestor", rev, head],
+            cwd=str(root),
+            capture_output=True,
+            timeout=10,
+        )
+    except (FileNotFoundError, subprocess.TimeoutExpired):
+        return False
+    return result.returncode == 0
+
+
+def stream_git_log(
+    root: Path,
+    rev_range: str = "HEAD",
+    since: str = "",
+    max_commits: int = 0,
+) -> Iterator[Tuple[str, int, List[Tuple[str, int, int]]]]:
+    cmd = [
+        "git", "-c", "core.quotePath=false", "log", "--numstat", "--no-renames", "--no-merges",
+        "--format=%x01%H %ct",
+    ]
+    if since:
+        cmd.append(f"--since={since}")
+    if max_commits:
+        cmd.append(f"--max-count={max_commits}")
+    cmd.append(rev_range)
+    try:
+        proc = subprocess.Popen(
+            cmd, cwd=str(root), stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            text=True, errors="replace",
+        )
+    except FileNotFoundError:
+        return
+    sha = ""
+    timestamp = 0
+    changes: List[Tuple[str, int, int]] = []
+    try:
+        for line in proc.stdout:
+            line = line.rstrip("\n")
+            if line.startswith("\x01"):
+                if sha:
+                    yield sha, timestamp, changes
+                sha, _, ts = line[1:].partition(" ")
+                timestamp = int(ts) if ts.isdigit() else 0
+                changes = []
                 continue
-    return hashes
+            added, sep, rest = line.partition("\t")
+            deleted, sep2, path = rest.partition("\t")
+            if not sep or not sep2 or not path:
+                continue
+            changes.append((
+                path,
+                int(added) if added.isdigit() else 0,
+                int(deleted) if deleted.isdigit() else 0,
+            ))
+        if sha:
+            yield sha, timestamp, changes
+    finally:
+        proc.stdout.close()
+        proc.wait()
+
+
+def count_pair(pairs: Dict[Tuple[str, str], int], pair: Tuple[str, str], capacity: int) -> int:
+    if pair in pairs:
+        pairs[pair] += 1
+        return 0
+    pairs[pair] = 1
+    if len(pairs) > 2 * capacity:
+        return prune_pairs(pairs, capacity)
+    return 0
+
+
+def prune_pairs(pairs: Dict[Tuple[str, str], int], capacity: int) -> int:
+    if len(pairs) <= capacity:
+        return 0
+    histogram: Dict[int, int] = {}
+    for n in pairs.values():
+        histogram[n] = histogram.get(n, 0) + 1
+    cut = 0
+    kept = 0
+    for n in sorted(histogram, reverse=True):
+        kept += histogram[n]
+        if kept > capacity:
+            cut = n
+            break
+    for key, n in list(pairs.items()):
+        if n <= cut:
+            del pairs[key]
+    return cut
+
+
+def update_history(
+    root: Path,
+    history: HistoryIndex,
+    head: str,
+    since: str,
+    max_commits: int,
+    live_paths: Set[str],
+) -> int:
+    if history.head and history.head == head and history.since == since and history.max_commits == max_commits:
+        return 0
+    incremental = (
+        history.head
+        and history.since == since
+        and history.max_commits == max_commits
+        and git_is_ancestor(root, history.head, head)
+    )
+    if not incremental:
+        history.files = {}
+        history.pairs = {}
+        history.commits = 0
+        history.pair_error = 0
+    rev_range = f"{history.head}..{head}" if incremental else head
+
+    processed = 0
+    for _, timestamp, changes in stream_git_log(root, rev_range, since, max_commits):
+        processed += 1
+        touched = sorted({path for path, _, _ in changes})
+        for path, added, deleted in changes:
+            stats = history.files.setdefault(
+                path, {"commits": 0, "added": 0, "deleted": 0, "first_changed": timestamp, "last_changed": timestamp},
+            )
+            stats["commits"] += 1
+            stats["added"] += added
+            stats["deleted"] += deleted
+            stats["first_changed"] = min(stats["first_changed"], timestamp)
+            stats["last_changed"] = max(stats["last_changed"], timestamp)
+        if len(touched) > CO_CHANGE_MAX_FILES:
+            continue
+        for i, a in enumerate(touched):
+            for b in touched[i + 1:]:
+                history.pair_error += count_pair(history.pairs, (a, b), CO_CHANGE_MAX_PAIRS)
+    history.pair_error += prune_pairs(history.pairs, CO_CHANGE_MAX_PAIRS)
+
+    history.files = {p: s for p, s in history.files.items() if p in live_paths}
+    history.pairs = {
+        pair: n for pair, n in history.pairs.items() if pair[0] in live_paths and pair[1] in live_paths
+    }
+    history.head = head
+    history.since = since
+    history.max_commits = max_commits
+    history.commits += processed
+    return processed
+
+
+def apply_history(state: IndexState, history: HistoryIndex, min_support: int) -> int:
+    file_ids = {n.path: n.id for n in state.nodes if n.type == "file"}
+    co_changes = state.edges.type_code("co_changes")
+    state.edges.retain(i for i, kind in enumerate(state.edges.kind) if kind != co_changes)
+    added = 0
+    for (a, b), support in sorted(history.pairs.items()):
+        if support < min_support or a not in file_ids or b not in file_ids:
+            continue
+        union = history.files.get(a, {}).get("commits", 0) + history.files.get(b, {}).get("commits", 0) - support
+        weight = round(support / union, 3) if union > 0 else 1.0
+        if state.add_edge(EdgeRecord(source=file_ids[a], target=file_ids[b], type="co_changes", weight=weight)):
+            added += 1
+    return added
+
+
+def load_previous_graph(output_dir: Path) -> PreviousGraph:
+    version, view = read_current(output_dir)
+    data = load_graph(output_dir, version, view)
+    base = view_dir(output_dir, version, view)
+    prev = PreviousGraph(data=data, meta=load_json(base / META_FILE), view=base)
+    for obj in data.files.values():
+        try:
+            fr = FileRecord.from_dict(obj)
+        except KeyError:
+            continue
+        prev.files[fr.path] = fr
+    node_paths: Dict[str, str] = {}
+    for obj in data.nodes.values():
+        path = obj.get("path", "")
+        node_paths[obj["id"]] = path
+        prev.nodes_by_path.setdefault(path, []).append(obj)
+    for obj in data.edges.values():
+        evidence = obj.get("evidence") or []
+        path = evidence[0].get("path", "") if evidence else node_paths.get(obj["source"], "")
+        prev.edges_by_path.setdefault(path, []).append(obj)
+    return prev
+
+
+def carry_over_file(
+    state: IndexState,
+    prev: PreviousGraph,
+    old_rel: str,
+    rel: str,
+) -> None:
+    for obj in prev.nodes_by_path.get(old_rel, []):
+        node = NodeRecord.from_dict(obj)
+        if old_rel != rel:
+            node.id = rebase_id(node.id, old_rel, rel)
+            node.path = rel
+            if node.type == "file":
+                node.name = Path(rel).name
+            node.evidence = [dict(ev, path=rel) for ev in node.evidence]
+        state.add_node(node)
+    for obj in prev.edges_by_path.get(old_rel, []):
+        edge = EdgeRecord.from_dict(obj)
+        if old_rel != rel:
+            edge.source = rebase_id(edge.source, old_rel, rel)
+            edge.target = rebase_id(edge.target, old_rel, rel)
+            edge.evidence = [dict(ev, path=rel) for ev in edge.evidence]
+        state.add_edge(edge)
 
 
 def extract_imports(lines: List[str], lang: str) -> List[Tuple[str, int]]:
@@ -453,6 +1558,14 @@ def extract_imports(lines: List[str], lang: str) -> List[Tuple[str, int]]:
             if m:
                 results.append((m.group(1), lineno))
                 break
+        if lang == "python":
+            m = PYTHON_FROM_NAMES_RE.match(stripped)
+            if m:
+                package = m.group(1) if m.group(1).endswith(".") else m.group(1) + "."
+                for name in m.group(2).split(","):
+                    name = name.split()[0] if name.split() else ""
+                    if name.isidentifier():
+                        results.append((package + name + OPTIONAL_IMPORT_SUFFIX, lineno))
     return results
 
 
@@ -539,6 +1652,38 @@ def extract_symbols_regex(lines: List[str], lang: str) -> List[Dict[str, Any]]:
     return symbols
 
 
+def extract_test_calls(lines: List[str], lang: str) -> List[Dict[str, Any]]:
+    pattern = TEST_CALL_PATTERNS.get(lang)
+    if pattern is None:
+        return []
+    cases = []
+    seen = set()
+    for lineno, line in enumerate(lines, 1):
+        m = pattern.match(line)
+        if m and m.group(2) not in seen:
+            seen.add(m.group(2))
+            cases.append({"name": m.group(2), "type": "test", "line": lineno, "end_line": lineno, "confidence": 0.7})
+    return cases
+
+
+def find_test_cases(lines: List[str], lang: str, symbols: List[Dict[str, Any]]) -> List[int]:
+    name_re = TEST_NAME_PATTERNS.get(lang)
+    annotation_re = TEST_ANNOTATION_PATTERNS.get(lang)
+    cases = []
+    for i, sym in enumerate(symbols):
+        if sym["type"] == "test":
+            cases.append(i)
+        elif sym["type"] not in TEST_SYMBOL_TYPES:
+            continue
+        elif name_re is not None and name_re.search(sym["name"]):
+            cases.append(i)
+        elif annotation_re is not None:
+            above = lines[max(0, sym["line"] - 1 - TEST_ANNOTATION_LOOKBACK):sym["line"] - 1]
+            if any(annotation_re.search(line) for line in above):
+                cases.append(i)
+    return cases
+
+
 def find_symbol_references(lines: List[str], symbol_name: str) -> List[int]:
     refs = []
     pattern = re.compile(r"\b" + re.escape(symbol_name) + r"\b")
@@ -551,52 +1696,99 @@ def find_symbol_references(lines: List[str], symbol_name: str) -> List[int]:
 def run_pass1(
     root: Path,
     all_files: List[Path],
-    existing_hashes: Dict[str, str],
+    prev: PreviousGraph,
     full_reindex: bool,
     state: IndexState,
     verbose: bool,
-) -> Tuple[Set[str], Dict[str, int], Dict[str, int]]:
+    blob_ids: Optional[Dict[str, str]] = None,
+    renames: Optional[Dict[str, str]] = None,
+    scope: Optional[Set[str]] = None,
+    policy: Optional[FilePolicy] = None,
+    source: Optional[GitRevision] = None,
+    sizes: Optional[Dict[str, int]] = None,
+) -> Set[str]:
     entry_point_ids: Set[str] = set()
-    fan_out: Dict[str, int] = {}
-    fan_in: Dict[str, int] = {}
     now = datetime.now(timezone.utc).isoformat()
+    renames = renames or {}
+    blob_algo = blob_hash_algo(blob_ids)
 
     for filepath in all_files:
-        if not filepath.is_file():
+        if source is None and sizes is None and not filepath.is_file():
             continue
         try:
-            rel = str(filepath.relative_to(root))
+            rel = filepath.relative_to(root).as_posix()
         except ValueError:
             continue
 
-        lang = detect_lang(filepath)
+        reader = (lambda: source.read(rel)) if source is not None else None
+        if source is not None and filepath.suffix.lower() not in LANG_MAP:
+            if policy is not None and policy.max_bytes and source.entries[rel][1] > policy.max_bytes:
+                continue
+        lang = detect_lang(filepath, (lambda: source.read_head(rel)) if source is not None else None)
         if not lang:
             continue
 
-        file_hash = sha256_file(filepath)
+        old_rel = renames.get(rel, rel)
+        prev_fr = None if full_reindex else prev.files.get(old_rel)
+
+        node_id = make_node_id("file", rel)
+        if scope is not None and rel not in scope:
+            if prev_fr is None:
+                continue
+            file_hash = prev_fr.hash
+        else:
+            if source is not None:
+                size = source.entries[rel][1]
+            else:
+                size = sizes.get(rel) if sizes is not None else None
+            reason = policy.check(filepath, rel, lang, size, reader) if policy else ""
+            if reason:
+                state.skipped[reason] = state.skipped.get(reason, 0) + 1
+                if reason != "ignored":
+                    state.add_node(NodeRecord(
+                        id=node_id, type="file", name=filepath.name,
+                        path=rel, lang=lang, summary=f"Skipped by file policy ({reason}).",
+                        tags=["skipped", reason], confidence=0.5,
+                    ))
+                if verbose:
+                    print(f"  [pass1] {rel} (skipped: {reason})")
+                continue
+            if blob_ids is None:
+                file_hash = sha256_file(filepath)
+            elif rel in blob_ids:
+                file_hash = blob_ids[rel]
+            else:
+                file_hash = git_blob_hash(filepath, blob_algo)
         if not file_hash:
             continue
 
-        if not full_reindex and rel in existing_hashes and existing_hashes[rel] == file_hash:
-            node_id = make_node_id("file", rel)
+        if prev_fr is not None and prev_fr.hash == file_hash:
+            carry_over_file(state, prev, old_rel, rel)
             state.add_node(NodeRecord(
                 id=node_id, type="file", name=filepath.name,
                 path=rel, lang=lang, confidence=0.9,
             ))
             state.files.append(FileRecord(
                 path=rel, hash=file_hash, lang=lang,
-                loc=count_lines(filepath), last_indexed=now,
+                loc=prev_fr.loc, last_indexed=prev_fr.last_indexed or now,
             ))
             if is_entry_point(filepath, root):
                 entry_point_ids.add(node_id)
+            if verbose and old_rel != rel:
+                print(f"  [pass1] {rel} (renamed from {old_rel}, reused)")
             continue
 
-        loc = count_lines(filepath)
+        data = source.read(rel) if source is not None else read_bytes(filepath)
+        text = data.decode("utf-8", errors="replace")
+        lines = text.splitlines()
+        state.line_offsets[file_hash] = line_offsets(data)
+        loc = len(lines)
         tags: List[str] = []
         if loc > 1000:
             tags.append("large_file")
+        if is_test_file(rel, lang, text):
+            tags.append("test")
 
-        node_id = make_node_id("file", rel)
         state.add_node(NodeRecord(
             id=node_id, type="file", name=filepath.name,
             path=rel, lang=lang, summary="", tags=tags,
@@ -609,9 +1801,7 @@ def run_pass1(
         if is_entry_point(filepath, root):
             entry_point_ids.add(node_id)
 
-        lines = read_lines(filepath)
         imports = extract_imports(lines, lang)
-        fan_out[node_id] = len(imports)
 
         for imp_target, lineno in imports:
             target_id = f"import:{imp_target}"
@@ -620,36 +1810,482 @@ def run_pass1(
                 evidence=[{"path": rel, "start_line": lineno, "end_line": lineno}],
                 weight=0.7,
             ))
-            fan_in[target_id] = fan_in.get(target_id, 0) + 1
 
         if verbose:
             print(f"  [pass1] {rel} ({lang}, {loc} LOC, {len(imports)} imports)")
 
-    return entry_point_ids, fan_out, fan_in
+    return entry_point_ids
+
+
+def build_module_index(paths: List[str]) -> Tuple[Set[str], Dict[str, List[str]], Dict[str, List[str]]]:
+    exact = set(paths)
+    stems: Dict[str, List[str]] = {}
+    suffixes: Dict[str, List[str]] = {}
+    for rel in paths:
+        stem = posixpath.splitext(rel)[0]
+        keys = [stem]
+        head, base = posixpath.split(stem)
+        if base in INDEX_STEMS and head:
+            keys.append(head)
+        for key in keys:
+            stems.setdefault(key, []).append(rel)
+        for full in (rel, stem):
+            parts = full.split("/")
+            for i in range(1, len(parts)):
+                suffixes.setdefault("/".join(parts[i:]), []).append(rel)
+    return exact, stems, suffixes
+
+
+def resolve_import(
+    spec: str,
+    rel: str,
+    lang: str,
+    module_index: Tuple[Set[str], Dict[str, List[str]], Dict[str, List[str]]],
+) -> str:
+    exact, stems, suffixes = module_index
+    base_dir = posixpath.dirname(rel)
+    candidates = []
+    if spec.startswith("."):
+        if lang == "python":
+            dots = len(spec) - len(spec.lstrip("."))
+            package = base_dir.split("/") if base_dir else []
+            package = package[:len(package) - (dots - 1)] if dots > 1 else package
+            rest = spec[dots:].replace(".", "/")
+            candidates.append("/".join(package + ([rest] if rest else [])))
+        else:
+            candidates.append(posixpath.normpath(posixpath.join(base_dir, spec)))
+    else:
+        if lang in ("c", "cpp", "ruby"):
+            candidates.append(posixpath.normpath(posixpath.join(base_dir, spec)))
+        norm = spec.replace("::", "/").replace("\\", "/")
+        if lang in DOTTED_IMPORT_LANGS:
+            norm = norm.replace(".", "/")
+        if lang == "rust":
+            norm = re.sub(r"^(?:crate|self|super)/", "", norm)
+        candidates.append(norm.strip("/"))
+
+    for cand in candidates:
+        if cand in exact:
+            return cand
+        matches = stems.get(cand, [])
+        if len(matches) == 1:
+            return matches[0]
+    cand = candidates[-1]
+    if "/" in cand or lang in ("c", "cpp", "ruby"):
+        matches = suffixes.get(cand, [])
+        if len(set(matches)) == 1:
+            return matches[0]
+    return ""
+
+
+def resolve_imports(state: IndexState) -> int:
+    lang_by_path = {fr.path: fr.lang for fr in state.files}
+    module_index = build_module_index(list(lang_by_path))
+    node_paths = {n.id: n.path for n in state.nodes if n.type == "file"}
+    resolved = 0
+    edges = state.edges
+    names = state.ids.names
+    imports = edges.type_code("imports")
+    dropped: Set[int] = set()
+    for i in range(len(edges)):
+        if edges.kind[i] != imports or not names[edges.target[i]].startswith("import:"):
+            continue
+        rel = node_paths.get(names[edges.source[i]], "")
+        spec = names[edges.target[i]][len("import:"):]
+        optional = spec.endswith(OPTIONAL_IMPORT_SUFFIX)
+        target = resolve_import(spec.rstrip(OPTIONAL_IMPORT_SUFFIX), rel, lang_by_path.get(rel, ""), module_index)
+        target_id = state.ids.intern(make_node_id("file", target)) if target else -1
+        if target and target_id != edges.source[i]:
+            edges.target[i] = target_id
+            resolved += 1
+        elif optional:
+            dropped.add(i)
+    edges.retain(i for i in range(len(edges)) if i not in dropped)
+    return resolved
+
+
+def pagerank_python(
+    n: int,
+    src: List[int],
+    dst: List[int],
+    weight: List[float],
+) -> List[float]:
+    out_weight = [0.0] * n
+    for s, w in zip(src, weight):
+        out_weight[s] += w
+    norm = [w / out_weight[s] for s, w in zip(src, weight)]
+    rank = [1.0 / n] * n
+    for _ in range(PAGERANK_MAX_ITER):
+        dangling = sum(rank[i] for i in range(n) if out_weight[i] == 0.0)
+        base = (1.0 - PAGERANK_DAMPING) / n + PAGERANK_DAMPING * dangling / n
+        new = [base] * n
+        for s, d, w in zip(src, dst, norm):
+            new[d] += PAGERANK_DAMPING * rank[s] * w
+        delta = sum(abs(a - b) for a, b in zip(new, rank))
+        rank = new
+        if delta < PAGERANK_TOLERANCE:
+            break
+    return rank
+
+
+def pagerank_numpy(
+    n: int,
+    src: List[int],
+    dst: List[int],
+    weight: List[float],
+) -> List[float]:
+    import numpy as np
+
+    src_a = np.asarray(src, dtype=np.int64)
+    dst_a = np.asarray(dst, dtype=np.int64)
+    w_a = np.asarray(weight, dtype=np.float64)
+    out_weight = np.bincount(src_a, weights=w_a, minlength=n)
+    norm = w_a / out_weight[src_a]
+    dangling = out_weight == 0.0
+    rank = np.full(n, 1.0 / n)
+    for _ in range(PAGERANK_MAX_ITER):
+        base = (1.0 - PAGERANK_DAMPING) / n + PAGERANK_DAMPING * rank[dangling].sum() / n
+        new = base + PAGERANK_DAMPING * np.bincount(dst_a, weights=rank[src_a] * norm, minlength=n)
+        delta = np.abs(new - rank).sum()
+        rank = new
+        if delta < PAGERANK_TOLERANCE:
+            break
+    return rank.tolist()
+
+
+def compute_centrality(state: IndexState) -> Dict[str, Dict[str, Any]]:
+    ids = [n.id for n in state.nodes]
+    index = {state.ids.index[nid]: i for i, nid in enumerate(ids)}
+    src: List[int] = []
+    dst: List[int] = []
+    weight: List[float] = []
+    edges = state.edges
+    for source, target, w in zip(edges.source, edges.target, edges.weight):
+        s = index.get(source)
+        d = index.get(target)
+        if s is None or d is None or s == d:
+            continue
+        src.append(s)
+        dst.append(d)
+        weight.append(w if w > 0 else 1e-3)
+    n = len(ids)
+    if not n:
+        return {}
+
+    try:
+        rank = pagerank_numpy(n, src, dst, weight)
+    except ImportError:
+        rank = pagerank_python(n, src, dst, weight)
+
+    in_degree = [0] * n
+    out_degree = [0] * n
+    for s, d in zip(src, dst):
+        out_degree[s] += 1
+        in_degree[d] += 1
+    return {
+        nid: {
+            "pagerank": float(f"{rank[i]:.6g}"),
+            "in_degree": in_degree[i],
+            "out_degree": out_degree[i],
+        }
+        for i, nid in enumerate(ids)
+    }
 
 
 def select_seeds(
     entry_point_ids: Set[str],
-    fan_out: Dict[str, int],
-    fan_in: Dict[str, int],
+    centrality: Dict[str, Dict[str, Any]],
     state: IndexState,
     max_files: int,
 ) -> List[str]:
-    file_nodes = [n for n in state.nodes if n.type == "file"]
+    file_nodes = [n for n in state.nodes if n.type == "file" and "skipped" not in n.tags]
 
-    entry_seeds = [n.id for n in file_nodes if n.id in entry_point_ids]
+    def score(node_id: str) -> float:
+        return centrality.get(node_id, {}).get("pagerank", 0.0)
+
+    entry_seeds = sorted(
+        (n.id for n in file_nodes if n.id in entry_point_ids),
+        key=score, reverse=True,
+    )
 
-    all_fan = {}
-    for n in file_nodes:
-        all_fan[n.id] = fan_out.get(n.id, 0) + fan_in.get(n.id, 0)
-    sorted_by_fan = sorted(all_fan.items(), key=lambda x: x[1], reverse=True)
-    threshold = max(1, len(sorted_by_fan) // 10)
-    high_fan_seeds = [nid for nid, _ in sorted_by_fan[:threshold] if nid not in entry_point_ids]
+    ranked = sorted((n.id for n in file_nodes), key=score, reverse=True)
+    threshold = max(1, len(ranked) // 10)
+    central_seeds = [nid for nid in ranked[:threshold] if nid not in entry_point_ids]
 
-    seeds = entry_seeds + high_fan_seeds
+    seeds = entry_seeds + central_seeds
     return seeds[:max_files]
 
 
+def extract_file(
+    filepath: Path,
+    lines: List[str],
+    lang: str,
+    use_ctags: bool,
+    timed: bool = False,
+) -> Dict[str, Any]:
+    if use_ctags:
+        symbols = extract_symbols_ctags(filepath)
+    else:
+        symbols = extract_symbols_regex(lines, lang)
+
+    calls: List[List[int]] = []
+    for i, sym in enumerate(symbols):
+        refs = find_symbol_references(lines, sym["name"])
+        if not refs:
+            continue
+        for j, other in enumerate(symbols):
+            if other["name"] == sym["name"] and other["type"] == sym["type"]:
+                continue
+            calls.append([i, j, refs[0]])
+
+    symbols = symbols + extract_test_calls(lines, lang)
+    tags, rule_cost = run_rules(lines, lang, symbols, timed)
+    return {
+        "symbols": symbols,
+        "calls": calls,
+        "tests": find_test_cases(lines, lang, symbols),
+        "tags": tags,
+        "rule_cost": rule_cost,
+        "refs": collect_refs(lines, symbols),
+        "minhash": [
+            minhash_signature(normalize_tokens(lines[start - 1:end]))
+            if sym["type"] in ("function", "method") else None
+            for sym, (start, end) in zip(symbols, symbol_spans(symbols, len(lines)))
+        ],
+    }
+
+
+def symbol_spans(symbols: List[Dict[str, Any]], line_count: int) -> List[Tuple[int, int]]:
+    starts = sorted({sym["line"] for sym in symbols})
+    spans = []
+    for sym in symbols:
+        start = sym["line"]
+        end = sym.get("end_line", start)
+        if end <= start:
+            k = bisect.bisect_right(starts, start)
+            end = starts[k] - 1 if k < len(starts) else line_count
+        spans.append((start, end))
+    return spans
+
+
+def normalize_tokens(lines: List[str]) -> List[str]:
+    tokens: List[str] = []
+    for line in lines:
+        stripped = line.strip()
+        if not stripped or stripped.startswith(("#", "//", "/*", "*")):
+            continue
+        for token in CODE_TOKEN_RE.findall(stripped):
+            if token in KEYWORDS or not (token[0].isalnum() or token[0] in "_\"'"):
+                tokens.append(token)
+            elif token[0].isdigit():
+                tokens.append("0")
+            elif token[0] in "\"'":
+                tokens.append("''")
+            else:
+                tokens.append("x")
+    return tokens
+
+
+def minhash_params() -> List[Tuple[int, int]]:
+    params = []
+    for i in range(MINHASH_PERMUTATIONS):
+        digest = hashlib.blake2b(f"minhash:{i}".encode(), digest_size=16).digest()
+        a = int.from_bytes(digest[:8], "little") % (MINHASH_PRIME - 1) + 1
+        b = int.from_bytes(digest[8:], "little") % MINHASH_PRIME
+        params.append((a, b))
+    return params
+
+
+MINHASH_PARAMS = minhash_params()
+
+
+def minhash_signature(tokens: List[str]) -> Optional[List[int]]:
+    if len(tokens) < MINHASH_MIN_TOKENS:
+        return None
+    shingles = {
+        int.from_bytes(hashlib.blake2b(" ".join(tokens[i:i + MINHASH_SHINGLE]).encode(), digest_size=8).digest(), "little")
+        for i in range(len(tokens) - MINHASH_SHINGLE + 1)
+    }
+    return [min((a * x + b) % MINHASH_PRIME for x in shingles) for a, b in MINHASH_PARAMS]
+
+
+def collect_refs(lines: List[str], symbols: List[Dict[str, Any]]) -> List[List[Any]]:
+    starts = sorted((sym["line"], i) for i, sym in enumerate(symbols))
+    defined_at = {(sym["line"], sym["name"]) for sym in symbols}
+    refs: List[List[Any]] = []
+    seen: Set[Tuple[str, int]] = set()
+    segment = -1
+    k = 0
+    for lineno, line in enumerate(lines, 1):
+        while k < len(starts) and starts[k][0] <= lineno:
+            segment = starts[k][1]
+            k += 1
+        for token in CALL_SITE_RE.findall(line):
+            if (token, segment) in seen or (lineno, token) in defined_at:
+                continue
+            seen.add((token, segment))
+            refs.append([token, segment, lineno])
+    return refs
+
+
+def emit_extraction(
+    state: IndexState,
+    node: NodeRecord,
+    extraction: Dict[str, Any],
+) -> int:
+    symbols = extraction.get("symbols", [])
+    rule_tags: Dict[int, List[str]] = {}
+    for segment, tag in extraction.get("tags", []):
+        rule_tags.setdefault(segment, []).append(tag)
+    test_cases = set(extraction.get("tests", [])) if "test" in node.tags else set()
+
+    sym_ids: List[str] = []
+    for i, sym in enumerate(symbols):
+        sym_name = sym["name"]
+        sym_type = "test" if i in test_cases else sym["type"]
+        sym_id = make_node_id(sym_type, node.path, sym_name)
+        sym_tags = rule_tags.get(i, [])
+
+        existing = state.get_node(sym_id)
+        if existing is not None:
+            existing.tags = [t for t in existing.tags if t not in RULE_TAGS] + sym_tags
+        state.add_node(NodeRecord(
+            id=sym_id, type=sym_type, name=sym_name,
+            path=node.path, lang=node.lang, tags=list(sym_tags),
+            confidence=sym.get("confidence", 0.7),
+            evidence=[{
+                "path": node.path,
+                "start_line": sym["line"],
+                "end_line": sym.get("end_line", sym["line"]),
+            }],
+        ))
+
+        state.add_edge(EdgeRecord(
+            source=node.id, target=sym_id, type="defines",
+            evidence=[{
+                "path": node.path,
+                "start_line": sym["line"],
+                "end_line": sym.get("end_line", sym["line"]),
+            }],
+            weight=0.9,
+        ))
+
+        sym_ids.append(sym_id)
+
+    for i, j, ref_line in extraction.get("calls", []):
+        state.add_edge(EdgeRecord(
+            source=sym_ids[i], target=sym_ids[j], type="calls",
+            evidence=[{
+                "path": node.path,
+                "start_line": ref_line,
+                "end_line": ref_line,
+            }],
+            weight=0.5,
+        ))
+
+    node.tags = [t for t in node.tags if t not in RULE_TAGS] + rule_tags.get(-1, [])
+    state.refs[node.path] = (sym_ids, extraction.get("refs", []))
+    for sym_id, signature in zip(sym_ids, extraction.get("minhash", [])):
+        if signature:
+            state.signatures[sym_id] = signature
+    return len(symbols)
+
+
+def extract_job(job: Tuple[str, str, bool, Optional[bytes], bool]) -> Optional[Tuple[Dict[str, Any], int]]:
+    path, lang, use_ctags, data, timed = job
+    filepath = Path(path)
+    if data is None:
+        if not filepath.is_file():
+            return None
+        lines = read_lines(filepath)
+    else:
+        lines = data.decode("utf-8", errors="replace").splitlines()
+    if not lines:
+        try:
+            empty = not data if data is not None else filepath.stat().st_size == 0
+        except OSError:
+            empty = False
+        return ({}, 0) if empty else None
+    if data is None or not use_ctags:
+        return extract_file(filepath, lines, lang, use_ctags, timed), len(lines)
+    with tempfile.TemporaryDirectory(prefix="archaeology-") as tmp:
+        blob_path = Path(tmp) / filepath.name
+        blob_path.write_bytes(data)
+        return extract_file(blob_path, lines, lang, use_ctags, timed), len(lines)
+
+
+class ExtractPool:
+    def __init__(self, jobs: int) -> None:
+        self.jobs = jobs
+        self.executor: Executor
+        try:
+            self.executor = ProcessPoolExecutor(max_workers=jobs)
+        except (OSError, NotImplementedError):
+            self.executor = ThreadPoolExecutor(max_workers=jobs)
+
+    def map(self, fn: Callable[[Any], Any], items: List[Any], chunksize: int = 1) -> List[Any]:
+        try:
+            return list(self.executor.map(fn, items, chunksize=chunksize))
+        except (BrokenProcessPool, OSError) as e:
+            if not isinstance(self.executor, ProcessPoolExecutor):
+                raise
+            print(f"Warning: extraction process pool failed ({e}), retrying with threads", file=sys.stderr)
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = ThreadPoolExecutor(max_workers=self.jobs)
+            return list(self.executor.map(fn, items))
+
+    def shutdown(self) -> None:
+        self.executor.shutdown()
+
+
+def extract_batch(
+    root: Path,
+    batch: List[NodeRecord],
+    file_map: Dict[str, FileRecord],
+    use_ctags: bool,
+    cache: Optional[ExtractionCache],
+    pool: Optional[ExtractPool],
+    profile: Optional[Dict[str, List[float]]] = None,
+    source: Optional[GitRevision] = None,
+) -> List[Optional[Tuple[Dict[str, Any], int]]]:
+    extractor = "ctags" if use_ctags else "regex"
+    results: List[Optional[Tuple[Dict[str, Any], int]]] = []
+    misses: List[int] = []
+    for node in batch:
+        fr = file_map.get(node.path)
+        extraction = cache.get(fr.hash, extractor, node.lang) if cache is not None and fr and fr.hash else None
+        if extraction is None:
+            misses.append(len(results))
+            results.append(None)
+        else:
+            results.append((extraction, fr.loc) if fr.loc else None)
+
+    jobs = [
+        (
+            str(root / batch[i].path), batch[i].lang, use_ctags,
+            source.read(batch[i].path) if source else None, profile is not None,
+        )
+        for i in misses
+    ]
+    if pool is not None and len(jobs) > 1:
+        extracted = pool.map(extract_job, jobs, chunksize=max(1, len(jobs) // 64))
+    else:
+        extracted = [extract_job(job) for job in jobs]
+
+    for i, result in zip(misses, extracted):
+        results[i] = result if result is None or result[1] else None
+        rule_cost = result[0].pop("rule_cost", {}) if result is not None else {}
+        if profile is not None:
+            for rule, seconds in rule_cost.items():
+                stats = profile.setdefault(rule, [0.0, 0])
+                stats[0] += seconds
+                stats[1] += 1
+        fr = file_map.get(batch[i].path)
+        if result is not None and cache is not None and fr and fr.hash:
+            cache.put(fr.hash, extractor, batch[i].lang, result[0])
+    return results
+
+
 def run_pass2(
     root: Path,
     seeds: List[str],
@@ -658,115 +2294,312 @@ def run_pass2(
     max_files: int,
     use_ctags: bool,
     verbose: bool,
-) -> None:
+    cache: Optional[ExtractionCache] = None,
+    jobs: int = 1,
+    profile: Optional[Dict[str, List[float]]] = None,
+    revision: Optional[GitRevision] = None,
+    always: Optional[List[str]] = None,
+    max_always: int = 0,
+) -> Tuple[int, int]:
     node_map = {n.id: n for n in state.nodes}
+    file_map = {fr.path: fr for fr in state.files}
     adjacency: Dict[str, List[str]] = {}
-    for edge in state.edges:
-        adjacency.setdefault(edge.source, []).append(edge.target)
-        adjacency.setdefault(edge.target, []).append(edge.source)
+    for source, target, _ in state.edges.triples():
+        adjacency.setdefault(source, []).append(target)
+        adjacency.setdefault(target, []).append(source)
 
     visited: Set[str] = set()
-    queue = [(sid, 0) for sid in seeds]
+    frontier = list(seeds)
     files_processed = 0
+    depth = 0
+    pool = ExtractPool(jobs) if jobs > 1 else None
 
-    while queue and files_processed < max_files:
-        current_id, depth = queue.pop(0)
-        if current_id in visited:
-            continue
-        visited.add(current_id)
+    def candidates_of(node_ids: List[str]) -> List[NodeRecord]:
+        candidates: List[NodeRecord] = []
+        for current_id in node_ids:
+            if current_id in visited:
+                continue
+            visited.add(current_id)
+            node = node_map.get(current_id)
+            if node and node.type == "file" and "skipped" not in node.tags:
+                candidates.append(node)
+        return candidates
+
+    def process(candidates: List[NodeRecord], limit: int) -> List[NodeRecord]:
+        processed: List[NodeRecord] = []
+        start = 0
+        while start < len(candidates) and len(processed) < limit:
+            batch = candidates[start:start + limit - len(processed)]
+            start += len(batch)
+            results = extract_batch(root, batch, file_map, use_ctags, cache, pool, profile, revision)
+            for node, result in zip(batch, results):
+                if result is None:
+                    continue
+                symbol_count = emit_extraction(state, node, result[0])
+                processed.append(node)
+                if verbose:
+                    print(f"  [pass2] {node.path} ({symbol_count} symbols)")
+        return processed
 
-        node = node_map.get(current_id)
-        if not node or node.type != "file":
+    try:
+        while frontier and files_processed < max_files:
+            processed = process(candidates_of(frontier), max_files - files_processed)
+            files_processed += len(processed)
+            if depth >= max_depth:
+                break
+            frontier = [
+                neighbor
+                for node in processed
+                for neighbor in adjacency.get(node.id, [])
+                if neighbor not in visited
+            ]
+            depth += 1
+        always = always or []
+        extra = candidates_of(always + [neighbor for node_id in always for neighbor in adjacency.get(node_id, [])])
+        extra_processed = len(process(extra, max_always))
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    return files_processed, extra_processed
+
+
+def link_cross_file_calls(
+    state: IndexState,
+    carried_refs: Optional[Dict[str, Tuple[List[str], List[List[Any]]]]] = None,
+) -> int:
+    refs_by_path = dict(carried_refs or {})
+    refs_by_path.update(state.refs)
+    node_paths = {n.id: n.path for n in state.nodes}
+    definitions: Dict[str, List[Tuple[str, str]]] = {}
+    local_names: Dict[str, Set[str]] = {}
+    for node in state.nodes:
+        if node.type != "file" and "skipped" not in node.tags:
+            definitions.setdefault(node.name, []).append((node.id, node.path))
+            local_names.setdefault(node.path, set()).add(node.name)
+
+    imported: Dict[str, Set[str]] = {}
+    kept: List[int] = []
+    for i, (source, target, edge_type) in enumerate(state.edges.triples()):
+        source_path = node_paths.get(source, "")
+        if edge_type == "imports" and target in node_paths:
+            imported.setdefault(source_path, set()).add(node_paths[target])
+        if edge_type == "calls" and (
+            source not in node_paths or target not in node_paths
+            or source_path in refs_by_path and node_paths[target] != source_path
+        ):
+            continue
+        kept.append(i)
+    state.edges.retain(kept)
+
+    linked = 0
+    for path, (sym_ids, refs) in refs_by_path.items():
+        defined_here = local_names.get(path, set())
+        imports = imported.get(path, set())
+        for token, segment, line in refs:
+            if segment < 0 or token in defined_here:
+                continue
+            candidates = [d for d in definitions.get(token, ()) if d[1] != path]
+            if not candidates:
+                continue
+            preferred = [d for d in candidates if d[1] in imports]
+            if preferred:
+                candidates, base = preferred, CROSS_CALL_IMPORTED_WEIGHT
+            elif len(candidates) <= CROSS_CALL_MAX_CANDIDATES:
+                base = CROSS_CALL_UNIMPORTED_WEIGHT
+            else:
+                continue
+            if segment >= len(sym_ids) or sym_ids[segment] not in node_paths:
+                continue
+            for target, _ in candidates:
+                if state.add_edge(EdgeRecord(
+                    source=sym_ids[segment], target=target, type="calls",
+                    evidence=[{"path": path, "start_line": line, "end_line": line}],
+                    weight=round(base / len(candidates), 3),
+                )):
+                    linked += 1
+    return linked
+
+
+def link_tests(state: IndexState) -> int:
+    edges = state.edges
+    test_paths = {n.path for n in state.nodes if n.type == "file" and "test" in n.tags}
+    node_info = {state.ids.index[n.id]: (n.type, n.path) for n in state.nodes if n.id in state.ids.index}
+    tests = edges.type_code("tests")
+    edges.retain(i for i, kind in enumerate(edges.kind) if kind != tests)
+    imports = edges.type_code("imports")
+    calls = edges.type_code("calls")
+    case_edges: List[int] = []
+    file_edges: List[int] = []
+    covered: Set[Tuple[str, str]] = set()
+    for i, (source, target, kind) in enumerate(zip(edges.source, edges.target, edges.kind)):
+        if kind != imports and kind != calls or source not in node_info or target not in node_info:
+            continue
+        source_type, source_path = node_info[source]
+        target_type, target_path = node_info[target]
+        if source_path not in test_paths or target_path in test_paths:
             continue
+        if kind == imports and source_type == "file" and target_type == "file":
+            file_edges.append(i)
+        elif kind == calls and source_type == "test":
+            case_edges.append(i)
+            covered.add((source_path, target_path))
+
+    linked = 0
+    for i in case_edges + file_edges:
+        source, target = edges.source[i], edges.target[i]
+        if edges.kind[i] == imports and (node_info[source][1], node_info[target][1]) in covered:
+            continue
+        if edges.insert(source, target, tests, edges.weight[i], edges.evidence(i)):
+            linked += 1
+    return linked
 
-        filepath = root / node.path
-        if not filepath.is_file():
+
+def detect_duplicates(state: IndexState) -> int:
+    fresh_paths = set(state.refs)
+    node_map = {n.id: n for n in state.nodes}
+    for node in state.nodes:
+        if "duplicate_logic" in node.tags:
+            node.tags.remove("duplicate_logic")
+    state.edges.retain(
+        i for i, (source, target, edge_type) in enumerate(state.edges.triples())
+        if edge_type != "duplicates" or (
+            source in node_map and target in node_map
+            and node_map[source].path not in fresh_paths and node_map[target].path not in fresh_paths
+        )
+    )
+
+    rows = MINHASH_PERMUTATIONS // MINHASH_BANDS
+    buckets: Dict[Tuple[int, Tuple[int, ...]], List[str]] = {}
+    for sym_id in sorted(state.signatures):
+        if sym_id not in node_map:
             continue
+        signature = state.signatures[sym_id]
+        for band in range(MINHASH_BANDS):
+            key = (band, tuple(signature[band * rows:(band + 1) * rows]))
+            buckets.setdefault(key, []).append(sym_id)
+
+    candidates: Set[Tuple[str, str]] = set()
+    for members in buckets.values():
+        if len(members) < 2 or len(members) > DUPLICATE_MAX_BUCKET:
+            continue
+        for i, a in enumerate(members):
+            for b in members[i + 1:]:
+                candidates.add((a, b))
+
+    found = 0
+    for a, b in sorted(candidates):
+        sig_a, sig_b = state.signatures[a], state.signatures[b]
+        similarity = sum(1 for x, y in zip(sig_a, sig_b) if x == y) / MINHASH_PERMUTATIONS
+        if similarity < DUPLICATE_THRESHOLD:
+            continue
+        if state.add_edge(EdgeRecord(source=a, target=b, type="duplicates", weight=round(similarity, 3))):
+            found += 1
 
-        lines = read_lines(filepath)
-        if not lines:
+    for source, target, edge_type in state.edges.triples():
+        if edge_type != "duplicates":
             continue
+        for sym_id in (source, target):
+            if "duplicate_logic" not in node_map[sym_id].tags:
+                node_map[sym_id].tags.append("duplicate_logic")
+    return found
 
-        if use_ctags:
-            symbols = extract_symbols_ctags(filepath)
-        else:
-            symbols = extract_symbols_regex(lines, node.lang)
-
-        method_count = 0
-        symbol_names = []
-        for sym in symbols:
-            sym_name = sym["name"]
-            sym_type = sym["type"]
-            sym_id = make_node_id(sym_type, node.path, sym_name)
-
-            sym_tags: List[str] = []
-            if sym_type in ("class",):
-                class_methods = sum(
-                    1 for s in symbols if s["type"] in ("method", "function")
-                )
-                if class_methods > 20:
-                    sym_tags.append("god_object")
-                method_count += 1
 
-            state.add_node(NodeRecord(
-                id=sym_id, type=sym_type, name=sym_name,
-                path=node.path, lang=node.lang, tags=sym_tags,
-                confidence=sym.get("confidence", 0.7),
-                evidence=[{
-                    "path": node.path,
-                    "start_line": sym["line"],
-                    "end_line": sym.get("end_line", sym["line"]),
-                }],
-            ))
+def directory_chain(path: str) -> List[str]:
+    parts = path.split("/")[:-1]
+    return ["."] + ["/".join(parts[:i]) for i in range(1, len(parts) + 1)]
 
+
+def build_rollups(state: IndexState, centrality: Optional[Dict[str, Dict[str, Any]]] = None) -> int:
+    loc_by_path = {fr.path: fr.loc for fr in state.files}
+    file_nodes = [n for n in state.nodes if n.type == "file"]
+    chains = {n.path: directory_chain(n.path) for n in file_nodes}
+    dirs: Dict[str, Dict[str, Any]] = {}
+    packages: Set[str] = set()
+    mass: Dict[str, float] = {}
+    for node in file_nodes:
+        if node.name in PACKAGE_MANIFESTS:
+            packages.add(chains[node.path][-1])
+        for d in chains[node.path]:
+            m = dirs.setdefault(d, {"files": 0, "loc": 0, "symbols": 0, "langs": {}, "tags": {}, "imports": {}})
+            m["files"] += 1
+            m["loc"] += loc_by_path.get(node.path, 0)
+            if node.lang:
+                m["langs"][node.lang] = m["langs"].get(node.lang, 0) + 1
+    for node in state.nodes:
+        chain = chains.get(node.path)
+        if chain is None or node.type in ROLLUP_TYPES:
+            continue
+        pagerank = centrality.get(node.id, {}).get("pagerank", 0.0) if centrality else 0.0
+        for d in chain:
+            m = dirs[d]
+            mass[d] = mass.get(d, 0.0) + pagerank
+            if node.type != "file":
+                m["symbols"] += 1
+            for tag in node.tags:
+                m["tags"][tag] = m["tags"].get(tag, 0) + 1
+
+    def rollup_id(d: str) -> str:
+        return make_node_id("package" if d in packages else "module", d)
+
+    for source, target, edge_type in state.edges.triples():
+        if edge_type != "imports" or not source.startswith("file:") or not target.startswith("file:"):
+            continue
+        src_chain = chains.get(source[len("file:"):])
+        dst_chain = chains.get(target[len("file:"):])
+        if src_chain is None or dst_chain is None:
+            continue
+        common = 0
+        while common < min(len(src_chain), len(dst_chain)) and src_chain[common] == dst_chain[common]:
+            common += 1
+        for a in src_chain[common:]:
+            counts = dirs[a]["imports"]
+            for b in dst_chain[common:]:
+                counts[rollup_id(b)] = counts.get(rollup_id(b), 0) + 1
+
+    for d in sorted(dirs):
+        m = dirs[d]
+        langs = sorted(m["langs"].items(), key=lambda x: (-x[1], x[0]))
+        m["langs"] = dict(langs)
+        m["tags"] = dict(sorted(m["tags"].items()))
+        m["imports"] = dict(sorted(m["imports"].items()))
+        mix = ", ".join(f"{lang} {count}" for lang, count in langs[:3])
+        state.add_node(NodeRecord(
+            id=rollup_id(d), type="package" if d in packages else "module",
+            name=posixpath.basename(d) or d, path=d, lang=langs[0][0] if langs else "",
+            summary=f"{m['files']} files, {m['loc']} LOC" + (f" ({mix})" if mix else ""),
+            confidence=1.0, metrics=m,
+        ))
+        if d != ".":
             state.add_edge(EdgeRecord(
-                source=current_id, target=sym_id, type="defines",
-                evidence=[{
-                    "path": node.path,
-                    "start_line": sym["line"],
-                    "end_line": sym.get("end_line", sym["line"]),
-                }],
-                weight=0.9,
+                source=rollup_id(posixpath.dirname(d) or "."), target=rollup_id(d), type="contains", weight=1.0,
             ))
-
-            symbol_names.append((sym_name, sym_id))
-
-        for sym_name, sym_id in symbol_names:
-            refs = find_symbol_references(lines, sym_name)
-            for other_name, other_id in symbol_names:
-                if other_id == sym_id:
-                    continue
-                for ref_line in refs:
-                    if ref_line != 0:
-                        state.add_edge(EdgeRecord(
-                            source=sym_id, target=other_id, type="calls",
-                            evidence=[{
-                                "path": node.path,
-                                "start_line": ref_line,
-                                "end_line": ref_line,
-                            }],
-                            weight=0.5,
-                        ))
-                        break
-
-        if node.path and count_lines(filepath) > 500 and method_count > 20:
-            if "god_object" not in node.tags:
-                node.tags.append("god_object")
-
-        files_processed += 1
-        if verbose:
-            print(f"  [pass2] {node.path} ({len(symbols)} symbols)")
-
-        if depth < max_depth:
-            for neighbor in adjacency.get(current_id, []):
-                if neighbor not in visited:
-                    queue.append((neighbor, depth + 1))
+        total = sum(m["imports"].values())
+        for target, count in m["imports"].items():
+            state.add_edge(EdgeRecord(
+                source=rollup_id(d), target=target, type="imports", weight=round(count / total, 3),
+            ))
+    for node in file_nodes:
+        state.add_edge(EdgeRecord(
+            source=rollup_id(chains[node.path][-1]), target=node.id, type="contains", weight=1.0,
+        ))
+    if centrality is not None:
+        importers: Dict[str, int] = {}
+        for m in dirs.values():
+            for target in m["imports"]:
+                importers[target] = importers.get(target, 0) + 1
+        for d, m in dirs.items():
+            centrality[rollup_id(d)] = {
+                "pagerank": float(f"{mass.get(d, 0.0):.6g}"),
+                "in_degree": importers.get(rollup_id(d), 0),
+                "out_degree": len(m["imports"]),
+            }
+    return len(dirs)
 
 
 def build_indexes(state: IndexState) -> Tuple[Dict[str, Any], Dict[str, Any]]:
     symbol_to_node: Dict[str, List[str]] = {}
     for node in state.nodes:
-        if node.type != "file":
+        if node.type != "file" and node.type not in ROLLUP_TYPES:
             symbol_to_node.setdefault(node.name, []).append(node.id)
 
     path_to_file: Dict[str, str] = {}
@@ -777,6 +2610,79 @@ def build_indexes(state: IndexState) -> Tuple[Dict[str, Any], Dict[str, Any]]:
     return symbol_to_node, path_to_file
 
 
+def build_reverse_deps(state: IndexState) -> Dict[str, Any]:
+    known = {n.id for n in state.nodes}
+    dependents: Dict[str, List[List[str]]] = {}
+    defines: Dict[str, List[str]] = {}
+    for source, target, edge_type in state.edges.triples():
+        if edge_type not in DEPENDENCY_EDGE_TYPES or source not in known or target not in known:
+            continue
+        if source == target:
+            continue
+        dependents.setdefault(target, []).append([source, edge_type])
+        if edge_type == "defines":
+            defines.setdefault(source, []).append(target)
+    return {
+        "types": list(DEPENDENCY_EDGE_TYPES),
+        "nodes": {n.id: [n.name, n.type, n.path, n.lang] for n in state.nodes},
+        "dependents": dependents,
+        "defines": defines,
+        "test_files": sorted(n.id for n in state.nodes if n.type == "file" and "test" in n.tags),
+    }
+
+
+def write_line_offsets(offsets_dir: Path, state: IndexState) -> None:
+    for file_hash, offsets in state.line_offsets.items():
+        path = offsets_dir / file_hash[:2] / f"{file_hash}.bin"
+        if path.exists():
+            continue
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".tmp")
+        with open(tmp, "wb") as f:
+            offsets.tofile(f)
+        os.replace(tmp, path)
+
+
+def write_refs(refs_dir: Path, state: IndexState) -> None:
+    hashes = {fr.path: fr.hash for fr in state.files}
+    for rel, (sym_ids, refs) in state.refs.items():
+        file_hash = hashes.get(rel)
+        if not file_hash:
+            continue
+        path = refs_dir / file_hash[:2] / f"{file_hash}.json"
+        if path.exists():
+            continue
+        atomic_write(path, [json.dumps({
+            "path": rel,
+            "symbols": sym_ids,
+            "refs": [ref for ref in refs if ref[1] >= 0],
+        })])
+
+
+def load_carried_refs(refs_dir: Path, state: IndexState) -> Dict[str, Tuple[List[str], List[List[Any]]]]:
+    carried: Dict[str, Tuple[List[str], List[List[Any]]]] = {}
+    for fr in state.files:
+        if fr.path in state.refs or not fr.hash:
+            continue
+        stored = load_json(refs_dir / fr.hash[:2] / f"{fr.hash}.json")
+        if not stored:
+            continue
+        old_path = stored.get("path", fr.path)
+        sym_ids = [rebase_id(sym_id, old_path, fr.path) for sym_id in stored.get("symbols", [])]
+        carried[fr.path] = (sym_ids, stored.get("refs", []))
+    return carried
+
+
+def prune_hashed_files(store_dir: Path, state: IndexState) -> None:
+    live = {fr.hash for fr in state.files}
+    for path in store_dir.glob("*/*"):
+        if path.stem not in live:
+            try:
+                path.unlink()
+            except OSError:
+                pass
+
+
 def write_output(
     output_dir: Path,
     state: IndexState,
@@ -784,41 +2690,315 @@ def write_output(
     path_to_file: Dict[str, Any],
     root: Path,
     elapsed: float,
-) -> None:
+    head: str = "",
+    prev: Optional[PreviousGraph] = None,
+    compact: bool = False,
+    centrality: Optional[Dict[str, Dict[str, Any]]] = None,
+    hash_algo: str = "sha256",
+) -> Tuple[str, Path]:
     output_dir.mkdir(parents=True, exist_ok=True)
-    indexes_dir = output_dir / "indexes"
-    indexes_dir.mkdir(parents=True, exist_ok=True)
-    summaries_dir = output_dir / "summaries"
-    summaries_dir.mkdir(parents=True, exist_ok=True)
 
-    with open(output_dir / "nodes.jsonl", "w") as f:
-        for node in state.nodes:
-            f.write(json.dumps(node.to_dict()) + "\n")
-
-    with open(output_dir / "edges.jsonl", "w") as f:
-        for edge in state.edges:
-            f.write(json.dumps(edge.to_dict()) + "\n")
-
-    with open(output_dir / "files.jsonl", "w") as f:
-        for fr in state.files:
-            f.write(json.dumps(fr.to_dict()) + "\n")
+    nodes = [node.to_dict() for node in state.nodes]
+    edges = [edge.to_dict() for edge in state.edges]
+    files = [fr.to_dict() for fr in state.files]
+    now = datetime.now(timezone.utc).isoformat()
 
-    with open(output_dir / "symbol_to_node.json", "w") as f:
-        json.dump(symbol_to_node, f, indent=2)
+    journal_size, base_size = journal_bytes(output_dir)
+    if prev is None or not current_version(output_dir):
+        compact = True
+    elif prev.data.journal_commits >= MAX_JOURNAL_COMMITS or journal_size > base_size * COMPACT_RATIO:
+        compact = True
+
+    if compact:
+        version = publish_snapshot(output_dir, nodes, edges, files, symbol_to_node, path_to_file)
+        journal_ops = 0
+        journal_offset = 0
+        written = f"snapshot {version}"
+    else:
+        ops = diff_ops(
+            prev.data.nodes, nodes, prev.data.edges, edges, prev.data.files, files,
+        )
+        version = current_version(output_dir)
+        journal_ops = len(ops)
+        journal_offset = append_journal(
+            output_dir, ops, {"indexed_at": now, "ops": len(ops)}, journal_limit(output_dir, *read_current(output_dir)),
+        )
+        written = f"journal +{len(ops)} ops on snapshot {version}"
 
-    with open(output_dir / "path_to_file.json", "w") as f:
-        json.dump(path_to_file, f, indent=2)
+    view = stage_view(output_dir, version)
+    indexes_dir = view / "indexes"
+    write_json(indexes_dir / "centrality.json", centrality or {})
+    write_json(indexes_dir / "reverse_deps.json", build_reverse_deps(state))
+    write_search_index(indexes_dir / SEARCH_DIR, state.nodes)
+    write_line_offsets(output_dir / LINE_OFFSETS_DIR, state)
+    write_refs(output_dir / REFS_DIR, state)
 
     meta = {
         "root": str(root.resolve()),
-        "indexed_at": datetime.now(timezone.utc).isoformat(),
+        "indexed_at": now,
         "file_count": len(state.files),
         "node_count": len(state.nodes),
         "edge_count": len(state.edges),
         "elapsed_seconds": round(elapsed, 2),
+        "git_head": head,
+        "snapshot": version,
+        "journal_ops": journal_ops,
+        "journal_offset": journal_offset,
+        "hash_algo": hash_algo,
     }
-    with open(output_dir / "meta.json", "w") as f:
-        json.dump(meta, f, indent=2)
+    write_json(view / META_FILE, meta)
+    return written, view
+
+
+def publish_output(output_dir: Path, view: Path, state: IndexState) -> str:
+    name = publish_view(output_dir, view)
+    published = view.parent / name
+    relative = published.relative_to(output_dir).as_posix()
+    overview = (published / "KG.md").read_text()
+    atomic_write(output_dir / "KG.md", [overview.replace("](summaries/", f"]({relative}/summaries/")])
+    prune_hashed_files(output_dir / LINE_OFFSETS_DIR, state)
+    prune_hashed_files(output_dir / REFS_DIR, state)
+    shutil.rmtree(output_dir / QUERY_CACHE_DIR, ignore_errors=True)
+    return name
+
+
+def module_of(path: str) -> str:
+    return posixpath.dirname(path) or "."
+
+
+def module_slug(module: str) -> str:
+    return "_root" if module == "." else module.replace("/", ".")
+
+
+def file_counts(items: Dict[str, int]) -> str:
+    return ", ".join(f"{k} ({v})" for k, v in sorted(items.items(), key=lambda x: (-x[1], x[0])))
+
+
+def module_fingerprint(
+    members: List[FileRecord],
+    symbols: Dict[str, List[NodeRecord]],
+    imports: Dict[str, List[str]],
+    file_nodes: Dict[str, NodeRecord],
+    entry_point_ids: Set[str],
+) -> str:
+    digest = hashlib.sha256(SUMMARY_VERSION.encode())
+    for fr in members:
+        file_node = file_nodes.get(fr.path)
+        parts = [
+            fr.path, fr.hash, str(fr.loc), str(make_node_id("file", fr.path) in entry_point_ids),
+            ",".join(sorted(file_node.tags)) if file_node else "",
+            ",".join(sorted(imports.get(fr.path, []))),
+        ]
+        parts.extend(f"{n.id}:{','.join(sorted(n.tags))}" for n in symbols.get(fr.path, []))
+        digest.update("\0".join(parts).encode() + b"\n")
+    return digest.hexdigest()
+
+
+def render_module_summary(
+    module: str,
+    members: List[FileRecord],
+    symbols: Dict[str, List[NodeRecord]],
+    imports: Dict[str, List[str]],
+    file_nodes: Dict[str, NodeRecord],
+    entry_point_ids: Set[str],
+) -> str:
+    langs: Dict[str, int] = {}
+    for fr in members:
+        langs[fr.lang] = langs.get(fr.lang, 0) + 1
+    module_symbols = [n for fr in members for n in symbols.get(fr.path, [])]
+    lines = [
+        f"# Module `{module}`",
+        "",
+        f"- **Files**: {len(members)}",
+        f"- **LOC**: {sum(fr.loc for fr in members)}",
+        f"- **Languages**: {file_counts(langs)}",
+        f"- **Symbols**: {len(module_symbols)}",
+    ]
+
+    entries = [fr.path for fr in members if make_node_id("file", fr.path) in entry_point_ids]
+    if entries:
+        lines += ["", "## Entry Points", ""]
+        lines += [f"- `{path}`" for path in entries]
+
+    lines += ["", "## Files", "", "| File | Lang | LOC | Symbols | Tags |", "|---|---|---|---|---|"]
+    for fr in sorted(members, key=lambda f: (-f.loc, f.path))[:SUMMARY_TOP_FILES]:
+        file_node = file_nodes.get(fr.path)
+        tags = ", ".join(f"`{t}`" for t in file_node.tags) if file_node else ""
+        lines.append(f"| `{fr.path}` | {fr.lang} | {fr.loc} | {len(symbols.get(fr.path, []))} | {tags} |")
+    if len(members) > SUMMARY_TOP_FILES:
+        lines.append(f"\n{len(members) - SUMMARY_TOP_FILES} smaller files omitted.")
+
+    if module_symbols:
+        ranked = sorted(
+            module_symbols,
+            key=lambda n: (-len(n.tags), SUMMARY_SYMBOL_TYPES.index(n.type), n.path, n.name),
+        )
+        lines += ["", "## Key Symbols", ""]
+        for n in ranked[:SUMMARY_TOP_SYMBOLS]:
+            line = n.evidence[0]["start_line"] if n.evidence else 0
+            tags = f" — {', '.join(f'`{t}`' for t in n.tags)}" if n.tags else ""
+            lines.append(f"- {n.type} `{n.name}` (`{n.path}:{line}`){tags}")
+
+    depends = sorted({
+        module_of(target) for fr in members for target in imports.get(fr.path, [])
+    } - {module})
+    if depends:
+        lines += ["", "## Depends On", ""]
+        lines += [f"- [`{dep}`]({module_slug(dep)}.md)" for dep in depends]
+
+    tagged: Dict[str, List[str]] = {}
+    for fr in members:
+        file_node = file_nodes.get(fr.path)
+        for n in ([file_node] if file_node else []) + symbols.get(fr.path, []):
+            for tag in n.tags:
+                tagged.setdefault(tag, []).append(n.name if n.type == "file" else f"{n.path}:{n.name}")
+    if tagged:
+        lines += ["", "## Tags", ""]
+        for tag, names in sorted(tagged.items()):
+            shown = ", ".join(f"`{name}`" for name in names[:5])
+            more = f" and {len(names) - 5} more" if len(names) > 5 else ""
+            lines.append(f"- `{tag}` ({len(names)}): {shown}{more}")
+    return "\n".join(lines) + "\n"
+
+
+def render_overview(
+    state: IndexState,
+    modules: Dict[str, List[FileRecord]],
+    symbols: Dict[str, List[NodeRecord]],
+    entry_point_ids: Set[str],
+    centrality: Dict[str, Dict[str, Any]],
+    history: Optional[HistoryIndex],
+) -> str:
+    langs: Dict[str, List[int]] = {}
+    for fr in state.files:
+        stats = langs.setdefault(fr.lang, [0, 0])
+        stats[0] += 1
+        stats[1] += fr.loc
+    symbol_count = sum(len(v) for v in symbols.values())
+    lines = [
+        "# Knowledge Graph Overview",
+        "",
+        f"{len(state.files)} files, {sum(fr.loc for fr in state.files)} LOC, "
+        f"{symbol_count} symbols, {len(modules)} modules.",
+        "",
+        "## Languages",
+        "",
+        "| Language | Files | LOC |",
+        "|---|---|---|",
+    ]
+    for lang, (count, loc) in sorted(langs.items(), key=lambda x: (-x[1][1], x[0])):
+        lines.append(f"| {lang} | {count} | {loc} |")
+
+    entries = sorted(node_id[len("file:"):] for node_id in entry_point_ids)
+    if entries:
+        lines += ["", "## Entry Points", ""]
+        lines += [f"- `{path}`" for path in entries[:OVERVIEW_TOP * 2]]
+        if len(entries) > OVERVIEW_TOP * 2:
+            lines.append(f"- … {len(entries) - OVERVIEW_TOP * 2} more")
+
+    lines += ["", "## Modules", "", "| Module | Files | LOC | Symbols |", "|---|---|---|---|"]
+    for module, members in sorted(modules.items()):
+        module_symbols = sum(len(symbols.get(fr.path, [])) for fr in members)
+        lines.append(
+            f"| [`{module}`](summaries/{module_slug(module)}.md) | {len(members)} | "
+            f"{sum(fr.loc for fr in members)} | {module_symbols} |"
+        )
+
+    file_ids = [make_node_id("file", fr.path) for fr in state.files]
+    ranked = sorted(
+        (i for i in file_ids if i in centrality),
+        key=lambda i: (-centrality[i]["pagerank"], i),
+    )[:OVERVIEW_TOP]
+    if ranked:
+        lines += ["", "## Hotspots", "", "| File | PageRank | Fan-in | Fan-out |", "|---|---|---|---|"]
+        for node_id in ranked:
+            c = centrality[node_id]
+            lines.append(f"| `{node_id[len('file:'):]}` | {c['pagerank']:.4f} | {c['in_degree']} | {c['out_degree']} |")
+
+    if history is not None and history.files:
+        live = {fr.path for fr in state.files}
+        churn = sorted(
+            ((path, stats) for path, stats in history.files.items() if path in live),
+            key=lambda x: (-x[1]["commits"], x[0]),
+        )[:OVERVIEW_TOP]
+        if churn:
+            lines += ["", "## Churn", "", "| File | Commits | Added | Deleted |", "|---|---|---|---|"]
+            for path, stats in churn:
+                lines.append(f"| `{path}` | {stats['commits']} | {stats['added']} | {stats['deleted']} |")
+
+    tagged: Dict[str, List[NodeRecord]] = {}
+    for node in state.nodes:
+        for tag in node.tags:
+            tagged.setdefault(tag, []).append(node)
+    if tagged:
+        lines += ["", "## Tags", "", "| Tag | Nodes | Examples |", "|---|---|---|"]
+        for tag, nodes in sorted(tagged.items(), key=lambda x: (-len(x[1]), x[0])):
+            examples = ", ".join(f"`{n.path}`" if n.type == "file" else f"`{n.path}:{n.name}`" for n in nodes[:3])
+            lines.append(f"| `{tag}` | {len(nodes)} | {examples} |")
+    return "\n".join(lines) + "\n"
+
+
+def write_summaries(
+    view: Path,
+    previous_view: Optional[Path],
+    state: IndexState,
+    entry_point_ids: Set[str],
+    centrality: Dict[str, Dict[str, Any]],
+    history: Optional[HistoryIndex],
+    full: bool = False,
+) -> Tuple[int, int]:
+    summaries_dir = view / "summaries"
+    summaries_dir.mkdir(parents=True, exist_ok=True)
+    previous = {} if full or previous_view is None else load_json(previous_view / "indexes" / SUMMARY_INDEX_FILE)
+
+    modules: Dict[str, List[FileRecord]] = {}
+    for fr in sorted(state.files, key=lambda f: f.path):
+        modules.setdefault(module_of(fr.path), []).append(fr)
+    file_nodes: Dict[str, NodeRecord] = {}
+    symbols: Dict[str, List[NodeRecord]] = {}
+    for node in state.nodes:
+        if node.type == "file":
+            file_nodes[node.path] = node
+        elif node.type in SUMMARY_SYMBOL_TYPES:
+            symbols.setdefault(node.path, []).append(node)
+    imports: Dict[str, List[str]] = {}
+    for source, target, edge_type in state.edges.triples():
+        if edge_type == "imports" and target.startswith("file:"):
+            imports.setdefault(source[len("file:"):], []).append(target[len("file:"):])
+
+    fingerprints: Dict[str, str] = {}
+    regenerated = 0
+    for module, members in modules.items():
+        fingerprint = module_fingerprint(members, symbols, imports, file_nodes, entry_point_ids)
+        fingerprints[module] = fingerprint
+        path = summaries_dir / f"{module_slug(module)}.md"
+        if previous.get(module) == fingerprint and previous_view is not None and reuse_file(
+            previous_view / "summaries" / path.name, path,
+        ):
+            continue
+        atomic_write(path, [render_module_summary(
+            module, members, symbols, imports, file_nodes, entry_point_ids,
+        )])
+        regenerated += 1
+
+    overview = render_overview(state, modules, symbols, entry_point_ids, centrality, history)
+    atomic_write(view / "KG.md", [overview])
+    atomic_write(summaries_dir / "overview.md", [overview.replace("](summaries/", "](")])
+    write_json(view / "indexes" / SUMMARY_INDEX_FILE, fingerprints)
+    return regenerated, len(modules)
+
+
+def reuse_file(source: Path, target: Path) -> bool:
+    try:
+        os.link(source, target)
+        return True
+    except OSError:
+        pass
+    try:
+        shutil.copyfile(source, target)
+        return True
+    except OSError:
+        return False
 
 
 def main() -> None:
@@ -845,6 +3025,16 @@ def main() -> None:
         metavar="REF",
         help="Only index files changed since git ref (commit, tag, branch)",
     )
+    parser.add_argument(
+        "--rev",
+        metavar="REF",
+        help="Index the tree of a git revision read from the object store, without checking it out",
+    )
+    parser.add_argument(
+        "--compact",
+        action="store_true",
+        help="Publish a new base snapshot instead of appending to the delta journal",
+    )
     parser.add_argument(
         "--max-files",
         type=int,
@@ -857,6 +3047,67 @@ def main() -> None:
         default=3,
         help="Maximum BFS depth in pass 2 (default: 3)",
     )
+    parser.add_argument(
+        "--max-test-files",
+        type=int,
+        default=200,
+        help="Maximum test files and their imports to deep-analyze in pass 2 beyond --max-files (default: 200)",
+    )
+    parser.add_argument(
+        "--max-file-kb",
+        type=int,
+        default=DEFAULT_MAX_FILE_KB,
+        help=f"Skip files larger than this many KB, 0 for no limit (default: {DEFAULT_MAX_FILE_KB})",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        help="Persistent extraction cache directory (default: $XDG_CACHE_HOME/code-archaeology/extract)",
+    )
+    parser.add_argument(
+        "--cache-max-mb",
+        type=int,
+        default=DEFAULT_CACHE_MAX_MB,
+        help=f"Extraction cache size limit in MB, evicted LRU (default: {DEFAULT_CACHE_MAX_MB})",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Disable the persistent extraction cache",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Worker threads for the non-git directory walk and processes for pass 2 extraction (default: CPU count)",
+    )
+    parser.add_argument(
+        "--no-history",
+        action="store_true",
+        help="Skip the git history churn and co-change pass",
+    )
+    parser.add_argument(
+        "--history-since",
+        default="",
+        metavar="DATE",
+        help="Only read git history after this date (any git --since value)",
+    )
+    parser.add_argument(
+        "--history-max-commits",
+        type=int,
+        default=DEFAULT_HISTORY_MAX_COMMITS,
+        help=f"Maximum commits read per history pass, 0 for no cap (default: {DEFAULT_HISTORY_MAX_COMMITS})",
+    )
+    parser.add_argument(
+        "--co-change-min-support",
+        type=int,
+        default=DEFAULT_CO_CHANGE_MIN_SUPPORT,
+        help=f"Commits two files must share to get a co_changes edge (default: {DEFAULT_CO_CHANGE_MIN_SUPPORT})",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Print per-rule anti-pattern detection cost after pass 2",
+    )
     parser.add_argument(
         "--verbose",
         action="store_true",
@@ -875,48 +3126,142 @@ def main() -> None:
     print(f"Indexing: {root}")
     print(f"Output:   {output_dir}")
 
+    source: Optional[GitRevision] = None
+    sizes: Optional[Dict[str, int]] = None
+    if args.rev:
+        commit = git_head(root, args.rev)
+        source = GitRevision(root, commit) if commit else None
+        git_files = source.list_files() if source else None
+        if git_files is None:
+            print(f"Error: cannot read git revision '{args.rev}'", file=sys.stderr)
+            sys.exit(1)
+        print(f"Revision: {args.rev} ({commit[:12]})")
+        blob_ids = source.blob_ids()
+        all_files = git_files
+        head = commit
+    else:
+        git_files = list_files_git(root)
+        blob_ids = git_blob_ids(root) if git_files else None
+        if git_files:
+            all_files = git_files
+        else:
+            walker = DirWalker(root, load_file_policy(root, args.max_file_kb).ignore, args.jobs)
+            all_files = walker.list_files()
+            sizes = walker.entries
+        head = git_head(root) if git_files else ""
+    prev = PreviousGraph() if args.full else load_previous_graph(output_dir)
+    rev = head if source else ""
+
+    scope: Optional[Set[str]] = None
+    renames: Dict[str, str] = {}
     if args.since_git:
-        changed = git_changed_files(root, args.since_git)
-        if changed is None:
+        changes = git_changes(root, args.since_git, rev)
+        if changes is None:
             print(f"Warning: git diff failed for ref '{args.since_git}', falling back to full scan", file=sys.stderr)
-            all_files = list_files_git(root) or list_files_walk(root)
         else:
-            all_files = [f for f in changed if f.is_file()]
-            print(f"Scoping to {len(all_files)} files changed since {args.since_git}")
-    else:
-        all_files = list_files_git(root) or list_files_walk(root)
-
-    existing_hashes = {} if args.full else load_existing_hashes(output_dir)
+            changed, renames = changes
+            scope = {
+                f.relative_to(root).as_posix() for f in changed
+                if (f.relative_to(root).as_posix() in source.entries if source else f.is_file())
+            }
+            print(f"Scoping to {len(scope)} files changed since {args.since_git} ({len(renames)} renames)")
+    elif prev.meta.get("git_head") and git_files:
+        changes = git_changes(root, prev.meta["git_head"], rev)
+        if changes is not None:
+            renames = changes[1]
     use_ctags = has_ctags()
     if use_ctags:
         print("Symbol extraction: ctags (confidence: 0.9)")
     else:
         print("Symbol extraction: regex fallback (confidence: 0.7)")
 
+    cache = None
+    if not args.no_cache:
+        cache_dir = Path(args.cache_dir) if args.cache_dir else default_cache_dir()
+        cache = ExtractionCache(cache_dir, args.cache_max_mb * 1024 * 1024)
+
     state = IndexState()
 
     print(f"\nPass 1: Coarse inventory ({len(all_files)} files)...")
-    entry_point_ids, fan_out, fan_in = run_pass1(
-        root, all_files, existing_hashes, args.full, state, args.verbose,
+    entry_point_ids = run_pass1(
+        root, all_files, prev, args.full, state, args.verbose,
+        blob_ids, renames, scope, load_file_policy(root, args.max_file_kb, source), source, sizes,
     )
-    file_count = len([n for n in state.nodes if n.type == "file"])
+    file_count = len(state.files)
     print(f"  Found {file_count} source files, {len(entry_point_ids)} entry points")
+    if state.skipped:
+        reasons = ", ".join(f"{k}={v}" for k, v in sorted(state.skipped.items()))
+        print(f"  Skipped by file policy: {reasons}")
 
-    seeds = select_seeds(entry_point_ids, fan_out, fan_in, state, args.max_files)
+    resolved = resolve_imports(state)
+    print(f"  Resolved {resolved} imports to repository files")
+
+    seeds = select_seeds(entry_point_ids, compute_centrality(state), state, args.max_files)
+    test_files = [n.id for n in state.nodes if n.type == "file" and "test" in n.tags and "skipped" not in n.tags]
     print(f"\nPass 2: Targeted deepening ({len(seeds)} seeds, max depth {args.max_depth})...")
-    run_pass2(root, seeds, state, args.max_depth, args.max_files, use_ctags, args.verbose)
+    profile: Optional[Dict[str, List[float]]] = {} if args.profile else None
+    deepened, extra_tests = run_pass2(
+        root, seeds, state, args.max_depth, args.max_files, use_ctags, args.verbose, cache, args.jobs, profile,
+        source, test_files, args.max_test_files,
+    )
+    print(f"  Extracted {deepened} files from the seeds")
+    print(f"  Extracted {extra_tests} test files and their imports not reached from the seeds")
+    if source is not None:
+        source.close()
+    if cache is not None:
+        evicted = cache.prune()
+        print(f"  Extraction cache: {cache.hits} hits, {cache.misses} misses, {evicted} evicted")
+
+    if profile:
+        print("  Rule cost (extracted files only):")
+        for rule, (seconds, files) in sorted(profile.items(), key=lambda x: -x[1][0]):
+            print(f"    {rule:<24} {seconds * 1000:9.1f} ms  {files} files")
+
+    linked = link_cross_file_calls(state, load_carried_refs(output_dir / REFS_DIR, state))
+    print(f"  Linked {linked} cross-file calls")
+    tested = link_tests(state)
+    print(f"  Linked {tested} tests edges")
+    duplicates = detect_duplicates(state)
+    print(f"  Found {duplicates} near-duplicate function pairs")
+
+    centrality = compute_centrality(state)
+    rollups = build_rollups(state, centrality)
+    print(f"  Rolled up {rollups} directories")
+    history = None
+    if head and not args.no_history:
+        history_path = prev.view / "indexes" / HISTORY_FILE if prev.view is not None else None
+        history = HistoryIndex() if history_path is None else HistoryIndex.from_dict(load_json(history_path))
+        live_paths = {fr.path for fr in state.files}
+        processed = update_history(
+            root, history, head, args.history_since, args.history_max_commits, live_paths,
+        )
+        co_changes = apply_history(state, history, args.co_change_min_support)
+        print(f"\nHistory: {processed} new commits ({history.commits} total), {co_changes} co_changes edges")
+        if history.pair_error:
+            print(f"  Co-change counts are lower bounds, each low by at most {history.pair_error}")
 
     symbol_to_node, path_to_file = build_indexes(state)
     elapsed = time.time() - start_time
-    write_output(output_dir, state, symbol_to_node, path_to_file, root, elapsed)
+    written, view = write_output(
+        output_dir, state, symbol_to_node, path_to_file, root, elapsed, head,
+        prev, args.full or args.compact, centrality,
+        f"git-{blob_hash_algo(blob_ids)}" if blob_ids is not None else "sha256",
+    )
 
-    symbol_count = len([n for n in state.nodes if n.type != "file"])
+    symbol_count = len([n for n in state.nodes if n.type != "file" and n.type not in ROLLUP_TYPES])
     print(f"\nDone in {elapsed:.1f}s")
     print(f"  Files:   {file_count}")
     print(f"  Symbols: {symbol_count}")
     print(f"  Nodes:   {len(state.nodes)}")
     print(f"  Edges:   {len(state.edges)}")
-    print(f"  Output:  {output_dir}")
+    print(f"  Output:  {output_dir} ({written})")
+    if history is not None:
+        write_json(view / "indexes" / HISTORY_FILE, history.to_dict())
+    regenerated, modules = write_summaries(
+        view, prev.view, state, entry_point_ids, centrality, history, args.full,
+    )
+    print(f"  Summaries: {regenerated} of {modules} modules regenerated")
+    print(f"  Published: view {publish_output(output_dir, view, state)}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+import tempfile
+from collections import defaultdict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Iterator, TextIO
+
+from kg_store import RECORD_KEYS, iter_sorted
+
+
+DEFAULT_KINDS = "nodes,edges"
+DEFAULT_IGNORE_FIELDS = "last_indexed"
+DEFAULT_LIMIT = 50
+CHANGES = ("added", "removed", "changed")
+
+Record = tuple[Any, dict[str, Any]]
+
+
+@dataclass
+class DiffStats:
+    kinds: dict[str, dict[str, int]] = field(default_factory=lambda: defaultdict(lambda: defaultdict(int)))
+    types: dict[tuple[str, str], dict[str, int]] = field(default_factory=lambda: defaultdict(lambda: defaultdict(int)))
+    tags: dict[str, dict[str, int]] = field(default_factory=lambda: defaultdict(lambda: defaultdict(int)))
+    fields: dict[tuple[str, str], int] = field(default_factory=lambda: defaultdict(int))
+    samples: dict[tuple[str, str], list[dict[str, Any]]] = field(default_factory=lambda: defaultdict(list))
+
+    def add(self, kind: str, change: str, entry: dict[str, Any], obj: dict[str, Any], limit: int) -> None:
+        self.kinds[kind][change] += 1
+        self.types[(kind, group_of(kind, obj))][change] += 1
+        if kind == "nodes":
+            for tag in obj.get("tags", []):
+                self.tags[tag][change] += 1
+        for name in entry.get("fields", []):
+            self.fields[(kind, name)] += 1
+        samples = self.samples[(kind, change)]
+        if len(samples) < limit:
+            samples.append(entry)
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "kinds": {k: dict(v) for k, v in self.kinds.items()},
+            "types": {f"{k[:-1]}:{t}": dict(v) for (k, t), v in sorted(self.types.items())},
+            "tags": {t: dict(v) for t, v in sorted(self.tags.items())},
+            "fields": {f"{k[:-1]}.{f}": n for (k, f), n in sorted(self.fields.items())},
+        }
+
+
+def group_of(kind: str, obj: dict[str, Any]) -> str:
+    return obj.get("lang", "") if kind == "files" else obj.get("type", "")
+
+
+def key_fields(kind: str, key: Any) -> dict[str, Any]:
+    if kind == "edges":
+        return {"source": key[0], "target": key[1], "type": key[2]}
+    return {"path": key} if kind == "files" else {"id": key}
+
+
+def merge_join(old: Iterator[Record], new: Iterator[Record]) -> Iterator[tuple[Any, dict | None, dict | None]]:
+    a = next(old, None)
+    b = next(new, None)
+    while a is not None or b is not None:
+        if b is None or (a is not None and a[0] < b[0]):
+            yield a[0], a[1], None
+            a = next(old, None)
+        elif a is None or b[0] < a[0]:
+            yield b[0], None, b[1]
+            b = next(new, None)
+        else:
+            yield a[0], a[1], b[1]
+            a = next(old, None)
+            b = next(new, None)
+
+
+def diff_kind(
+    kind: str,
+    old_dir: Path,
+    new_dir: Path,
+    tmp_dir: Path,
+    ignore: set[str],
+) -> Iterator[tuple[str, dict[str, Any], dict[str, Any]]]:
+    old = iter_sorted(old_dir, kind, tmp_dir)
+    new = iter_sorted(new_dir, kind, tmp_dir)
+    for key, before, after in merge_join(old, new):
+        entry: dict[str, Any] = {"kind": kind[:-1]}
+        entry.update(key_fields(kind, key))
+        if before is None:
+            yield "added", dict(entry, change="added", data=after), after
+        elif after is None:
+            if kind != "edges":
+                entry["lang" if kind == "files" else "type"] = group_of(kind, before)
+            yield "removed", dict(entry, change="removed"), before
+        else:
+            changed = sorted(
+                name for name in before.keys() | after.keys()
+                if name not in ignore and before.get(name) != after.get(name)
+            )
+            if changed:
+                yield "changed", dict(
+                    entry,
+                    change="changed",
+                    fields=changed,
+                    before={name: before.get(name) for name in changed},
+                    after={name: after.get(name) for name in changed},
+                ), after
+
+
+def entry_label(entry: dict[str, Any]) -> str:
+    if entry["kind"] == "edge":
+        return f"{entry['source']} --{entry['type']}--> {entry['target']}"
+    return entry.get("id") or entry.get("path", "")
+
+
+def count_row(label: str, counts: dict[str, int]) -> str:
+    return f"| {label} | " + " | ".join(str(counts.get(c, 0)) for c in CHANGES) + " |"
+
+
+def format_md(stats: DiffStats, old_dir: Path, new_dir: Path, kinds: list[str], out: TextIO) -> None:
+    out.write(f"# Graph Diff\n\n- Old: `{old_dir}`\n- New: `{new_dir}`\n\n")
+    out.write("| Kind | Added | Removed | Changed |\n|---|---|---|---|\n")
+    for kind in kinds:
+        out.write(count_row(kind, stats.kinds.get(kind, {})) + "\n")
+    if stats.types:
+        out.write("\n## By Type\n\n| Type | Added | Removed | Changed |\n|---|---|---|---|\n")
+        for (kind, group), counts in sorted(stats.types.items(), key=lambda x: (x[0][0], -sum(x[1].values()), x[0][1])):
+            out.write(count_row(f"{kind[:-1]}:{group or '-'}", counts) + "\n")
+    if stats.tags:
+        out.write("\n## By Tag\n\n| Tag | Added | Removed | Changed |\n|---|---|---|---|\n")
+        for tag, counts in sorted(stats.tags.items(), key=lambda x: (-sum(x[1].values()), x[0])):
+            out.write(count_row(tag, counts) + "\n")
+    if stats.fields:
+        out.write("\n## Changed Fields\n\n| Field | Records |\n|---|---|\n")
+        for (kind, name), n in sorted(stats.fields.items(), key=lambda x: (-x[1], x[0])):
+            out.write(f"| {kind[:-1]}.{name} | {n} |\n")
+    for kind in kinds:
+        for change in CHANGES:
+            samples = stats.samples.get((kind, change))
+            if not samples:
+                continue
+            total = stats.kinds[kind][change]
+            shown = f" (first {len(samples)} of {total})" if total > len(samples) else ""
+            out.write(f"\n## {change.capitalize()} {kind}{shown}\n\n")
+            for entry in samples:
+                suffix = f" — {', '.join(entry['fields'])}" if change == "changed" else ""
+                out.write(f"- `{entry_label(entry)}`{suffix}\n")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Stream the differences between two knowledge graph directories in bounded memory.",
+    )
+    parser.add_argument("old_kg", help="Baseline knowledge graph directory")
+    parser.add_argument("new_kg", help="Knowledge graph directory to compare against the baseline")
+    parser.add_argument(
+        "--kinds",
+        default=DEFAULT_KINDS,
+        help=f"Record kinds to compare: nodes, edges, files (default: {DEFAULT_KINDS})",
+    )
+    parser.add_argument(
+        "--ignore-fields",
+        default=DEFAULT_IGNORE_FIELDS,
+        help=f"Fields left out of change detection, comma-separated (default: {DEFAULT_IGNORE_FIELDS})",
+    )
+    parser.add_argument("--format", choices=["md", "jsonl"], default="md", help="Output format (default: md)")
+    parser.add_argument(
+        "--limit",
+        type=int,
+        default=DEFAULT_LIMIT,
+        help=f"Records listed per kind and change in md output (default: {DEFAULT_LIMIT})",
+    )
+    parser.add_argument("--output", "-o", help="Write the delta to this file instead of stdout")
+    parser.add_argument("--tmp-dir", help="Directory for external sort runs (default: system temp dir)")
+
+    args = parser.parse_args()
+    kinds = [k.strip() for k in args.kinds.split(",") if k.strip()]
+    unknown = [k for k in kinds if k not in RECORD_KEYS]
+    if unknown or not kinds:
+        parser.error(f"--kinds: expected nodes, edges or files, got {', '.join(unknown) or 'nothing'}")
+    ignore = {f.strip() for f in args.ignore_fields.split(",") if f.strip()}
+
+    old_dir = Path(args.old_kg)
+    new_dir = Path(args.new_kg)
+    for kg_dir in (old_dir, new_dir):
+        if not kg_dir.is_dir():
+            print(f"Error: Knowledge graph directory not found: {kg_dir}", file=sys.stderr)
+            sys.exit(1)
+
+    out = open(args.output, "w") if args.output else sys.stdout
+    stats = DiffStats()
+    limit = args.limit if args.format == "md" else 0
+    try:
+        with tempfile.TemporaryDirectory(prefix="kg-diff-", dir=args.tmp_dir) as tmp:
+            for kind in kinds:
+                for change, entry, obj in diff_kind(kind, old_dir, new_dir, Path(tmp), ignore):
+                    stats.add(kind, change, entry, obj, limit)
+                    if args.format == "jsonl":
+                        out.write(json.dumps(entry) + "\n")
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    if args.format == "jsonl":
+        out.write(json.dumps(dict(kind="summary", **stats.to_dict())) + "\n")
+    else:
+        format_md(stats, old_dir, new_dir, kinds, out)
+    if out is not sys.stdout:
+        out.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,469 @@
+from __future__ import annotations
+
+import heapq
+import json
+import os
+import shutil
+import tempfile
+import time
+from dataclasses import dataclass, field
+from operator import itemgetter
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+
+CURRENT_FILE = "CURRENT"
+SNAPSHOTS_DIR = "snapshots"
+VIEWS_DIR = "views"
+JOURNAL_FILE = "journal.jsonl"
+META_FILE = "meta.json"
+SORTED_FILE = "SORTED"
+LEGACY_FILES = (
+    "nodes.jsonl", "edges.jsonl", "files.jsonl", "symbol_to_node.json", "path_to_file.json", META_FILE,
+)
+LEGACY_DIRS = ("indexes", "summaries")
+KEEP_SNAPSHOTS = 2
+KEEP_VIEWS = 2
+RETIRE_GRACE_SECONDS = 600
+SORT_RUN_RECORDS = 100_000
+ROLLUP_TYPES = ("module", "package")
+
+EdgeKey = Tuple[str, str, str]
+
+
+@dataclass
+class GraphData:
+    nodes: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+    edges: Dict[EdgeKey, Dict[str, Any]] = field(default_factory=dict)
+    files: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+    symbol_to_node: Dict[str, Any] = field(default_factory=dict)
+    path_to_file: Dict[str, Any] = field(default_factory=dict)
+    version: str = ""
+    journal_commits: int = 0
+
+
+def edge_key(obj: Dict[str, Any]) -> EdgeKey:
+    return (obj.get("source", ""), obj.get("target", ""), obj.get("type", ""))
+
+
+def node_key(obj: Dict[str, Any]) -> str:
+    return obj.get("id", "")
+
+
+def file_key(obj: Dict[str, Any]) -> str:
+    return obj.get("path", "")
+
+
+RECORD_KEYS: Dict[str, Callable[[Dict[str, Any]], Any]] = {
+    "nodes": node_key,
+    "edges": edge_key,
+    "files": file_key,
+}
+JOURNAL_OPS = {"nodes": ("node", "del_node"), "edges": ("edge", "del_edge"), "files": ("file", "del_file")}
+
+
+def iter_jsonl(path: Path) -> Iterator[Dict[str, Any]]:
+    if not path.exists():
+        return
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+
+def load_json(path: Path) -> Dict[str, Any]:
+    try:
+        return json.loads(path.read_text())
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+
+def atomic_write(path: Path, lines: Iterable[str]) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=str(path.parent), prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            for line in lines:
+                f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def write_jsonl(path: Path, objs: Iterable[Dict[str, Any]]) -> None:
+    atomic_write(path, (json.dumps(obj) + "\n" for obj in objs))
+
+
+def write_json(path: Path, obj: Any) -> None:
+    atomic_write(path, [json.dumps(obj, indent=2)])
+
+
+def read_current(kg_dir: Path) -> Tuple[str, str]:
+    try:
+        parts = (kg_dir / CURRENT_FILE).read_text().split()
+    except OSError:
+        parts = []
+    return (parts[0] if parts else "", parts[1] if len(parts) > 1 else "")
+
+
+def current_version(kg_dir: Path) -> str:
+    return read_current(kg_dir)[0]
+
+
+def snapshot_dir(kg_dir: Path, version: str = "") -> Path:
+    version = version or current_version(kg_dir)
+    if not version:
+        return kg_dir
+    return kg_dir / SNAPSHOTS_DIR / version
+
+
+def view_dir(kg_dir: Path, version: str = "", view: str = "") -> Path:
+    if not version:
+        version, view = read_current(kg_dir)
+    if not view:
+        return kg_dir
+    return kg_dir / SNAPSHOTS_DIR / version / VIEWS_DIR / view
+
+
+def journal_limit(kg_dir: Path, version: str, view: str) -> Optional[int]:
+    if not view:
+        return None
+    limit = load_json(view_dir(kg_dir, version, view) / META_FILE).get("journal_offset")
+    return limit if isinstance(limit, int) else None
+
+
+def read_journal(journal: Path, limit: Optional[int] = None) -> Tuple[List[List[Dict[str, Any]]], int]:
+    batches: List[List[Dict[str, Any]]] = []
+    pending: List[Dict[str, Any]] = []
+    committed_offset = 0
+    if not journal.exists():
+        return batches, 0
+    with open(journal, "rb") as f:
+        offset = 0
+        for raw in f:
+            offset += len(raw)
+            if not raw.endswith(b"\n") or (limit is not None and offset > limit):
+                break
+            try:
+                op = json.loads(raw)
+            except json.JSONDecodeError:
+                pending = []
+                continue
+            if op.get("op") == "commit":
+                batches.append(pending)
+                pending = []
+                committed_offset = offset
+            else:
+                pending.append(op)
+    return batches, committed_offset
+
+
+def apply_ops(graph: GraphData, ops: List[Dict[str, Any]]) -> None:
+    for op in ops:
+        kind = op.get("op")
+        if kind == "node":
+            data = op["data"]
+            old = graph.nodes.get(data["id"])
+            if old is not None:
+                unindex_node(graph, old)
+            graph.nodes[data["id"]] = data
+            index_node(graph, data)
+        elif kind == "del_node":
+            old = graph.nodes.pop(op["id"], None)
+            if old is not None:
+                unindex_node(graph, old)
+        elif kind == "edge":
+            graph.edges[edge_key(op["data"])] = op["data"]
+        elif kind == "del_edge":
+            graph.edges.pop((op["source"], op["target"], op["type"]), None)
+        elif kind == "file":
+            graph.files[op["data"]["path"]] = op["data"]
+        elif kind == "del_file":
+            graph.files.pop(op["path"], None)
+
+
+def index_node(graph: GraphData, node: Dict[str, Any]) -> None:
+    if node.get("type") == "file":
+        graph.path_to_file[node.get("path", "")] = node["id"]
+        return
+    if node.get("type") in ROLLUP_TYPES:
+        return
+    ids = graph.symbol_to_node.setdefault(node.get("name", ""), [])
+    if node["id"] not in ids:
+        ids.append(node["id"])
+
+
+def unindex_node(graph: GraphData, node: Dict[str, Any]) -> None:
+    if node.get("type") == "file":
+        if graph.path_to_file.get(node.get("path", "")) == node["id"]:
+            del graph.path_to_file[node["path"]]
+        return
+    if node.get("type") in ROLLUP_TYPES:
+        return
+    ids = graph.symbol_to_node.get(node.get("name", ""))
+    if ids and node["id"] in ids:
+        ids.remove(node["id"])
+        if not ids:
+            del graph.symbol_to_node[node["name"]]
+
+
+def load_graph(kg_dir: Path, version: str = "", view: str = "") -> GraphData:
+    if not version:
+        version, view = read_current(kg_dir)
+    base = snapshot_dir(kg_dir, version)
+    graph = GraphData(version=version)
+    for obj in iter_jsonl(base / "nodes.jsonl"):
+        if "id" in obj:
+            graph.nodes[obj["id"]] = obj
+    for obj in iter_jsonl(base / "edges.jsonl"):
+        graph.edges[edge_key(obj)] = obj
+    for obj in iter_jsonl(base / "files.jsonl"):
+        if "path" in obj:
+            graph.files[obj["path"]] = obj
+    graph.symbol_to_node = load_json(base / "symbol_to_node.json")
+    graph.path_to_file = load_json(base / "path_to_file.json")
+
+    if version:
+        batches, _ = read_journal(base / JOURNAL_FILE, journal_limit(kg_dir, version, view))
+        for ops in batches:
+            apply_ops(graph, ops)
+        graph.journal_commits = len(batches)
+    return graph
+
+
+def diff_ops(
+    old_nodes: Dict[str, Dict[str, Any]],
+    new_nodes: Iterable[Dict[str, Any]],
+    old_edges: Dict[EdgeKey, Dict[str, Any]],
+    new_edges: Iterable[Dict[str, Any]],
+    old_files: Dict[str, Dict[str, Any]],
+    new_files: Iterable[Dict[str, Any]],
+) -> List[Dict[str, Any]]:
+    ops: List[Dict[str, Any]] = []
+    seen_nodes = set()
+    for node in new_nodes:
+        seen_nodes.add(node["id"])
+        if old_nodes.get(node["id"]) != node:
+            ops.append({"op": "node", "data": node})
+    seen_edges = set()
+    for edge in new_edges:
+        key = edge_key(edge)
+        seen_edges.add(key)
+        if old_edges.get(key) != edge:
+            ops.append({"op": "edge", "data": edge})
+    seen_files = set()
+    for fr in new_files:
+        seen_files.add(fr["path"])
+        if old_files.get(fr["path"]) != fr:
+            ops.append({"op": "file", "data": fr})
+    for key in old_edges:
+        if key not in seen_edges:
+            ops.append({"op": "del_edge", "source": key[0], "target": key[1], "type": key[2]})
+    for node_id in old_nodes:
+        if node_id not in seen_nodes:
+            ops.append({"op": "del_node", "id": node_id})
+    for path in old_files:
+        if path not in seen_files:
+            ops.append({"op": "del_file", "path": path})
+    return ops
+
+
+def append_journal(
+    kg_dir: Path,
+    ops: List[Dict[str, Any]],
+    commit: Dict[str, Any],
+    limit: Optional[int] = None,
+) -> int:
+    journal = snapshot_dir(kg_dir) / JOURNAL_FILE
+    _, committed_offset = read_journal(journal, limit)
+    with open(journal, "ab") as f:
+        f.truncate(committed_offset)
+        if ops:
+            for op in ops:
+                f.write((json.dumps(op) + "\n").encode())
+            f.write((json.dumps(dict(commit, op="commit")) + "\n").encode())
+        f.flush()
+        os.fsync(f.fileno())
+        return f.tell()
+
+
+def journal_bytes(kg_dir: Path) -> Tuple[int, int]:
+    base = snapshot_dir(kg_dir)
+    size = 0
+    for name in ("nodes.jsonl", "edges.jsonl"):
+        try:
+            size += (base / name).stat().st_size
+        except OSError:
+            pass
+    try:
+        journal = (base / JOURNAL_FILE).stat().st_size
+    except OSError:
+        journal = 0
+    return journal, size
+
+
+def publish_snapshot(
+    kg_dir: Path,
+    nodes: Iterable[Dict[str, Any]],
+    edges: Iterable[Dict[str, Any]],
+    files: Iterable[Dict[str, Any]],
+    symbol_to_node: Dict[str, Any],
+    path_to_file: Dict[str, Any],
+) -> str:
+    snapshots = kg_dir / SNAPSHOTS_DIR
+    snapshots.mkdir(parents=True, exist_ok=True)
+    existing = sorted(p.name for p in snapshots.iterdir() if p.is_dir() and p.name.isdigit())
+    version = f"{int(existing[-1]) + 1 if existing else 1:06d}"
+
+    staging = Path(tempfile.mkdtemp(dir=str(snapshots), prefix=f".{version}."))
+    write_jsonl(staging / "nodes.jsonl", sorted(nodes, key=node_key))
+    write_jsonl(staging / "edges.jsonl", sorted(edges, key=edge_key))
+    write_jsonl(staging / "files.jsonl", sorted(files, key=file_key))
+    write_json(staging / "symbol_to_node.json", symbol_to_node)
+    write_json(staging / "path_to_file.json", path_to_file)
+    (staging / JOURNAL_FILE).touch()
+    (staging / SORTED_FILE).touch()
+    os.replace(staging, snapshots / version)
+    return version
+
+
+def stage_view(kg_dir: Path, version: str) -> Path:
+    views = snapshot_dir(kg_dir, version) / VIEWS_DIR
+    views.mkdir(parents=True, exist_ok=True)
+    return Path(tempfile.mkdtemp(dir=str(views), prefix=".view."))
+
+
+def publish_view(kg_dir: Path, staging: Path) -> str:
+    views = staging.parent
+    version = views.parent.name
+    existing = sorted(p.name for p in views.iterdir() if p.is_dir() and p.name.isdigit())
+    view = f"{int(existing[-1]) + 1 if existing else 1:06d}"
+    os.replace(staging, views / view)
+    atomic_write(kg_dir / CURRENT_FILE, [f"{version} {view}\n"])
+
+    for name in LEGACY_FILES:
+        try:
+            (kg_dir / name).unlink()
+        except OSError:
+            pass
+    for name in LEGACY_DIRS:
+        shutil.rmtree(kg_dir / name, ignore_errors=True)
+    prune_retired(kg_dir / SNAPSHOTS_DIR, KEEP_SNAPSHOTS)
+    prune_retired(views, KEEP_VIEWS)
+    return view
+
+
+def prune_retired(parent: Path, keep: int) -> None:
+    entries = sorted(p for p in parent.iterdir() if p.is_dir() and p.name.isdigit())
+    now = time.time()
+    for old, successor in zip(entries[:max(0, len(entries) - keep)], entries[1:]):
+        try:
+            retired = successor.stat().st_mtime
+        except OSError:
+            continue
+        if now - retired >= RETIRE_GRACE_SECONDS:
+            shutil.rmtree(old, ignore_errors=True)
+    for stale in parent.glob(".*"):
+        try:
+            if now - stale.stat().st_mtime >= RETIRE_GRACE_SECONDS:
+                shutil.rmtree(stale, ignore_errors=True)
+        except OSError:
+            pass
+
+
+def journal_overlay(
+    journal: Path,
+    name: str,
+    limit: Optional[int] = None,
+) -> Dict[Any, Optional[Dict[str, Any]]]:
+    key = RECORD_KEYS[name]
+    put, delete = JOURNAL_OPS[name]
+    overlay: Dict[Any, Optional[Dict[str, Any]]] = {}
+    batches, _ = read_journal(journal, limit)
+    for ops in batches:
+        for op in ops:
+            if op.get("op") == put:
+                overlay[key(op["data"])] = op["data"]
+            elif op.get("op") == delete:
+                if name == "edges":
+                    overlay[(op["source"], op["target"], op["type"])] = None
+                else:
+                    overlay[op["id" if name == "nodes" else "path"]] = None
+    return overlay
+
+
+def write_run(chunk: List[Dict[str, Any]], key: Callable[[Dict[str, Any]], Any], tmp_dir: Path) -> Path:
+    chunk.sort(key=key)
+    fd, tmp = tempfile.mkstemp(dir=str(tmp_dir), prefix="run.", suffix=".jsonl")
+    with os.fdopen(fd, "w") as f:
+        for obj in chunk:
+            f.write(json.dumps(obj) + "\n")
+    return Path(tmp)
+
+
+def external_sort(
+    path: Path,
+    key: Callable[[Dict[str, Any]], Any],
+    tmp_dir: Path,
+    run_records: int = SORT_RUN_RECORDS,
+) -> Iterator[Tuple[Any, Dict[str, Any]]]:
+    runs: List[Path] = []
+    chunk: List[Dict[str, Any]] = []
+    for obj in iter_jsonl(path):
+        chunk.append(obj)
+        if len(chunk) >= run_records:
+            runs.append(write_run(chunk, key, tmp_dir))
+            chunk = []
+    if not runs:
+        chunk.sort(key=key)
+        for obj in chunk:
+            yield key(obj), obj
+        return
+    if chunk:
+        runs.append(write_run(chunk, key, tmp_dir))
+    del chunk
+    streams = [((key(obj), obj) for obj in iter_jsonl(run)) for run in runs]
+    yield from heapq.merge(*streams, key=itemgetter(0))
+
+
+def iter_sorted(kg_dir: Path, name: str, tmp_dir: Path) -> Iterator[Tuple[Any, Dict[str, Any]]]:
+    key = RECORD_KEYS[name]
+    version, view = read_current(kg_dir)
+    base = snapshot_dir(kg_dir, version)
+    path = base / f"{name}.jsonl"
+    if (base / SORTED_FILE).exists():
+        records: Iterable[Tuple[Any, Dict[str, Any]]] = ((key(obj), obj) for obj in iter_jsonl(path))
+    else:
+        records = external_sort(path, key, tmp_dir)
+    overlay = journal_overlay(base / JOURNAL_FILE, name, journal_limit(kg_dir, version, view)) if version else {}
+    pending = sorted(overlay.items(), key=itemgetter(0))
+    i = 0
+    last = None
+    for k, obj in records:
+        if last is not None and k < last:
+            raise ValueError(f"{path} is not sorted by key; remove {base / SORTED_FILE} to sort it externally")
+        last = k
+        while i < len(pending) and pending[i][0] < k:
+            if pending[i][1] is not None:
+                yield pending[i]
+            i += 1
+        if i < len(pending) and pending[i][0] == k:
+            if pending[i][1] is not None:
+                yield pending[i]
+            i += 1
+            continue
+        yield k, obj
+    for k, obj in pending[i:]:
+        if obj is not None:
+            yield k, obj
@@ -3,12 +3,60 @@
 from __future__ import annotations
 
 import argparse
+import hashlib
 import json
+import mmap
+import os
 import sys
+import tempfile
+import time
+from array import array
 from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from dataclasses import dataclass, field
+from functools import lru_cache
 from pathlib import Path
-from typing import Any
+from typing import Any, Iterable, Iterator
+
+from kg_store import GraphData, load_graph, load_json, read_current, view_dir
+from query_lang import Expr, NodeIndex, QueryError, Term, all_of, any_of, evaluate, parse_query
+from text_search import SEARCH_DIR, SearchIndex
+
+
+QUERY_CACHE_DIR = "query_cache"
+
+DEFAULT_QUERY_CACHE_MAX_MB = 64
+
+DEFAULT_MAX_NODES = 30
+
+DEFAULT_MAX_EDGES = 60
+
+TOKEN_BUDGET_MAX_NODES = 2000
+
+TOKEN_BUDGET_MAX_EDGES = 4000
+
+CHARS_PER_TOKEN = 4
+
+LINE_OFFSETS_DIR = "line_offsets"
+
+DEFAULT_SNIPPET_BYTES = 16000
+
+DEFAULT_PATH_COUNT = 3
+
+DEFAULT_MAX_VISITED = 100000
+
+DEPENDENCY_EDGE_TYPES = ("imports", "calls", "inherits", "defines", "tests")
+
+DEFAULT_SEARCH_TOP_K = 10
+
+EDGE_TABLE_HEADER = ("| From | Relationship | To |", "|------|-------------|-----|")
+
+EDGE_EVIDENCE_HEADER = ("## Edge Evidence", "")
+
+HOTSPOTS_HEADER = ("## Hotspots", "")
+
+JSON_LIST_OVERHEAD = 4
 
 
 @dataclass
@@ -20,8 +68,9 @@ class Node:
     lang: str = ""
     tags: list[str] = field(default_factory=list)
     summary: str = ""
-    evidence: list[str] = field(default_factory=list)
+    evidence: list[dict[str, Any]] = field(default_factory=list)
     raw: dict[str, Any] = field(default_factory=dict)
+    snippets: list[dict[str, Any]] = field(default_factory=list)
 
 
 @dataclass
@@ -31,6 +80,7 @@ class Edge:
     type: str
     confidence: float = 1.0
     raw: dict[str, Any] = field(default_factory=dict)
+    snippets: list[dict[str, Any]] = field(default_factory=list)
 
 
 @dataclass
@@ -39,23 +89,302 @@ class ContextBundle:
     nodes: list[Node]
     edges: list[Edge]
     hotspots: list[dict[str, Any]]
+    paths: list[list[str]] = field(default_factory=list)
+    impact: dict[str, int] = field(default_factory=dict)
+    tests: list[dict[str, Any]] = field(default_factory=list)
+    matches: list[dict[str, Any]] = field(default_factory=list)
 
 
-def load_jsonl(path: Path) -> list[dict[str, Any]]:
-    if not path.exists():
-        return []
-    items = []
-    for line in path.read_text().splitlines():
-        line = line.strip()
-        if line:
-            items.append(json.loads(line))
-    return items
+@dataclass
+class QueryResult:
+    nodes: list[dict[str, Any]] = field(default_factory=list)
+    edges: list[dict[str, Any]] = field(default_factory=list)
+    seeds: list[str] = field(default_factory=list)
+    centrality: dict[str, Any] = field(default_factory=dict)
+    depths: dict[str, int] = field(default_factory=dict)
+    node_count: int = 0
+    root: str = ""
+    hash_algo: str = ""
+    file_hashes: dict[str, str] = field(default_factory=dict)
+    paths: list[list[str]] = field(default_factory=list)
+    truncated: bool = False
+    impact: dict[str, int] = field(default_factory=dict)
+    tests: list[dict[str, Any]] = field(default_factory=list)
+    matches: list[dict[str, Any]] = field(default_factory=list)
+    notes: list[str] = field(default_factory=list)
 
 
-def load_json(path: Path) -> dict[str, Any]:
-    if not path.exists():
-        return {}
-    return json.loads(path.read_text())
+@dataclass
+class GraphPath:
+    nodes: list[str]
+    edges: list[Edge]
+
+
+@dataclass
+class SearchBudget:
+    remaining: int
+
+    def spend(self, count: int = 1) -> bool:
+        self.remaining -= count
+        return self.remaining >= 0
+
+
+class QueryCache:
+    def __init__(self, cache_dir: Path, max_bytes: int) -> None:
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    def get(self, key: str) -> tuple[str, list[str]] | None:
+        path = self.cache_dir / f"{key}.out"
+        try:
+            entry = json.loads(path.read_text())
+            if any(file_stamp(Path(p)) != stamp for p, stamp in entry["files"].items()):
+                return None
+            os.utime(path)
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            return None
+        return entry["output"], entry["notes"]
+
+    def put(self, key: str, text: str, notes: list[str], files: dict[str, list[int] | None]) -> None:
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=str(self.cache_dir), suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                json.dump({"output": text, "notes": notes, "files": files}, f)
+            os.replace(tmp, self.cache_dir / f"{key}.out")
+        except OSError:
+            return
+        self.prune()
+
+    def prune(self) -> None:
+        entries = []
+        total = 0
+        for path in self.cache_dir.glob("*.out"):
+            try:
+                st = path.stat()
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                path.unlink()
+            except OSError:
+                continue
+            total -= size
+
+
+def file_stamp(path: Path) -> list[int] | None:
+    try:
+        st = path.stat()
+    except OSError:
+        return None
+    return [st.st_mtime_ns, st.st_size]
+
+
+@lru_cache(maxsize=None)
+def pinned_version(kg_dir: Path) -> tuple[str, str]:
+    return read_current(kg_dir)
+
+
+def kg_view(kg_dir: Path) -> Path:
+    return view_dir(kg_dir, *pinned_version(kg_dir))
+
+
+def load_pinned_graph(kg_dir: Path) -> GraphData:
+    return load_graph(kg_dir, *pinned_version(kg_dir))
+
+
+def graph_version(kg_dir: Path) -> str:
+    meta_path = kg_view(kg_dir) / "meta.json"
+    try:
+        meta = json.loads(meta_path.read_text())
+        parts = [meta.get("indexed_at", ""), meta.get("node_count", ""), meta.get("edge_count", "")]
+    except (OSError, json.JSONDecodeError):
+        parts = []
+        for name in ("nodes.jsonl", "edges.jsonl"):
+            try:
+                st = (kg_dir / name).stat()
+                parts.extend([st.st_mtime_ns, st.st_size])
+            except OSError:
+                parts.append("")
+    return hashlib.sha256(json.dumps(parts).encode()).hexdigest()[:16]
+
+
+def split_csv(value: str | None) -> list[str]:
+    if not value:
+        return []
+    return sorted({t.strip().lower() for t in value.split(",") if t.strip()})
+
+
+def query_cache_key(args: argparse.Namespace, version: str, kg_dirs: list[Path] | None = None) -> str:
+    normalised = {
+        "version": version,
+        "query": args.query or "",
+        "explain": args.explain,
+        "symbol": args.symbol or "",
+        "path": args.path or "",
+        "tags": split_csv(args.tags),
+        "type": split_csv(args.type),
+        "hops": args.hops,
+        "max_nodes": args.max_nodes,
+        "max_edges": args.max_edges,
+        "format": args.format,
+        "include_evidence": args.include_evidence,
+        "token_budget": args.token_budget,
+        "snippet_bytes": args.snippet_bytes,
+        "from": args.from_query or "",
+        "to": args.to_query or "",
+        "paths": args.paths,
+        "max_visited": args.max_visited,
+        "undirected": args.undirected,
+        "impact": args.impact,
+        "affected_tests": args.affected_tests,
+        "search": args.search or "",
+        "top_k": args.top_k,
+        "kg_dirs": [str(d.resolve()) for d in kg_dirs or []],
+    }
+    return hashlib.sha256(json.dumps(normalised, sort_keys=True).encode()).hexdigest()
+
+
+class SnippetReader:
+    def __init__(self, kg_dir: Path, root: str, hash_algo: str, file_hashes: dict[str, str]) -> None:
+        self.kg_dir = kg_dir
+        self.root = Path(root) if root else None
+        self.hash_algo = hash_algo
+        self.file_hashes = file_hashes
+        self.maps: dict[str, mmap.mmap | None] = {}
+        self.verified: dict[str, bool] = {}
+        self.offsets: dict[str, array] = {}
+
+    def open(self, path: str) -> mmap.mmap | None:
+        if path in self.maps:
+            return self.maps[path]
+        mm = None
+        if self.root is not None:
+            try:
+                with open(self.root / path, "rb") as f:
+                    mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (OSError, ValueError):
+                mm = None
+        self.maps[path] = mm
+        return mm
+
+    def stamps(self) -> dict[str, list[int] | None]:
+        if self.root is None:
+            return {}
+        return {str(self.root / path): file_stamp(self.root / path) for path in self.maps}
+
+    def is_fresh(self, path: str, mm: mmap.mmap) -> bool:
+        if path not in self.verified:
+            expected = self.file_hashes.get(path, "")
+            if self.hash_algo.startswith("git-"):
+                h = hashlib.new(self.hash_algo[4:])
+                h.update(f"blob {len(mm)}\0".encode())
+            else:
+                h = hashlib.sha256()
+            h.update(mm)
+            self.verified[path] = bool(expected) and h.hexdigest() == expected
+        return self.verified[path]
+
+    def line_offsets(self, path: str, mm: mmap.mmap) -> array:
+        file_hash = self.file_hashes.get(path, "")
+        if file_hash in self.offsets:
+            return self.offsets[file_hash]
+        offsets = array("Q")
+        stored = self.kg_dir / LINE_OFFSETS_DIR / file_hash[:2] / f"{file_hash}.bin"
+        try:
+            offsets.frombytes(stored.read_bytes())
+        except (OSError, ValueError):
+            offsets = array("Q", [0])
+            pos = mm.find(b"\n")
+            while pos != -1:
+                offsets.append(pos + 1)
+                pos = mm.find(b"\n", pos + 1)
+            if offsets[-1] != len(mm):
+                offsets.append(len(mm))
+        self.offsets[file_hash] = offsets
+        return offsets
+
+    def read(self, evidence: dict[str, Any], max_bytes: int) -> dict[str, Any] | None:
+        path = evidence.get("path", "")
+        start_line = int(evidence.get("start_line", 0) or 0)
+        end_line = int(evidence.get("end_line", start_line) or start_line)
+        if not path or start_line < 1 or max_bytes <= 0:
+            return None
+        snippet = {"path": path, "start_line": start_line, "end_line": end_line}
+        mm = self.open(path)
+        if mm is None:
+            return None
+        if not self.is_fresh(path, mm):
+            return dict(snippet, stale=True, text="")
+        offsets = self.line_offsets(path, mm)
+        if start_line >= len(offsets):
+            return dict(snippet, stale=True, text="")
+        end_line = min(max(end_line, start_line), len(offsets) - 1)
+        start, end = offsets[start_line - 1], offsets[end_line]
+        if end - start > max_bytes:
+            cut = mm.rfind(b"\n", start, start + max_bytes)
+            end = cut + 1 if cut > start else start + max_bytes
+        text = mm[start:end].decode("utf-8", errors="replace")
+        return dict(snippet, end_line=start_line + text.count("\n") - (1 if text.endswith("\n") else 0), stale=False, text=text)
+
+    def close(self) -> None:
+        for mm in self.maps.values():
+            if mm is not None:
+                mm.close()
+        self.maps.clear()
+
+
+def materialize_snippets(
+    bundle: ContextBundle,
+    readers: dict[str, SnippetReader],
+    max_bytes: int,
+) -> int:
+    remaining = max_bytes
+    items: list[Node | Edge] = [*bundle.nodes, *bundle.edges]
+    for item in items:
+        reader = readers.get(item.raw.get("repo", ""))
+        if reader is None:
+            continue
+        for evidence in item.raw.get("evidence", []):
+            if remaining <= 0:
+                return max_bytes - remaining
+            snippet = reader.read(evidence, remaining)
+            if snippet is None:
+                continue
+            item.snippets.append(snippet)
+            remaining -= len(snippet["text"].encode())
+    return max_bytes - remaining
+
+
+def format_evidence(evidence: dict[str, Any]) -> str:
+    path = evidence.get("path", "")
+    start = evidence.get("start_line")
+    end = evidence.get("end_line", start)
+    if not start:
+        return path
+    if end and end != start:
+        return f"{path}:{start}-{end}"
+    return f"{path}:{start}"
+
+
+def snippet_lines(snippets: list[dict[str, Any]]) -> list[str]:
+    lines: list[str] = []
+    for snippet in snippets:
+        if snippet["stale"]:
+            lines.append(f"- `{format_evidence(snippet)}` (stale: file changed since indexing)")
+            continue
+        lines.append(f"- `{format_evidence(snippet)}`")
+        lines.append("")
+        lines.append("```")
+        lines.extend(snippet["text"].rstrip("\n").split("\n"))
+        lines.append("```")
+        lines.append("")
+    return lines
 
 
 def parse_node(raw: dict[str, Any]) -> Node:
@@ -82,64 +411,6 @@ def parse_edge(raw: dict[str, Any]) -> Edge:
     )
 
 
-def resolve_by_symbol(
-    symbol: str,
-    symbol_index: dict[str, Any],
-    all_nodes: list[Node],
-) -> set[str]:
-    node_ids: set[str] = set()
-    if symbol in symbol_index:
-        val = symbol_index[symbol]
-        if isinstance(val, list):
-            node_ids.update(val)
-        else:
-            node_ids.add(str(val))
-    if not node_ids:
-        lower = symbol.lower()
-        for node in all_nodes:
-            if lower in node.name.lower():
-                node_ids.add(node.id)
-    return node_ids
-
-
-def resolve_by_path(
-    path_query: str,
-    path_index: dict[str, Any],
-    all_nodes: list[Node],
-) -> set[str]:
-    node_ids: set[str] = set()
-    for indexed_path, val in path_index.items():
-        if path_query in indexed_path:
-            if isinstance(val, list):
-                node_ids.update(val)
-            else:
-                node_ids.add(str(val))
-    if not node_ids:
-        lower = path_query.lower()
-        for node in all_nodes:
-            if lower in node.path.lower():
-                node_ids.add(node.id)
-    return node_ids
-
-
-def resolve_by_tags(tags: list[str], all_nodes: list[Node]) -> set[str]:
-    tag_set = {t.lower() for t in tags}
-    return {
-        node.id
-        for node in all_nodes
-        if tag_set & {t.lower() for t in node.tags}
-    }
-
-
-def resolve_by_type(types: list[str], all_nodes: list[Node]) -> set[str]:
-    type_set = {t.lower() for t in types}
-    return {
-        node.id
-        for node in all_nodes
-        if node.type.lower() in type_set
-    }
-
-
 def expand_neighborhood(
     initial_ids: set[str],
     all_edges: list[Edge],
@@ -147,6 +418,7 @@ def expand_neighborhood(
     hops: int,
     max_nodes: int,
     max_edges: int,
+    depths: dict[str, int] | None = None,
 ) -> tuple[list[Node], list[Edge]]:
     adjacency: dict[str, list[Edge]] = defaultdict(list)
     for edge in all_edges:
@@ -171,6 +443,11 @@ def expand_neighborhood(
             if neighbor not in visited:
                 visited.add(neighbor)
                 queue.append((neighbor, depth + 1))
+                if depths is not None:
+                    depths[neighbor] = depth + 1
+
+    if depths is not None:
+        depths.update((nid, 0) for nid in initial_ids)
 
     collected_edges.sort(key=lambda e: e.confidence, reverse=True)
     collected_edges = collected_edges[:max_edges]
@@ -186,13 +463,262 @@ def expand_neighborhood(
     return result_nodes, collected_edges
 
 
-def compute_hotspots(nodes: list[Node], edges: list[Edge]) -> list[dict[str, Any]]:
+def resolve_endpoint(query: str, index: NodeIndex) -> set[str]:
+    return index.scan(Term("name", query, "auto")) or index.scan(Term("path", query, "auto"))
+
+
+def build_adjacency(
+    all_edges: list[Edge],
+    undirected: bool,
+) -> tuple[dict[str, dict[str, Edge]], dict[str, dict[str, Edge]]]:
+    forward: dict[str, dict[str, Edge]] = defaultdict(dict)
+    backward: dict[str, dict[str, Edge]] = defaultdict(dict)
+    for edge in all_edges:
+        if edge.source == edge.target:
+            continue
+        pairs = [(edge.source, edge.target)]
+        if undirected:
+            pairs.append((edge.target, edge.source))
+        for a, b in pairs:
+            best = forward[a].get(b)
+            if best is None or edge.confidence > best.confidence:
+                forward[a][b] = edge
+                backward[b][a] = edge
+    return forward, backward
+
+
+def ordered_neighbors(adjacency: dict[str, dict[str, Edge]], node_id: str) -> list[tuple[str, Edge]]:
+    return sorted(adjacency.get(node_id, {}).items(), key=lambda x: (-x[1].confidence, x[0]))
+
+
+def bidirectional_bfs(
+    sources: set[str],
+    targets: set[str],
+    forward: dict[str, dict[str, Edge]],
+    backward: dict[str, dict[str, Edge]],
+    budget: SearchBudget,
+    banned_nodes: set[str],
+    banned_edges: set[tuple[str, str]],
+) -> GraphPath | None:
+    sources = sources - banned_nodes
+    targets = targets - banned_nodes
+    if not sources or not targets:
+        return None
+    for node_id in sorted(sources & targets):
+        return GraphPath(nodes=[node_id], edges=[])
+
+    parents_f: dict[str, tuple[str, Edge] | None] = {s: None for s in sources}
+    parents_b: dict[str, tuple[str, Edge] | None] = {t: None for t in targets}
+    depth_f = dict.fromkeys(sources, 0)
+    depth_b = dict.fromkeys(targets, 0)
+    frontier_f = sorted(sources)
+    frontier_b = sorted(targets)
+
+    while frontier_f and frontier_b:
+        expand_forward = len(frontier_f) <= len(frontier_b)
+        if expand_forward:
+            frontier, adjacency, parents, depth, other_depth = frontier_f, forward, parents_f, depth_f, depth_b
+        else:
+            frontier, adjacency, parents, depth, other_depth = frontier_b, backward, parents_b, depth_b, depth_f
+        next_frontier: list[str] = []
+        meetings: list[str] = []
+        for current in frontier:
+            for neighbor, edge in ordered_neighbors(adjacency, current):
+                if neighbor in banned_nodes or neighbor in parents:
+                    continue
+                pair = (current, neighbor) if expand_forward else (neighbor, current)
+                if pair in banned_edges:
+                    continue
+                if not budget.spend():
+                    return None
+                parents[neighbor] = (current, edge)
+                depth[neighbor] = depth[current] + 1
+                next_frontier.append(neighbor)
+                if neighbor in other_depth:
+                    meetings.append(neighbor)
+        if meetings:
+            meet = min(meetings, key=lambda m: (depth_f[m] + depth_b[m], m))
+            return join_path(meet, parents_f, parents_b)
+        if expand_forward:
+            frontier_f = next_frontier
+        else:
+            frontier_b = next_frontier
+    return None
+
+
+def join_path(
+    meet: str,
+    parents_f: dict[str, tuple[str, Edge] | None],
+    parents_b: dict[str, tuple[str, Edge] | None],
+) -> GraphPath:
+    head_nodes = [meet]
+    head_edges: list[Edge] = []
+    step = parents_f[meet]
+    while step is not None:
+        prev, edge = step
+        head_nodes.append(prev)
+        head_edges.append(edge)
+        step = parents_f[prev]
+    head_nodes.reverse()
+    head_edges.reverse()
+    step = parents_b[meet]
+    while step is not None:
+        nxt, edge = step
+        head_nodes.append(nxt)
+        head_edges.append(edge)
+        step = parents_b[nxt]
+    return GraphPath(nodes=head_nodes, edges=head_edges)
+
+
+def k_shortest_paths(
+    sources: set[str],
+    targets: set[str],
+    forward: dict[str, dict[str, Edge]],
+    backward: dict[str, dict[str, Edge]],
+    k: int,
+    budget: SearchBudget,
+) -> list[GraphPath]:
+    first = bidirectional_bfs(sources, targets, forward, backward, budget, set(), set())
+    if first is None:
+        return []
+    found = [first]
+    seen = {tuple(first.nodes)}
+    candidates: list[tuple[int, tuple[str, ...], GraphPath]] = []
+    while len(found) < k:
+        last = found[-1]
+        for i in range(-1, len(last.nodes) - 1):
+            root_nodes = last.nodes[:i + 1]
+            if i < 0:
+                spur_sources = sources - {p.nodes[0] for p in found}
+                banned_edges: set[tuple[str, str]] = set()
+            else:
+                spur_sources = {last.nodes[i]}
+                banned_edges = {
+                    (p.nodes[i], p.nodes[i + 1])
+                    for p in found
+                    if len(p.nodes) > i + 1 and p.nodes[:i + 1] == root_nodes
+                }
+            spur = bidirectional_bfs(
+                spur_sources, targets, forward, backward, budget, set(root_nodes[:-1]), banned_edges,
+            )
+            if budget.remaining < 0:
+                break
+            if spur is None:
+                continue
+            path = GraphPath(
+                nodes=root_nodes[:-1] + spur.nodes if root_nodes else spur.nodes,
+                edges=last.edges[:i] + spur.edges if i > 0 else spur.edges,
+            )
+            key = tuple(path.nodes)
+            if key not in seen:
+                seen.add(key)
+                candidates.append((len(path.edges), key, path))
+        if not candidates or budget.remaining < 0:
+            break
+        candidates.sort(key=lambda c: (c[0], c[1]))
+        found.append(candidates.pop(0)[2])
+    return found
+
+
+def load_reverse_deps(kg_dir: Path) -> dict[str, Any]:
+    deps = load_json(kg_view(kg_dir) / "indexes" / "reverse_deps.json")
+    if "dependents" in deps and "nodes" in deps:
+        return deps
+    graph = load_pinned_graph(kg_dir)
+    dependents: dict[str, list[list[str]]] = defaultdict(list)
+    defines: dict[str, list[str]] = defaultdict(list)
+    for (source, target, edge_type) in graph.edges:
+        if edge_type not in DEPENDENCY_EDGE_TYPES or source == target:
+            continue
+        if source not in graph.nodes or target not in graph.nodes:
+            continue
+        dependents[target].append([source, edge_type])
+        if edge_type == "defines":
+            defines[source].append(target)
+    return {
+        "nodes": {
+            nid: [n.get("name", ""), n.get("type", ""), n.get("path", ""), n.get("lang", "")]
+            for nid, n in graph.nodes.items()
+        },
+        "dependents": dependents,
+        "defines": defines,
+        "test_files": sorted(
+            nid for nid, n in graph.nodes.items() if n.get("type") == "file" and "test" in n.get("tags", [])
+        ),
+    }
+
+
+def impact_closure(
+    changed_ids: set[str],
+    deps: dict[str, Any],
+) -> tuple[dict[str, int], list[tuple[str, str, str]]]:
+    dependents = deps.get("dependents", {})
+    defines = deps.get("defines", {})
+    depths = dict.fromkeys(changed_ids, 0)
+    for file_id in changed_ids:
+        for symbol_id in defines.get(file_id, []):
+            depths.setdefault(symbol_id, 0)
+    edges: list[tuple[str, str, str]] = []
+    queue: deque[str] = deque(sorted(depths))
+    while queue:
+        current = queue.popleft()
+        for source, edge_type in dependents.get(current, []):
+            edges.append((source, current, edge_type))
+            if source not in depths:
+                depths[source] = depths[current] + 1
+                queue.append(source)
+    return depths, edges
+
+
+def select_tests(
+    changed_ids: set[str],
+    depths: dict[str, int],
+    closure_edges: list[tuple[str, str, str]],
+    deps: dict[str, Any],
+) -> list[dict[str, Any]]:
+    table = deps["nodes"]
+    test_files = set(deps.get("test_files", []))
+    whole = changed_ids & test_files
+    whole.update(s for s, _, edge_type in closure_edges if s in test_files and edge_type == "tests")
+    cases: dict[str, list[str]] = defaultdict(list)
+    for nid in depths:
+        if nid in table and table[nid][1] == "test":
+            cases[table[nid][2]].append(nid)
+    selected = []
+    for nid in test_files & depths.keys():
+        path = table[nid][2]
+        names = [] if nid in whole else sorted(table[c][0] for c in cases.get(path, []))
+        selected.append({"path": path, "id": nid, "depth": depths[nid], "cases": names})
+    selected.sort(key=lambda t: (t["depth"], t["path"]))
+    return selected
+
+
+def compute_hotspots(
+    nodes: list[Node],
+    edges: list[Edge],
+    centrality: dict[str, Any] | None = None,
+) -> list[dict[str, Any]]:
+    node_names = {n.id: n.name for n in nodes}
+    if centrality:
+        scored = [(nid, centrality[nid]) for nid in node_names if nid in centrality]
+        scored.sort(key=lambda x: x[1].get("pagerank", 0.0), reverse=True)
+        return [
+            {
+                "id": nid,
+                "name": node_names[nid],
+                "pagerank": score.get("pagerank", 0.0),
+                "in_degree": score.get("in_degree", 0),
+                "out_degree": score.get("out_degree", 0),
+                "edge_count": score.get("in_degree", 0) + score.get("out_degree", 0),
+            }
+            for nid, score in scored[:10]
+        ]
+
     edge_count: dict[str, int] = defaultdict(int)
     for edge in edges:
         edge_count[edge.source] += 1
         edge_count[edge.target] += 1
 
-    node_names = {n.id: n.name for n in nodes}
     ranked = sorted(edge_count.items(), key=lambda x: x[1], reverse=True)
     return [
         {"id": nid, "name": node_names.get(nid, nid), "edge_count": count}
@@ -201,61 +727,684 @@ def compute_hotspots(nodes: list[Node], edges: list[Edge]) -> list[dict[str, Any
     ]
 
 
-def format_md(bundle: ContextBundle, include_evidence: bool) -> str:
-    lines = [f"# Context Bundle: {bundle.query}", ""]
-
-    lines.append(f"## Nodes ({len(bundle.nodes)})")
+def metrics_text(metrics: dict[str, Any]) -> str:
+    parts = [f"{metrics.get('files', 0)} files", f"{metrics.get('loc', 0)} LOC", f"{metrics.get('symbols', 0)} symbols"]
+    if metrics.get("langs"):
+        parts.append("languages " + ", ".join(f"{k} {v}" for k, v in metrics["langs"].items()))
+    if metrics.get("tags"):
+        parts.append("tags " + ", ".join(f"{k} {v}" for k, v in metrics["tags"].items()))
+    if metrics.get("imports"):
+        parts.append(f"imports {len(metrics['imports'])} directories")
+    return "; ".join(parts)
+
+
+def node_lines(node: Node, include_evidence: bool) -> list[str]:
+    lines = [f"### {node.name} ({node.type})"]
+    if node.raw.get("repo"):
+        lines.append(f"- **Repo**: {node.raw['repo']}")
+    if node.path:
+        lines.append(f"- **Path**: {node.path}")
+    if node.lang:
+        lines.append(f"- **Language**: {node.lang}")
+    if node.tags:
+        lines.append(f"- **Tags**: {', '.join(node.tags)}")
+    if node.summary:
+        lines.append(f"- **Summary**: {node.summary}")
+    metrics = node.raw.get("metrics")
+    if metrics:
+        lines.append(f"- **Metrics**: {metrics_text(metrics)}")
+    if include_evidence and node.evidence:
+        lines.append(f"- **Evidence**: {', '.join(format_evidence(ev) for ev in node.evidence)}")
+    if node.snippets:
+        lines.append("")
+        lines.extend(snippet_lines(node.snippets))
     lines.append("")
+    return lines
+
+
+def edge_line(edge: Edge, node_names: dict[str, str]) -> str:
+    src = node_names.get(edge.source, edge.source)
+    tgt = node_names.get(edge.target, edge.target)
+    return f"| {src} | {edge.type} | {tgt} |"
+
+
+def edge_evidence_lines(edge: Edge, node_names: dict[str, str]) -> list[str]:
+    src = node_names.get(edge.source, edge.source)
+    tgt = node_names.get(edge.target, edge.target)
+    return [f"### {src} {edge.type} {tgt}", *snippet_lines(edge.snippets)]
+
+
+def hotspot_line(hs: dict[str, Any]) -> str:
+    if "pagerank" in hs:
+        return (
+            f"- **{hs['name']}**: {hs['in_degree']} in / {hs['out_degree']} out"
+            f" (pagerank {hs['pagerank']:.4g})"
+        )
+    return f"- **{hs['name']}**: {hs['edge_count']} connections"
+
+
+def iter_md(bundle: ContextBundle, include_evidence: bool):
+    yield f"# Context Bundle: {bundle.query}"
+    yield ""
+
+    yield f"## Nodes ({len(bundle.nodes)})"
+    yield ""
     for node in bundle.nodes:
-        lines.append(f"### {node.name} ({node.type})")
-        if node.path:
-            lines.append(f"- **Path**: {node.path}")
-        if node.lang:
-            lines.append(f"- **Language**: {node.lang}")
-        if node.tags:
-            lines.append(f"- **Tags**: {', '.join(node.tags)}")
-        if node.summary:
-            lines.append(f"- **Summary**: {node.summary}")
-        if include_evidence and node.evidence:
-            lines.append(f"- **Evidence**: {', '.join(node.evidence)}")
-        lines.append("")
+        yield from node_lines(node, include_evidence)
 
-    lines.append(f"## Edges ({len(bundle.edges)})")
-    lines.append("")
+    yield f"## Edges ({len(bundle.edges)})"
+    yield ""
     if bundle.edges:
         node_names = {n.id: n.name for n in bundle.nodes}
-        lines.append("| From | Relationship | To |")
-        lines.append("|------|-------------|-----|")
+        yield from EDGE_TABLE_HEADER
         for edge in bundle.edges:
-            src = node_names.get(edge.source, edge.source)
-            tgt = node_names.get(edge.target, edge.target)
-            lines.append(f"| {src} | {edge.type} | {tgt} |")
-        lines.append("")
+            yield edge_line(edge, node_names)
+        yield ""
+
+    edge_snippets = [e for e in bundle.edges if e.snippets]
+    if edge_snippets:
+        node_names = {n.id: n.name for n in bundle.nodes}
+        yield from EDGE_EVIDENCE_HEADER
+        for edge in edge_snippets:
+            yield from edge_evidence_lines(edge, node_names)
+
+    if bundle.matches:
+        yield f"## Search Matches ({len(bundle.matches)})"
+        yield ""
+        for i, match in enumerate(bundle.matches, 1):
+            yield f"{i}. **{match['name']}** (`{match['path']}`) — {match['score']:.3f}"
+        yield ""
+
+    if bundle.paths:
+        node_names = {n.id: n.name for n in bundle.nodes}
+        yield f"## Paths ({len(bundle.paths)})"
+        yield ""
+        for i, path in enumerate(bundle.paths, 1):
+            yield f"{i}. " + " → ".join(node_names.get(nid, nid) for nid in path)
+        yield ""
+
+    if bundle.impact:
+        yield "## Impact"
+        yield ""
+        yield f"- **Changed files**: {bundle.impact['changed_files']}"
+        yield f"- **Affected files**: {bundle.impact['affected_files']}"
+        yield f"- **Affected symbols**: {bundle.impact['affected_symbols']}"
+        yield f"- **Max depth**: {bundle.impact['max_depth']}"
+        yield ""
+
+    if bundle.tests:
+        yield f"## Affected Tests ({len(bundle.tests)} files)"
+        yield ""
+        for test in bundle.tests:
+            selection = ", ".join(test["cases"]) if test["cases"] else "all tests"
+            yield f"- `{test['path']}` — {selection} (depth {test['depth']})"
+        yield ""
 
     if bundle.hotspots:
-        lines.append("## Hotspots")
-        lines.append("")
+        yield from HOTSPOTS_HEADER
         for hs in bundle.hotspots:
-            lines.append(f"- **{hs['name']}**: {hs['edge_count']} connections")
-        lines.append("")
+            yield hotspot_line(hs)
+        yield ""
+
+
+def format_md(bundle: ContextBundle, include_evidence: bool) -> str:
+    return "\n".join(iter_md(bundle, include_evidence))
+
+
+def line_chars(lines: Iterable[str]) -> int:
+    return sum(len(line) + 1 for line in lines)
+
+
+def json_item_chars(obj: Any, depth: int = 2) -> int:
+    text = json.dumps(obj, indent=2)
+    return len(text) + (text.count("\n") + 1) * 2 * depth + 2
+
+
+def pack_bundle(
+    query: str,
+    nodes: list[Node],
+    edges: list[Edge],
+    seeds: set[str],
+    depths: dict[str, int],
+    centrality: dict[str, Any],
+    budget: int,
+    include_evidence: bool,
+    fmt: str,
+    paths: list[list[str]] | None = None,
+    impact: dict[str, int] | None = None,
+    tests: list[dict[str, Any]] | None = None,
+    matches: list[dict[str, Any]] | None = None,
+    readers: dict[str, SnippetReader] | None = None,
+    snippet_bytes: int = 0,
+) -> ContextBundle:
+    node_by_id = {n.id: n for n in nodes}
+    node_names = {n.id: n.name for n in nodes}
+    max_rank = max((centrality.get(n.id, {}).get("pagerank", 0.0) for n in nodes), default=0.0) or 1.0
+
+    def importance(node_id: str) -> float:
+        return centrality.get(node_id, {}).get("pagerank", 0.0) / max_rank
+
+    def hop_decay(node_id: str) -> float:
+        return 1.0 / (1 + depths.get(node_id, 1))
+
+    def node_chars(node: Node) -> int:
+        if fmt == "json":
+            return json_item_chars(dict(node.raw, snippets=node.snippets) if node.snippets else node.raw)
+        return line_chars(node_lines(node, include_evidence))
+
+    def edge_chars(edge: Edge) -> int:
+        if fmt == "json":
+            return json_item_chars(dict(edge.raw, snippets=edge.snippets) if edge.snippets else edge.raw)
+        chars = line_chars([edge_line(edge, node_names)])
+        return chars + line_chars(edge_evidence_lines(edge, node_names)) if edge.snippets else chars
+
+    def section_chars(lines: Iterable[str]) -> int:
+        return JSON_LIST_OVERHEAD if fmt == "json" else line_chars(lines)
+
+    bundle = ContextBundle(
+        query=query, nodes=[], edges=[], hotspots=[], paths=paths or [], impact=impact or {}, tests=tests or [],
+        matches=matches or [],
+    )
+    rendered = "".join(iter_json(bundle)) if fmt == "json" else format_md(bundle, include_evidence)
+    remaining = budget * CHARS_PER_TOKEN - len(rendered) - 1
+    if fmt == "json":
+        remaining -= JSON_LIST_OVERHEAD
+    else:
+        remaining -= len(str(len(nodes))) + len(str(len(edges))) - 2
+    snippets_left = snippet_bytes if include_evidence and readers else 0
+    edge_snippets = False
+
+    def add_snippets(item: Node | Edge, cost: int) -> None:
+        nonlocal remaining, snippets_left, edge_snippets
+        reader = readers.get(item.raw.get("repo", "")) if readers else None
+        if reader is None:
+            return
+        for evidence in item.raw.get("evidence", []):
+            header = 0
+            if fmt != "json" and isinstance(item, Edge) and not edge_snippets:
+                header = line_chars(EDGE_EVIDENCE_HEADER)
+            limit = min(snippets_left, remaining - header)
+            while limit > 0:
+                snippet = reader.read(evidence, limit)
+                if snippet is None:
+                    break
+                item.snippets.append(snippet)
+                grown = (edge_chars(item) if isinstance(item, Edge) else node_chars(item)) + header
+                if grown - cost <= remaining:
+                    remaining -= grown - cost
+                    snippets_left -= len(snippet["text"].encode())
+                    cost = grown - header
+                    edge_snippets = edge_snippets or bool(header)
+                    break
+                item.snippets.pop()
+                limit -= grown - cost - remaining
+            if limit <= 0:
+                return
+
+    items: list[tuple[float, int, Any]] = []
+    for i, node in enumerate(nodes):
+        score = 0.5 * hop_decay(node.id) + 0.5 * importance(node.id)
+        if node.id in seeds:
+            score += 1.0
+        items.append((score, i, node))
+    for i, edge in enumerate(edges):
+        decay = max(hop_decay(edge.source), hop_decay(edge.target))
+        centre = (importance(edge.source) + importance(edge.target)) / 2
+        items.append((edge.confidence * decay * (0.5 + 0.5 * centre), len(nodes) + i, edge))
+    items.sort(key=lambda x: (-x[0], x[1]))
+
+    costs = {n.id: node_chars(n) for n in nodes}
+    picked_ids: set[str] = set()
+    for _, _, item in items:
+        if isinstance(item, Node):
+            if item.id in picked_ids or costs[item.id] > remaining:
+                continue
+            picked_ids.add(item.id)
+            bundle.nodes.append(item)
+            remaining -= costs[item.id]
+            continue
+        missing = [
+            nid for nid in dict.fromkeys((item.source, item.target))
+            if nid in node_by_id and nid not in picked_ids
+        ]
+        header = 0 if bundle.edges else section_chars([*EDGE_TABLE_HEADER, ""])
+        cost = edge_chars(item) + header + sum(costs[nid] for nid in missing)
+        if cost > remaining:
+            continue
+        for nid in missing:
+            picked_ids.add(nid)
+            bundle.nodes.append(node_by_id[nid])
+        bundle.edges.append(item)
+        remaining -= cost
+
+    for hs in compute_hotspots(bundle.nodes, bundle.edges, centrality):
+        header = 0 if bundle.hotspots else section_chars([*HOTSPOTS_HEADER, ""])
+        cost = header + (json_item_chars(hs) if fmt == "json" else line_chars([hotspot_line(hs)]))
+        if cost > remaining:
+            break
+        bundle.hotspots.append(hs)
+        remaining -= cost
+
+    for node in bundle.nodes:
+        add_snippets(node, costs[node.id])
+    for edge in bundle.edges:
+        add_snippets(edge, edge_chars(edge))
+    return bundle
+
 
-    return "\n".join(lines)
+def json_payload(bundle: ContextBundle) -> dict[str, Any]:
+    return {
+        "query": bundle.query,
+        "nodes": [dict(n.raw, snippets=n.snippets) if n.snippets else n.raw for n in bundle.nodes],
+        "edges": [dict(e.raw, snippets=e.snippets) if e.snippets else e.raw for e in bundle.edges],
+        "hotspots": bundle.hotspots,
+        **({"paths": bundle.paths} if bundle.paths else {}),
+        **({"impact": bundle.impact} if bundle.impact else {}),
+        **({"tests": bundle.tests} if bundle.tests else {}),
+        **({"matches": bundle.matches} if bundle.matches else {}),
+    }
+
+
+def iter_json(bundle: ContextBundle) -> Iterator[str]:
+    return json.JSONEncoder(indent=2).iterencode(json_payload(bundle))
 
 
-def format_json(bundle: ContextBundle) -> str:
-    return json.dumps(
-        {
-            "query": bundle.query,
-            "nodes": [n.raw for n in bundle.nodes],
-            "edges": [e.raw for e in bundle.edges],
-            "hotspots": bundle.hotspots,
+def load_manifest(path: Path) -> list[tuple[str, Path]]:
+    text = path.read_text()
+    entries: list[tuple[str, str]] = []
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError:
+        data = None
+    if isinstance(data, dict):
+        entries = [(str(name), str(kg)) for name, kg in data.items()]
+    elif isinstance(data, list):
+        entries = [("", str(kg)) for kg in data]
+    else:
+        for line in text.splitlines():
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            name, sep, kg = line.partition("=")
+            entries.append((name.strip(), kg.strip()) if sep else ("", line))
+    return [(name, (path.parent / kg).resolve()) for name, kg in entries]
+
+
+def repo_name(kg_dir: Path) -> str:
+    meta = load_json(kg_view(kg_dir) / "meta.json")
+    if meta.get("root"):
+        return Path(meta["root"]).name
+    resolved = kg_dir.resolve()
+    if resolved.name == "kg" and resolved.parent.name == "archaeology":
+        return resolved.parent.parent.name
+    return resolved.name
+
+
+def collect_kg_dirs(args: argparse.Namespace) -> list[tuple[str, Path]]:
+    entries: list[tuple[str, Path]] = []
+    if args.manifest:
+        entries.extend(load_manifest(Path(args.manifest)))
+    entries.extend(("", Path(d)) for d in args.kg_dir)
+    if not entries:
+        entries.append(("", Path("./archaeology/kg")))
+
+    named: list[tuple[str, Path]] = []
+    used: set[str] = set()
+    for name, kg_dir in entries:
+        name = name or repo_name(kg_dir)
+        unique = name
+        suffix = 2
+        while unique in used:
+            unique = f"{name}-{suffix}"
+            suffix += 1
+        used.add(unique)
+        named.append((unique, kg_dir))
+    return named
+
+
+def build_filter(args: argparse.Namespace) -> Expr | None:
+    children = []
+    if args.query:
+        children.append(parse_query(args.query))
+    if args.symbol:
+        children.append(Term("name", args.symbol, "auto"))
+    if args.path:
+        children.append(Term("path", args.path, "auto"))
+    if args.tags:
+        children.append(any_of("tag", [t.strip() for t in args.tags.split(",") if t.strip()]))
+    if args.type:
+        children.append(any_of("type", [t.strip() for t in args.type.split(",") if t.strip()]))
+    return all_of(children)
+
+
+def run_query(kg_dir: Path, args: argparse.Namespace) -> QueryResult:
+    if args.impact is not None:
+        return run_impact_query(kg_dir, args)
+    if args.affected_tests is not None:
+        return run_affected_tests_query(kg_dir, args)
+
+    graph = load_pinned_graph(kg_dir)
+    symbol_index = graph.symbol_to_node
+    path_index = graph.path_to_file
+    notes: list[str] = []
+
+    all_nodes = [parse_node(r) for r in graph.nodes.values()]
+    all_edges = [parse_edge(r) for r in graph.edges.values()]
+    node_map = {n.id: n for n in all_nodes}
+
+    if args.from_query and args.to_query:
+        return run_path_query(kg_dir, graph, args, all_nodes, all_edges, node_map)
+
+    expr = build_filter(args)
+    if expr is not None:
+        index = NodeIndex(all_nodes, symbol_index, path_index)
+        trace: list[str] | None = [] if args.explain else None
+        initial_ids = evaluate(expr, index, trace)
+        if trace is not None:
+            notes.append(f"Plan for {kg_dir}: {expr}")
+            notes.extend(f"  {line}" for line in trace)
+    else:
+        initial_ids = set()
+
+    matches: list[dict[str, Any]] = []
+    if args.search:
+        matches = search_matches(
+            kg_dir, args.search, args.top_k, initial_ids if expr is not None else None, node_map, args.explain, notes,
+        )
+        initial_ids = {m["id"] for m in matches}
+
+    if not initial_ids:
+        return QueryResult(node_count=len(all_nodes), notes=notes)
+
+    depths: dict[str, int] = {}
+    result_nodes, result_edges = expand_neighborhood(
+        initial_ids,
+        all_edges,
+        node_map,
+        args.hops,
+        args.max_nodes,
+        args.max_edges,
+        depths,
+    )
+
+    centrality = load_json(kg_view(kg_dir) / "indexes" / "centrality.json")
+    meta = load_json(kg_view(kg_dir) / "meta.json")
+    result_ids = {n.id for n in result_nodes}
+    evidence_paths = {
+        ev.get("path", "")
+        for item in [*result_nodes, *result_edges]
+        for ev in item.raw.get("evidence", [])
+    }
+    return QueryResult(
+        nodes=[n.raw for n in result_nodes],
+        edges=[e.raw for e in result_edges],
+        seeds=sorted(initial_ids & result_ids),
+        centrality={nid: centrality[nid] for nid in result_ids if nid in centrality},
+        depths={nid: d for nid, d in depths.items() if nid in result_ids},
+        node_count=len(all_nodes),
+        root=meta.get("root", ""),
+        hash_algo=meta.get("hash_algo", "sha256"),
+        file_hashes={
+            p: graph.files[p].get("hash", "") for p in evidence_paths if p in graph.files
+        },
+        matches=matches,
+        notes=notes,
+    )
+
+
+def search_matches(
+    kg_dir: Path,
+    text: str,
+    top_k: int,
+    allowed_ids: set[str] | None,
+    node_map: dict[str, Node],
+    explain: bool,
+    notes: list[str],
+) -> list[dict[str, Any]]:
+    try:
+        index = SearchIndex(kg_view(kg_dir) / "indexes" / SEARCH_DIR)
+    except (OSError, ValueError) as e:
+        notes.append(f"Warning: no usable search index in {kg_dir} ({e}); re-run index.py")
+        return []
+    start = time.perf_counter()
+    allowed = index.rows_for(allowed_ids) if allowed_ids is not None else None
+    hits = index.search(text, top_k, allowed)
+    ids = index.ids_for([row for row, _ in hits])
+    if explain:
+        elapsed = (time.perf_counter() - start) * 1000
+        notes.append(
+            f"Search for {kg_dir}: {index.postings_scored} postings over {index.docs} nodes, "
+            f"{len(hits)} hits in {elapsed:.1f} ms"
+        )
+    return [
+        {"id": nid, "name": node_map[nid].name, "path": node_map[nid].path, "score": round(score, 4)}
+        for nid, (_, score) in zip(ids, hits) if nid in node_map
+    ]
+
+
+def run_impact_query(kg_dir: Path, args: argparse.Namespace) -> QueryResult:
+    deps = load_reverse_deps(kg_dir)
+    table = deps["nodes"]
+    changed = set(args.impact)
+    changed_ids = {
+        nid for nid, (_, node_type, path, _) in table.items()
+        if node_type == "file" and path in changed
+    }
+    if not changed_ids:
+        return QueryResult(node_count=len(table))
+
+    depths, closure_edges = impact_closure(changed_ids, deps)
+    centrality = load_json(kg_view(kg_dir) / "indexes" / "centrality.json")
+
+    def rank(nid: str) -> tuple[int, float, str]:
+        return (depths[nid], -centrality.get(nid, {}).get("pagerank", 0.0), nid)
+
+    ranked = sorted((nid for nid in depths if nid in table), key=rank)
+    result_ids = ranked[:args.max_nodes]
+    kept = set(result_ids)
+    closure_edges.sort(key=lambda e: (depths[e[0]], e[0], e[1], e[2]))
+    edge_rows = [e for e in closure_edges if e[0] in kept and e[1] in kept][:args.max_edges]
+
+    meta: dict[str, Any] = {}
+    file_hashes: dict[str, str] = {}
+    if args.include_evidence:
+        graph = load_pinned_graph(kg_dir)
+        meta = load_json(kg_view(kg_dir) / "meta.json")
+        nodes = [graph.nodes[nid] for nid in result_ids if nid in graph.nodes]
+        edges = [graph.edges[e] for e in edge_rows if e in graph.edges]
+        evidence_paths = {ev.get("path", "") for item in [*nodes, *edges] for ev in item.get("evidence", [])}
+        file_hashes = {p: graph.files[p].get("hash", "") for p in evidence_paths if p in graph.files}
+    else:
+        nodes = [
+            {"id": nid, "name": table[nid][0], "type": table[nid][1], "path": table[nid][2], "lang": table[nid][3]}
+            for nid in result_ids
+        ]
+        edges = [{"source": s, "target": t, "type": edge_type} for s, t, edge_type in edge_rows]
+
+    affected = [nid for nid, d in depths.items() if d > 0 and nid in table]
+    return QueryResult(
+        nodes=nodes,
+        edges=edges,
+        seeds=sorted(changed_ids & kept),
+        centrality={nid: centrality[nid] for nid in result_ids if nid in centrality},
+        depths={nid: depths[nid] for nid in result_ids},
+        node_count=len(table),
+        root=meta.get("root", ""),
+        hash_algo=meta.get("hash_algo", "sha256"),
+        file_hashes=file_hashes,
+        impact={
+            "changed_files": len(changed_ids),
+            "affected_files": sum(1 for nid in affected if table[nid][1] == "file"),
+            "affected_symbols": sum(1 for nid in affected if table[nid][1] != "file"),
+            "max_depth": max(depths.values()),
+        },
+    )
+
+
+def run_affected_tests_query(kg_dir: Path, args: argparse.Namespace) -> QueryResult:
+    deps = load_reverse_deps(kg_dir)
+    table = deps["nodes"]
+    changed = set(args.affected_tests)
+    changed_ids = {
+        nid for nid, (_, node_type, path, _) in table.items()
+        if node_type == "file" and path in changed
+    }
+    if not changed_ids:
+        return QueryResult(node_count=len(table))
+
+    depths, closure_edges = impact_closure(changed_ids, deps)
+    tests = select_tests(changed_ids, depths, closure_edges, deps)
+    if not tests:
+        return QueryResult(node_count=len(table))
+    selected_cases = {t["path"] for t in tests if t["cases"]}
+    result_ids = [t["id"] for t in tests] + sorted(
+        (nid for nid in depths if nid in table and table[nid][1] == "test" and table[nid][2] in selected_cases),
+        key=lambda nid: (depths[nid], nid),
+    )
+    result_ids = result_ids[:args.max_nodes]
+    kept = set(result_ids)
+    edge_rows = sorted({e for e in closure_edges if e[0] in kept and e[1] in kept})[:args.max_edges]
+    return QueryResult(
+        nodes=[
+            {"id": nid, "name": table[nid][0], "type": table[nid][1], "path": table[nid][2], "lang": table[nid][3]}
+            for nid in result_ids
+        ],
+        edges=[{"source": s, "target": t, "type": edge_type} for s, t, edge_type in edge_rows],
+        seeds=[t["id"] for t in tests if t["id"] in kept],
+        depths={nid: depths[nid] for nid in result_ids},
+        node_count=len(table),
+        tests=tests,
+    )
+
+
+def run_path_query(
+    kg_dir: Path,
+    graph: GraphData,
+    args: argparse.Namespace,
+    all_nodes: list[Node],
+    all_edges: list[Edge],
+    node_map: dict[str, Node],
+) -> QueryResult:
+    index = NodeIndex(all_nodes, graph.symbol_to_node, graph.path_to_file)
+    sources = resolve_endpoint(args.from_query, index)
+    targets = resolve_endpoint(args.to_query, index)
+    if not sources or not targets:
+        return QueryResult(node_count=len(all_nodes))
+
+    forward, backward = build_adjacency(all_edges, args.undirected)
+    budget = SearchBudget(args.max_visited)
+    paths = k_shortest_paths(sources, targets, forward, backward, args.paths, budget)
+
+    result_ids: list[str] = []
+    depths: dict[str, int] = {}
+    result_edges: list[Edge] = []
+    seen_edges: set[tuple[str, str, str]] = set()
+    for path in paths:
+        for i, nid in enumerate(path.nodes):
+            if nid not in depths:
+                result_ids.append(nid)
+            depths[nid] = min(depths.get(nid, i), i, len(path.nodes) - 1 - i)
+        for edge in path.edges:
+            key = (edge.source, edge.target, edge.type)
+            if key not in seen_edges:
+                seen_edges.add(key)
+                result_edges.append(edge)
+
+    centrality = load_json(kg_view(kg_dir) / "indexes" / "centrality.json")
+    meta = load_json(kg_view(kg_dir) / "meta.json")
+    result_nodes = [node_map[nid] for nid in result_ids if nid in node_map]
+    evidence_paths = {
+        ev.get("path", "")
+        for item in [*result_nodes, *result_edges]
+        for ev in item.raw.get("evidence", [])
+    }
+    return QueryResult(
+        nodes=[n.raw for n in result_nodes],
+        edges=[e.raw for e in result_edges],
+        seeds=sorted((sources | targets) & depths.keys()),
+        centrality={nid: centrality[nid] for nid in depths if nid in centrality},
+        depths=depths,
+        node_count=len(all_nodes),
+        root=meta.get("root", ""),
+        hash_algo=meta.get("hash_algo", "sha256"),
+        file_hashes={
+            p: graph.files[p].get("hash", "") for p in evidence_paths if p in graph.files
         },
-        indent=2,
+        paths=[path.nodes for path in paths],
+        truncated=budget.remaining < 0,
     )
 
 
+def run_federated(
+    kg_dirs: list[tuple[str, Path]],
+    args: argparse.Namespace,
+) -> list[tuple[str, QueryResult]]:
+    workers = min(len(kg_dirs), os.cpu_count() or 1)
+    dirs = [kg_dir for _, kg_dir in kg_dirs]
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(run_query, dirs, [args] * len(dirs)))
+    except (OSError, NotImplementedError, BrokenProcessPool):
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(run_query, dirs, [args] * len(dirs)))
+    return [(name, result) for (name, _), result in zip(kg_dirs, results)]
+
+
+def qualify(repo: str, node_id: str) -> str:
+    return f"{repo}::{node_id}"
+
+
+def merge_results(
+    results: list[tuple[str, QueryResult]],
+    max_nodes: int,
+    max_edges: int,
+) -> tuple[list[Node], list[Edge], dict[str, Any], set[str], dict[str, int]]:
+    ranked_nodes: list[tuple[int, float, Node]] = []
+    edges: list[Edge] = []
+    centrality: dict[str, Any] = {}
+    all_seeds: set[str] = set()
+    depths: dict[str, int] = {}
+    for repo, result in results:
+        seeds = set(result.seeds)
+        all_seeds.update(qualify(repo, nid) for nid in seeds)
+        depths.update((qualify(repo, nid), d) for nid, d in result.depths.items())
+        scale = max(result.node_count, 1)
+        for raw in result.nodes:
+            node = parse_node(dict(raw, id=qualify(repo, raw.get("id", "")), repo=repo))
+            score = result.centrality.get(raw.get("id", ""), {})
+            if score:
+                centrality[node.id] = dict(score, pagerank=score.get("pagerank", 0.0) * scale)
+            importance = score.get("pagerank", 0.0) * scale
+            ranked_nodes.append((0 if raw.get("id") in seeds else 1, -importance, node))
+        for raw in result.edges:
+            edges.append(parse_edge(dict(
+                raw,
+                source=qualify(repo, raw.get("source", "")),
+                target=qualify(repo, raw.get("target", "")),
+                repo=repo,
+            )))
+
+    ranked_nodes.sort(key=lambda x: (x[0], x[1]))
+    nodes = [node for _, _, node in ranked_nodes[:max_nodes]]
+    kept = {node.id for node in nodes}
+    edges = [e for e in edges if e.source in kept and e.target in kept]
+    edges.sort(key=lambda e: e.confidence, reverse=True)
+    return nodes, edges[:max_edges], centrality, all_seeds, depths
+
+
 def build_query_description(args: argparse.Namespace) -> str:
     parts = []
+    if args.impact is not None:
+        parts.append(f"impact={','.join(args.impact)}")
+    if args.affected_tests is not None:
+        parts.append(f"affected_tests={','.join(args.affected_tests)}")
+    if args.search:
+        parts.append(f"search={args.search}")
+    if args.from_query and args.to_query:
+        parts.append(f"from={args.from_query}")
+        parts.append(f"to={args.to_query}")
+    if args.query:
+        parts.append(f"query={args.query}")
     if args.symbol:
         parts.append(f"symbol={args.symbol}")
     if args.path:
@@ -273,117 +1422,312 @@ def main() -> None:
     )
     parser.add_argument(
         "kg_dir",
-        nargs="?",
-        default="./archaeology/kg",
-        help="Knowledge graph directory (default: ./archaeology/kg)",
+        nargs="*",
+        help="Knowledge graph directories; several are queried in parallel (default: ./archaeology/kg)",
+    )
+    parser.add_argument(
+        "--manifest",
+        help="File listing KG directories to federate (JSON object name->dir, JSON list, or one [name=]dir per line)",
+    )
+    parser.add_argument(
+        "--query",
+        "-q",
+        help="Boolean filter expression, e.g. 'type:function AND path:src/api AND NOT tag:test OR symbol:~parse'",
+    )
+    parser.add_argument(
+        "--explain",
+        action="store_true",
+        help="Print the filter evaluation plan with estimated and actual sizes to stderr",
+    )
+    parser.add_argument(
+        "--search",
+        help="Rank nodes by TF-IDF similarity of identifier, path and summary subtokens to this text",
+    )
+    parser.add_argument(
+        "--top-k",
+        type=int,
+        default=DEFAULT_SEARCH_TOP_K,
+        help=f"Number of --search matches used as seeds (default: {DEFAULT_SEARCH_TOP_K})",
     )
     parser.add_argument("--symbol", help="Find nodes matching this symbol name")
     parser.add_argument("--path", help="Find nodes related to this file path (partial match)")
     parser.add_argument("--tags", help="Filter nodes by tags (comma-separated)")
     parser.add_argument("--type", help="Filter by node type (comma-separated)")
+    parser.add_argument("--from", dest="from_query", help="Path query start: symbol name or file path")
+    parser.add_argument("--to", dest="to_query", help="Path query end: symbol name or file path")
+    parser.add_argument(
+        "--paths",
+        type=int,
+        default=DEFAULT_PATH_COUNT,
+        help=f"Number of shortest paths to return for --from/--to (default: {DEFAULT_PATH_COUNT})",
+    )
+    parser.add_argument(
+        "--max-visited",
+        type=int,
+        default=DEFAULT_MAX_VISITED,
+        help=f"Node visit budget for path search (default: {DEFAULT_MAX_VISITED})",
+    )
+    parser.add_argument(
+        "--undirected",
+        action="store_true",
+        help="Let path search traverse edges in either direction",
+    )
+    parser.add_argument(
+        "--impact",
+        action="append",
+        nargs="?",
+        const="-",
+        metavar="PATH[,PATH...]",
+        help="Rank everything that transitively depends on these changed files; repeatable (reads stdin if none given)",
+    )
+    parser.add_argument(
+        "--affected-tests",
+        action="append",
+        nargs="?",
+        const="-",
+        metavar="PATH[,PATH...]",
+        help="Select the tests reachable from these changed files; repeatable (reads stdin if none given)",
+    )
     parser.add_argument("--hops", type=int, default=1, help="Neighborhood expansion depth (default: 1, max: 3)")
-    parser.add_argument("--max-nodes", type=int, default=30, help="Maximum nodes to return (default: 30)")
-    parser.add_argument("--max-edges", type=int, default=60, help="Maximum edges to return (default: 60)")
+    parser.add_argument("--max-nodes", type=int, help=f"Maximum nodes to return (default: {DEFAULT_MAX_NODES})")
+    parser.add_argument("--max-edges", type=int, help=f"Maximum edges to return (default: {DEFAULT_MAX_EDGES})")
+    parser.add_argument(
+        "--token-budget",
+        type=int,
+        help="Pack the most relevant nodes and edges into at most N estimated tokens",
+    )
     parser.add_argument("--format", choices=["md", "json"], default="md", help="Output format (default: md)")
-    parser.add_argument("--include-evidence", action="store_true", help="Include evidence pointers in output")
+    parser.add_argument(
+        "--include-evidence",
+        action="store_true",
+        help="Include evidence pointers and the source snippets they point to",
+    )
+    parser.add_argument(
+        "--snippet-bytes",
+        type=int,
+        default=DEFAULT_SNIPPET_BYTES,
+        help=f"Total byte budget for evidence snippets (default: {DEFAULT_SNIPPET_BYTES})",
+    )
     parser.add_argument("--summary", action="store_true", help="Show only the top-level KG.md summary")
+    parser.add_argument("--no-cache", action="store_true", help="Bypass the on-disk query result cache")
+    parser.add_argument(
+        "--cache-max-mb",
+        type=int,
+        default=DEFAULT_QUERY_CACHE_MAX_MB,
+        help=f"Query result cache size limit in MB (default: {DEFAULT_QUERY_CACHE_MAX_MB})",
+    )
 
     args = parser.parse_args()
     args.hops = min(max(args.hops, 0), 3)
-
-    has_filter = any([args.symbol, args.path, args.tags, args.type])
+    if args.max_nodes is None:
+        args.max_nodes = TOKEN_BUDGET_MAX_NODES if args.token_budget else DEFAULT_MAX_NODES
+    if args.max_edges is None:
+        args.max_edges = TOKEN_BUDGET_MAX_EDGES if args.token_budget else DEFAULT_MAX_EDGES
+
+    if bool(args.from_query) != bool(args.to_query):
+        parser.error("--from and --to must be given together")
+
+    if args.impact is not None and args.affected_tests is not None:
+        parser.error("--impact and --affected-tests cannot be combined")
+    if args.search and (args.impact is not None or args.affected_tests is not None or args.from_query):
+        parser.error("--search cannot be combined with --impact, --affected-tests or --from/--to")
+    if args.top_k < 1:
+        parser.error("--top-k must be at least 1")
+    for name in ("impact", "affected_tests"):
+        changed = getattr(args, name)
+        if changed is None:
+            continue
+        changed = [p for value in changed for p in value.split(",")]
+        if "-" in changed:
+            changed.remove("-")
+            changed += [] if sys.stdin.isatty() else sys.stdin.read().splitlines()
+        setattr(args, name, sorted({p.strip().removeprefix("./") for p in changed if p.strip()}))
+
+    if args.query:
+        try:
+            parse_query(args.query)
+        except QueryError as e:
+            parser.error(f"--query: {e}")
+
+    has_filter = any([
+        args.query, args.search, args.symbol, args.path, args.tags, args.type, args.from_query, args.impact,
+        args.affected_tests,
+    ])
     if not has_filter and not args.summary:
-        print("Usage: query_graph.py [OPTIONS] [KG_DIR]")
+        print("Usage: query_graph.py [OPTIONS] [KG_DIR ...]")
         print()
         print("Provide at least one query filter:")
+        print("  --query EXPR     Boolean filter, e.g. 'type:function AND NOT tag:test'")
+        print("  --search TEXT    Rank nodes by similarity to free text, e.g. 'retry backoff'")
         print("  --symbol NAME    Find nodes matching a symbol name")
         print("  --path PATH      Find nodes related to a file path")
         print("  --tags TAG,...   Filter nodes by tags")
         print("  --type TYPE,...  Filter by node type")
+        print("  --from X --to Y  Shortest paths between two symbols or files")
+        print("  --impact [PATH,...]  Transitive dependents of changed files (or stdin)")
+        print("  --affected-tests [PATH,...]  Tests reachable from changed files (or stdin)")
         print()
         print("Other options:")
         print("  --hops N         Neighborhood depth (default: 1, max: 3)")
+        print("  --paths K        Paths returned by --from/--to (default: 3)")
+        print("  --top-k N        Matches kept by --search (default: 10)")
+        print("  --undirected     Let path search ignore edge direction")
         print("  --max-nodes N    Max nodes returned (default: 30)")
         print("  --max-edges N    Max edges returned (default: 60)")
+        print("  --token-budget N Pack output into N estimated tokens")
         print("  --format md|json Output format (default: md)")
-        print("  --include-evidence  Include evidence pointers")
+        print("  --include-evidence  Include evidence pointers and source snippets")
+        print("  --snippet-bytes N   Byte budget for evidence snippets (default: 16000)")
         print("  --summary        Show KG.md summary")
+        print("  --no-cache       Bypass the query result cache")
+        print("  --manifest FILE  Federate the KG directories listed in FILE")
         sys.exit(0)
 
-    kg_dir = Path(args.kg_dir)
-    if not kg_dir.exists():
-        print(f"Error: Knowledge graph directory not found: {kg_dir}", file=sys.stderr)
-        sys.exit(1)
+    kg_dirs = collect_kg_dirs(args)
+    for _, kg_dir in kg_dirs:
+        if not kg_dir.exists():
+            print(f"Error: Knowledge graph directory not found: {kg_dir}", file=sys.stderr)
+            sys.exit(1)
+    kg_dir = kg_dirs[0][1]
 
     if args.summary:
-        kg_md = kg_dir / "KG.md"
-        if kg_md.exists():
-            print(kg_md.read_text())
-        else:
-            print(f"Error: No KG.md found in {kg_dir}", file=sys.stderr)
+        missing = [d for _, d in kg_dirs if not (kg_view(d) / "KG.md").exists()]
+        if missing:
+            print(f"Error: No KG.md found in {missing[0]}", file=sys.stderr)
             sys.exit(1)
+        for name, d in kg_dirs:
+            if len(kg_dirs) > 1:
+                print(f"<!-- repo: {name} -->")
+            print((kg_view(d) / "KG.md").read_text())
         return
 
-    symbol_index = load_json(kg_dir / "symbol_to_node.json")
-    path_index = load_json(kg_dir / "path_to_file.json")
-    raw_nodes = load_jsonl(kg_dir / "nodes.jsonl")
-    raw_edges = load_jsonl(kg_dir / "edges.jsonl")
-
-    all_nodes = [parse_node(r) for r in raw_nodes]
-    all_edges = [parse_edge(r) for r in raw_edges]
-    node_map = {n.id: n for n in all_nodes}
-
-    candidate_sets: list[set[str]] = []
-
-    if args.symbol:
-        candidate_sets.append(resolve_by_symbol(args.symbol, symbol_index, all_nodes))
-
-    if args.path:
-        candidate_sets.append(resolve_by_path(args.path, path_index, all_nodes))
-
-    if args.tags:
-        tag_list = [t.strip() for t in args.tags.split(",") if t.strip()]
-        candidate_sets.append(resolve_by_tags(tag_list, all_nodes))
-
-    if args.type:
-        type_list = [t.strip() for t in args.type.split(",") if t.strip()]
-        candidate_sets.append(resolve_by_type(type_list, all_nodes))
-
-    if candidate_sets:
-        initial_ids = candidate_sets[0]
-        for s in candidate_sets[1:]:
-            initial_ids &= s
+    cache = None
+    cache_key = ""
+    if not args.no_cache:
+        cache = QueryCache(kg_dir / QUERY_CACHE_DIR, args.cache_max_mb * 1024 * 1024)
+        version = ",".join(graph_version(d) for _, d in kg_dirs)
+        cache_key = query_cache_key(args, version, [d for _, d in kg_dirs])
+        cached = cache.get(cache_key)
+        if cached is not None:
+            output, notes = cached
+            for note in notes:
+                print(note, file=sys.stderr)
+            print(output)
+            return
+
+    if len(kg_dirs) == 1:
+        result = run_query(kg_dir, args)
+        result_nodes = [parse_node(r) for r in result.nodes]
+        result_edges = [parse_edge(r) for r in result.edges]
+        centrality = result.centrality
+        seeds = set(result.seeds)
+        depths = result.depths
+        paths = result.paths
+        truncated = result.truncated
+        impact = result.impact
+        tests = result.tests
+        matches = result.matches
+        notes = list(result.notes)
+        readers = {"": SnippetReader(kg_dir, result.root, result.hash_algo, result.file_hashes)}
     else:
-        initial_ids = set()
-
-    if not initial_ids:
+        results = run_federated(kg_dirs, args)
+        result_nodes, result_edges, centrality, seeds, depths = merge_results(
+            results, args.max_nodes, args.max_edges,
+        )
+        paths = [[qualify(repo, nid) for nid in p] for repo, res in results for p in res.paths]
+        paths.sort(key=len)
+        del paths[args.paths:]
+        truncated = any(res.truncated for _, res in results)
+        impact: dict[str, int] = {}
+        for _, res in results:
+            for key, value in res.impact.items():
+                impact[key] = max(impact.get(key, 0), value) if key == "max_depth" else impact.get(key, 0) + value
+        tests = [
+            dict(t, path=qualify(repo, t["path"]), id=qualify(repo, t["id"])) for repo, res in results for t in res.tests
+        ]
+        tests.sort(key=lambda t: (t["depth"], t["path"]))
+        matches = [
+            dict(m, id=qualify(repo, m["id"]), path=qualify(repo, m["path"])) for repo, res in results for m in res.matches
+        ]
+        matches.sort(key=lambda m: (-m["score"], m["id"]))
+        del matches[args.top_k:]
+        notes = [note for _, res in results for note in res.notes]
+        dirs = dict(kg_dirs)
+        readers = {
+            repo: SnippetReader(dirs[repo], res.root, res.hash_algo, res.file_hashes)
+            for repo, res in results
+        }
+
+    if truncated:
+        notes.append(f"Warning: path search stopped after visiting {args.max_visited} nodes")
+    for note in notes:
+        print(note, file=sys.stderr)
+
+    if not result_nodes:
         query_desc = build_query_description(args)
-        print(f"No nodes found matching query: {query_desc}", file=sys.stderr)
+        if args.from_query:
+            print(f"No path found: {query_desc}", file=sys.stderr)
+        elif args.affected_tests is not None:
+            print(f"No affected tests: {query_desc}", file=sys.stderr)
+        else:
+            print(f"No nodes found matching query: {query_desc}", file=sys.stderr)
         sys.exit(1)
 
-    result_nodes, result_edges = expand_neighborhood(
-        initial_ids,
-        all_edges,
-        node_map,
-        args.hops,
-        args.max_nodes,
-        args.max_edges,
-    )
-
-    hotspots = compute_hotspots(result_nodes, result_edges)
     query_desc = build_query_description(args)
-
-    bundle = ContextBundle(
-        query=query_desc,
-        nodes=result_nodes,
-        edges=result_edges,
-        hotspots=hotspots,
-    )
-
-    if args.format == "json":
-        print(format_json(bundle))
+    if args.token_budget:
+        bundle = pack_bundle(
+            query_desc, result_nodes, result_edges, seeds, depths, centrality,
+            args.token_budget, args.include_evidence, args.format, paths, impact, tests, matches,
+            readers, args.snippet_bytes,
+        )
     else:
-        print(format_md(bundle, args.include_evidence))
+        bundle = ContextBundle(
+            query=query_desc,
+            nodes=result_nodes,
+            edges=result_edges,
+            hotspots=compute_hotspots(result_nodes, result_edges, centrality),
+            paths=paths,
+            impact=impact,
+            tests=tests,
+            matches=matches,
+        )
+
+    if args.include_evidence and not args.token_budget:
+        materialize_snippets(bundle, readers, args.snippet_bytes)
+    files: dict[str, list[int] | None] = {}
+    for reader in readers.values():
+        files.update(reader.stamps())
+        reader.close()
+
+    emit_bundle(bundle, args, cache, cache_key, notes, files)
+
+
+def emit_bundle(
+    bundle: ContextBundle,
+    args: argparse.Namespace,
+    cache: QueryCache | None,
+    cache_key: str,
+    notes: list[str],
+    files: dict[str, list[int] | None],
+) -> None:
+    if args.format == "json":
+        chunks: list[str] = []
+        for chunk in iter_json(bundle):
+            sys.stdout.write(chunk)
+            chunks.append(chunk)
+        sys.stdout.write("\n")
+        sys.stdout.flush()
+        if cache is not None:
+            cache.put(cache_key, "".join(chunks), notes, files)
+        return
+
+    written: list[str] = []
+    for line in iter_md(bundle, args.include_evidence):
+        sys.stdout.write(line + "\n")
+        written.append(line)
+    sys.stdout.flush()
+    if cache is not None:
+        cache.put(cache_key, "\n".join(written), notes, files)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,342 @@
+from __future__ import annotations
+
+import bisect
+import fnmatch
+import re
+from dataclasses import dataclass, field
+from typing import Any, Union
+
+
+FIELD_ALIASES = {
+    "type": "type",
+    "tag": "tag",
+    "tags": "tag",
+    "path": "path",
+    "symbol": "name",
+    "name": "name",
+    "lang": "lang",
+    "id": "id",
+}
+
+CASE_INSENSITIVE_FIELDS = {"type", "tag", "lang"}
+
+TOKEN_RE = re.compile(r'\s*(?:(\()|(\))|((?:[A-Za-z_]+:)?"(?:[^"\\]|\\.)*")|([^\s()]+))')
+
+ESTIMATE_SAMPLE = 64
+
+ROLLUP_TYPES = ("module", "package")
+
+
+class QueryError(ValueError):
+    pass
+
+
+@dataclass
+class Term:
+    field: str
+    value: str
+    mode: str = "exact"
+
+    def __str__(self) -> str:
+        prefix = {"substring": "~", "auto": "?"}.get(self.mode, "")
+        return f"{self.field}:{prefix}{self.value}"
+
+
+@dataclass
+class BoolExpr:
+    op: str
+    children: list[Expr] = field(default_factory=list)
+
+    def __str__(self) -> str:
+        if self.op == "not":
+            return f"NOT {self.children[0]}"
+        return "(" + f" {self.op.upper()} ".join(str(c) for c in self.children) + ")"
+
+
+Expr = Union[Term, BoolExpr]
+
+
+def tokenize(text: str) -> list[str]:
+    tokens: list[str] = []
+    pos = 0
+    text = text.strip()
+    while pos < len(text):
+        m = TOKEN_RE.match(text, pos)
+        if not m or m.end() == pos:
+            raise QueryError(f"unexpected input at offset {pos}: {text[pos:pos + 20]!r}")
+        tokens.append(next(g for g in m.groups() if g is not None))
+        pos = m.end()
+        while pos < len(text) and text[pos].isspace():
+            pos += 1
+    return tokens
+
+
+def parse_term(token: str) -> Term:
+    if ":" not in token:
+        raise QueryError(f"expected field:value, got {token!r}")
+    name, value = token.split(":", 1)
+    field_name = FIELD_ALIASES.get(name.lower())
+    if field_name is None:
+        raise QueryError(f"unknown field {name!r} (expected one of {', '.join(sorted(FIELD_ALIASES))})")
+    mode = "exact"
+    if value.startswith("~"):
+        mode, value = "substring", value[1:]
+    if len(value) >= 2 and value[0] == value[-1] == '"':
+        value = re.sub(r"\\(.)", r"\1", value[1:-1])
+    if not value:
+        raise QueryError(f"empty value for field {name!r}")
+    if mode == "exact" and any(c in value for c in "*?["):
+        mode = "glob"
+    if field_name in CASE_INSENSITIVE_FIELDS or mode == "substring":
+        value = value.lower()
+    return Term(field_name, value, mode)
+
+
+def parse_query(text: str) -> Expr:
+    tokens = tokenize(text)
+    if not tokens:
+        raise QueryError("empty query")
+    pos = 0
+
+    def peek() -> str:
+        return tokens[pos] if pos < len(tokens) else ""
+
+    def parse_or() -> Expr:
+        nonlocal pos
+        children = [parse_and()]
+        while peek().upper() == "OR":
+            pos += 1
+            children.append(parse_and())
+        return children[0] if len(children) == 1 else BoolExpr("or", children)
+
+    def parse_and() -> Expr:
+        nonlocal pos
+        children = [parse_not()]
+        while peek() and peek() != ")" and peek().upper() != "OR":
+            if peek().upper() == "AND":
+                pos += 1
+            children.append(parse_not())
+        return children[0] if len(children) == 1 else BoolExpr("and", children)
+
+    def parse_not() -> Expr:
+        nonlocal pos
+        if peek().upper() == "NOT":
+            pos += 1
+            return BoolExpr("not", [parse_not()])
+        return parse_atom()
+
+    def parse_atom() -> Expr:
+        nonlocal pos
+        token = peek()
+        if not token:
+            raise QueryError("unexpected end of query")
+        pos += 1
+        if token == "(":
+            expr = parse_or()
+            if peek() != ")":
+                raise QueryError("missing closing parenthesis")
+            pos += 1
+            return expr
+        if token == ")" or token.upper() in ("AND", "OR"):
+            raise QueryError(f"unexpected {token!r}")
+        return parse_term(token)
+
+    expr = parse_or()
+    if pos != len(tokens):
+        raise QueryError(f"unexpected {tokens[pos]!r}")
+    return expr
+
+
+def all_of(children: list[Expr]) -> Expr | None:
+    if not children:
+        return None
+    return children[0] if len(children) == 1 else BoolExpr("and", children)
+
+
+def any_of(field_name: str, values: list[str]) -> Expr:
+    terms: list[Expr] = [Term(field_name, v.lower()) for v in values]
+    return terms[0] if len(terms) == 1 else BoolExpr("or", terms)
+
+
+class NodeIndex:
+    def __init__(self, nodes: list[Any], symbol_index: dict[str, Any], path_index: dict[str, Any]) -> None:
+        self.nodes = {n.id: n for n in nodes}
+        self.universe = set(self.nodes)
+        self.postings: dict[str, dict[str, set[str]]] = {f: {} for f in set(FIELD_ALIASES.values())}
+        for n in nodes:
+            for field_name in self.postings:
+                for value in node_values(n, field_name):
+                    self.postings[field_name].setdefault(value, set()).add(n.id)
+        self.sorted_keys = {f: sorted(p) for f, p in self.postings.items()}
+        self.totals = {f: sum(len(ids) for ids in p.values()) for f, p in self.postings.items()}
+        self.symbol_index = symbol_index
+        self.path_index = path_index
+        self.legacy_cache: dict[tuple[str, str], set[str]] = {}
+
+    def scan(self, term: Term) -> set[str]:
+        postings = self.postings[term.field]
+        if term.mode == "exact" and term.field != "path":
+            return postings.get(term.value, set())
+        if term.mode == "auto":
+            return self.legacy(term)
+        result: set[str] = set()
+        for key in self.matching_keys(term):
+            result |= postings[key]
+        return result
+
+    def matching_keys(self, term: Term) -> list[str]:
+        keys = self.sorted_keys[term.field]
+        if term.mode == "exact":
+            prefix = term.value.rstrip("/") + "/"
+            lo = bisect.bisect_left(keys, prefix)
+            hi = bisect.bisect_left(keys, prefix[:-1] + "0")
+            exact = [term.value] if term.value in self.postings[term.field] else []
+            return exact + keys[lo:hi]
+        return [k for k in keys if term_matches_value(term, k)]
+
+    def legacy(self, term: Term) -> set[str]:
+        cached = self.legacy_cache.get((term.field, term.value))
+        if cached is not None:
+            return cached
+        ids: set[str] = set()
+        if term.field == "name":
+            val = self.symbol_index.get(term.value)
+            if val is not None:
+                ids.update(val if isinstance(val, list) else [str(val)])
+        else:
+            directory = term.value.rstrip("/") or "."
+            ids.update(
+                i for i in self.postings["path"].get(directory, ()) if self.nodes[i].type in ROLLUP_TYPES
+            )
+            for indexed_path, val in self.path_index.items() if not ids else ():
+                if term.value in indexed_path:
+                    ids.update(val if isinstance(val, list) else [str(val)])
+        if not ids:
+            fallback = Term(term.field, term.value.lower(), "substring")
+            for key in self.matching_keys(fallback):
+                ids |= self.postings[term.field][key]
+        self.legacy_cache[(term.field, term.value)] = ids
+        return ids
+
+    def cost(self, expr: Expr) -> int:
+        if isinstance(expr, BoolExpr):
+            return sum(self.cost(c) for c in expr.children)
+        if expr.mode == "exact" and expr.field != "path":
+            return 1
+        if expr.mode == "exact":
+            return len(self.sorted_keys["path"]).bit_length() + self.estimate(expr)
+        return len(self.sorted_keys[expr.field]) + self.estimate(expr)
+
+    def estimate(self, expr: Expr) -> int:
+        n = len(self.universe)
+        if isinstance(expr, BoolExpr):
+            if expr.op == "not":
+                return max(0, n - self.estimate(expr.children[0]))
+            estimates = [self.estimate(c) for c in expr.children]
+            if expr.op == "or":
+                return min(n, sum(estimates))
+            result = float(min(estimates))
+            for e in sorted(estimates)[1:]:
+                result *= e / n if n else 0
+            return int(result + 0.5)
+        postings = self.postings[expr.field]
+        if expr.mode == "exact" and expr.field != "path":
+            return len(postings.get(expr.value, ()))
+        keys = self.sorted_keys[expr.field]
+        if not keys:
+            return 0
+        if expr.mode == "exact":
+            matched = self.matching_keys(expr)
+            return int(len(matched) * self.totals[expr.field] / len(keys) + 0.5)
+        step = max(1, len(keys) // ESTIMATE_SAMPLE)
+        sample = keys[::step]
+        probe = Term(expr.field, expr.value.lower(), "substring") if expr.mode == "auto" else expr
+        hits = sum(1 for k in sample if term_matches_value(probe, k))
+        if expr.mode == "auto" and not hits:
+            hits = 1
+        return int(self.totals[expr.field] * hits / len(sample) + 0.5)
+
+    def matches(self, node_id: str, expr: Expr) -> bool:
+        if isinstance(expr, BoolExpr):
+            if expr.op == "not":
+                return not self.matches(node_id, expr.children[0])
+            if expr.op == "and":
+                return all(self.matches(node_id, c) for c in expr.children)
+            return any(self.matches(node_id, c) for c in expr.children)
+        if expr.mode == "auto":
+            return node_id in self.legacy(expr)
+        node = self.nodes[node_id]
+        return any(term_matches_value(expr, v) for v in node_values(node, expr.field))
+
+
+def node_values(node: Any, field_name: str) -> list[str]:
+    if field_name == "tag":
+        return [t.lower() for t in node.tags]
+    if field_name == "name":
+        return [node.name] if node.name else []
+    value = getattr(node, field_name, "") or ""
+    if field_name in CASE_INSENSITIVE_FIELDS:
+        value = value.lower()
+    return [value] if value else []
+
+
+def term_matches_value(term: Term, value: str) -> bool:
+    if term.mode == "substring":
+        return term.value in value.lower()
+    if term.mode == "glob":
+        return fnmatch.fnmatchcase(value, term.value)
+    if term.field == "path":
+        return value == term.value or value.startswith(term.value.rstrip("/") + "/")
+    return value == term.value
+
+
+def evaluate(expr: Expr, index: NodeIndex, trace: list[str] | None = None, depth: int = 0) -> set[str]:
+    pad = "  " * depth
+    if isinstance(expr, Term):
+        result = index.scan(expr)
+        if trace is not None:
+            trace.append(f"{pad}scan {expr} (est {index.estimate(expr)}, cost {index.cost(expr)}) -> {len(result)}")
+        return result
+
+    if expr.op == "not":
+        inner = evaluate(expr.children[0], index, trace, depth + 1)
+        if trace is not None:
+            trace.append(f"{pad}complement -> {len(index.universe) - len(inner)}")
+        return index.universe - inner
+
+    if expr.op == "or":
+        result: set[str] = set()
+        for child in sorted(expr.children, key=index.cost):
+            result = result | evaluate(child, index, trace, depth + 1)
+            if len(result) == len(index.universe):
+                break
+        if trace is not None:
+            trace.append(f"{pad}union -> {len(result)}")
+        return result
+
+    positives = [c for c in expr.children if not (isinstance(c, BoolExpr) and c.op == "not")]
+    negatives = [c.children[0] for c in expr.children if isinstance(c, BoolExpr) and c.op == "not"]
+    plan = sorted(positives, key=lambda c: (index.estimate(c), index.cost(c)))
+    if plan:
+        result = evaluate(plan[0], index, trace, depth + 1)
+    else:
+        result = index.universe
+    steps = [(c, False) for c in plan[1:]]
+    steps += sorted(((c, True) for c in negatives), key=lambda s: -index.estimate(s[0]))
+    for step, (child, negate) in enumerate(steps):
+        if not result:
+            if trace is not None:
+                trace.append(f"{pad}empty, skipping {len(steps) - step} remaining terms")
+            break
+        if len(result) <= index.cost(child):
+            result = {i for i in result if index.matches(i, child) != negate}
+            if trace is not None:
+                trace.append(f"{pad}probe {'NOT ' if negate else ''}{child} on candidates -> {len(result)}")
+            continue
+        other = evaluate(child, index, trace, depth + 1)
+        result = result - other if negate else result & other
+        if trace is not None:
+            trace.append(f"{pad}{'subtract' if negate else 'intersect'} -> {len(result)}")
+    if trace is not None:
+        trace.append(f"{pad}and -> {len(result)}")
+    return result
@@ -0,0 +1,354 @@
+from __future__ import annotations
+
+import re
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Set, Tuple, Type
+
+
+IDENT_RE = re.compile(r"\b[A-Za-z_]\w*\b")
+
+CALL_RE = re.compile(r"\b([A-Za-z_][\w.]*)\s*\(")
+
+ATTRIBUTE_RE = re.compile(r"\b([A-Za-z_]\w*)\.([A-Za-z_]\w*)\b")
+
+IMPORT_LINE_RE = re.compile(r"^\s*(?:import|from|using|require|use)\b|\brequire\s*\(")
+
+IO_CALLS: Dict[str, Set[str]] = {
+    "python": {
+        "open", "print", "input", "urlopen", "requests.get", "requests.post", "requests.put",
+        "requests.delete", "requests.request", "subprocess.run", "subprocess.Popen", "subprocess.call",
+        "subprocess.check_output", "os.system", "os.remove", "os.unlink", "os.makedirs", "os.listdir",
+        "shutil.copy", "shutil.move", "shutil.rmtree", "socket.socket", "sqlite3.connect",
+        "psycopg2.connect", "boto3.client", "boto3.resource",
+    },
+    "javascript": {
+        "fetch", "axios", "axios.get", "axios.post", "axios.put", "axios.delete", "fs.readFileSync",
+        "fs.writeFileSync", "fs.readFile", "fs.writeFile", "fs.unlinkSync", "http.request",
+        "https.request", "localStorage.getItem", "localStorage.setItem", "console.log",
+        "child_process.exec", "execSync", "spawnSync",
+    },
+    "go": {
+        "os.Open", "os.Create", "os.ReadFile", "os.WriteFile", "os.Remove", "ioutil.ReadFile",
+        "ioutil.WriteFile", "http.Get", "http.Post", "http.NewRequest", "sql.Open", "exec.Command",
+        "fmt.Println", "fmt.Printf", "net.Dial",
+    },
+    "java": {
+        "Files.readAllLines", "Files.readString", "Files.write", "Files.writeString",
+        "System.out.println", "DriverManager.getConnection", "HttpClient.newHttpClient",
+    },
+    "ruby": {"File.read", "File.write", "File.open", "Net::HTTP.get", "puts", "system"},
+}
+IO_CALLS["typescript"] = IO_CALLS["javascript"]
+IO_CALLS["kotlin"] = IO_CALLS["java"] | {"println", "readLine", "File"}
+
+IO_METHODS = {
+    "execute", "executemany", "urlopen", "read_text", "write_text", "read_bytes", "write_bytes",
+    "Query", "QueryRow", "Exec", "executeQuery", "executeUpdate",
+}
+
+IO_NAME_HINT = re.compile(
+    r"read|write|load|save|fetch|send|get|post|put|delete|open|close|print|log|dump|query|request|"
+    r"download|upload|sync|flush|connect|main|run|cli|handle|export|import|store|persist|io",
+    re.IGNORECASE,
+)
+
+MUTABLE_ASSIGNMENTS: Dict[str, re.Pattern] = {
+    "python": re.compile(
+        r"^([A-Za-z_]\w*)\s*(?::[^=]+)?=\s*(?:\[|\{|dict\(|list\(|set\(|defaultdict\(|deque\(|OrderedDict\()"
+    ),
+    "javascript": re.compile(r"^(?:export\s+)?(?:let|var)\s+(\w+)\b|^(?:export\s+)?const\s+(\w+)\s*=\s*(?:\[|\{|new\s+(?:Map|Set)\b)"),
+    "go": re.compile(r"^var\s+(\w+)\s*(?:=\s*)?(?:map\[|\[\]|make\()"),
+}
+MUTABLE_ASSIGNMENTS["typescript"] = MUTABLE_ASSIGNMENTS["javascript"]
+
+MUTATING_METHODS = r"append|extend|insert|pop|remove|clear|update|setdefault|add|discard|push|splice|shift|unshift|set|delete"
+
+CONFIG_LOOKUP_RE = re.compile(
+    r"os\.environ\s*\[\s*['\"]|os\.environ\.get\(\s*['\"]|os\.getenv\(\s*['\"]|process\.env\.[A-Z_]|"
+    r"process\.env\s*\[\s*['\"]|System\.getenv\(\s*\"|os\.Getenv\(\s*\"|ENV\[\s*['\"]|"
+    r"\b(?:config|settings|conf|cfg|options)(?:\.get|\.getString|\.getInt)?\s*[\[\(]\s*['\"]"
+)
+
+STATE_GUARD_RE = re.compile(
+    r"(?:\bif\s+not\s+|\bif\s*\(\s*!\s*|\bassert\s+|\bif\s+)(?:self|this)\.\s*_?\w*"
+    r"(?:initiali[sz]ed|started|opened|connected|ready|setup|loaded|configured|bound)\b",
+    re.IGNORECASE,
+)
+
+ORDER_ERROR_RE = re.compile(
+    r"(?:raise|throw)\b.*(?:not (?:yet )?(?:initiali[sz]ed|started|connected|opened|set ?up)|must (?:first )?(?:call|be called))",
+    re.IGNORECASE,
+)
+
+SELF_NAMES = {"self", "this", "cls"}
+
+GOD_OBJECT_METHODS = 20
+
+GOD_OBJECT_FILE_LOC = 500
+
+FEATURE_ENVY_MIN_REFS = 5
+
+CONFIG_LOOKUPS_PER_SYMBOL = 2
+
+CONFIG_LOOKUPS_PER_FILE = 5
+
+
+@dataclass
+class FileContext:
+    lang: str
+    symbols: List[Dict[str, Any]]
+    loc: int
+    module_names: Set[str] = field(default_factory=set)
+
+
+@dataclass
+class LineEvent:
+    lineno: int
+    text: str
+    stripped: str
+    indent: int
+    segment: int
+    symbol: int = -1
+    tokens: List[str] = field(default_factory=list)
+    calls: List[str] = field(default_factory=list)
+    attributes: List[Tuple[str, str]] = field(default_factory=list)
+
+
+class Rule:
+    tag = ""
+    needs: Set[str] = set()
+    langs: Optional[Set[str]] = None
+
+    def __init__(self, ctx: FileContext) -> None:
+        self.ctx = ctx
+        self.hits: Set[int] = set()
+
+    def line(self, ev: LineEvent) -> None:
+        pass
+
+    def finish(self) -> Set[int]:
+        return self.hits
+
+
+class GodObjectRule(Rule):
+    tag = "god_object"
+
+    def __init__(self, ctx: FileContext) -> None:
+        super().__init__(ctx)
+        self.open_classes: List[Tuple[int, int]] = []
+        self.methods: Dict[int, int] = {}
+        self.functions = 0
+
+    def line(self, ev: LineEvent) -> None:
+        if not ev.stripped:
+            return
+        while self.open_classes and ev.indent <= self.open_classes[-1][1]:
+            self.open_classes.pop()
+        if ev.symbol < 0:
+            return
+        sym_type = self.ctx.symbols[ev.symbol]["type"]
+        if sym_type == "class":
+            self.open_classes.append((ev.symbol, ev.indent))
+        elif sym_type in ("function", "method"):
+            self.functions += 1
+            if self.open_classes:
+                cls = self.open_classes[-1][0]
+                self.methods[cls] = self.methods.get(cls, 0) + 1
+
+    def finish(self) -> Set[int]:
+        self.hits = {cls for cls, count in self.methods.items() if count > GOD_OBJECT_METHODS}
+        if self.ctx.loc > GOD_OBJECT_FILE_LOC and self.functions > GOD_OBJECT_METHODS:
+            self.hits.add(-1)
+        return self.hits
+
+
+class HiddenIORule(Rule):
+    tag = "hidden_io"
+    needs = {"calls"}
+    langs = set(IO_CALLS)
+
+    def __init__(self, ctx: FileContext) -> None:
+        super().__init__(ctx)
+        self.io_calls = IO_CALLS.get(ctx.lang, set())
+
+    def line(self, ev: LineEvent) -> None:
+        if ev.segment < 0 or ev.segment in self.hits:
+            return
+        sym = self.ctx.symbols[ev.segment]
+        if sym["type"] not in ("function", "method") or IO_NAME_HINT.search(sym["name"]):
+            return
+        for call in ev.calls:
+            if call in self.io_calls or call.rsplit(".", 1)[-1] in IO_METHODS:
+                self.hits.add(ev.segment)
+                return
+
+
+class SharedMutableStateRule(Rule):
+    tag = "shared_mutable_state"
+    langs = set(MUTABLE_ASSIGNMENTS)
+
+    def __init__(self, ctx: FileContext) -> None:
+        super().__init__(ctx)
+        self.pattern = MUTABLE_ASSIGNMENTS[ctx.lang]
+        self.rebinds = ctx.lang != "python"
+        self.globals: Set[str] = set()
+        self.writer_re: Optional[re.Pattern] = None
+        self.writers: Dict[str, Set[int]] = {}
+
+    def line(self, ev: LineEvent) -> None:
+        if ev.indent == 0:
+            m = self.pattern.match(ev.stripped)
+            if m:
+                self.globals.add(next(g for g in m.groups() if g))
+                names = "|".join(re.escape(g) for g in sorted(self.globals))
+                rebind = r"|[+\-*/|&]?=[^=]" if self.rebinds else ""
+                self.writer_re = re.compile(
+                    rf"\bglobal\s+({names})\b|\b({names})\s*(?:\.\s*(?:{MUTATING_METHODS})\s*\(|\[[^\]]*\]\s*=[^=]{rebind})"
+                )
+            return
+        if ev.segment < 0 or self.writer_re is None:
+            return
+        for m in self.writer_re.finditer(ev.stripped):
+            self.writers.setdefault(m.group(1) or m.group(2), set()).add(ev.segment)
+
+    def finish(self) -> Set[int]:
+        for segments in self.writers.values():
+            if len(segments) >= 2:
+                self.hits.update(segments)
+                self.hits.add(-1)
+        return self.hits
+
+
+class StringlyTypedConfigRule(Rule):
+    tag = "stringly_typed_config"
+
+    def __init__(self, ctx: FileContext) -> None:
+        super().__init__(ctx)
+        self.counts: Dict[int, int] = {}
+
+    def line(self, ev: LineEvent) -> None:
+        found = len(CONFIG_LOOKUP_RE.findall(ev.stripped))
+        if found:
+            self.counts[ev.segment] = self.counts.get(ev.segment, 0) + found
+
+    def finish(self) -> Set[int]:
+        self.hits = {seg for seg, n in self.counts.items() if n >= CONFIG_LOOKUPS_PER_SYMBOL}
+        if sum(self.counts.values()) >= CONFIG_LOOKUPS_PER_FILE:
+            self.hits.add(-1)
+        return self.hits
+
+
+class FeatureEnvyRule(Rule):
+    tag = "feature_envy"
+    needs = {"attributes"}
+
+    def __init__(self, ctx: FileContext) -> None:
+        super().__init__(ctx)
+        self.own: Dict[int, int] = {}
+        self.foreign: Dict[int, Dict[str, int]] = {}
+
+    def line(self, ev: LineEvent) -> None:
+        if ev.segment < 0:
+            return
+        for receiver, _ in ev.attributes:
+            if receiver in SELF_NAMES:
+                self.own[ev.segment] = self.own.get(ev.segment, 0) + 1
+            elif receiver[0].islower() and receiver not in self.ctx.module_names:
+                counts = self.foreign.setdefault(ev.segment, {})
+                counts[receiver] = counts.get(receiver, 0) + 1
+
+    def finish(self) -> Set[int]:
+        for seg, counts in self.foreign.items():
+            if self.ctx.symbols[seg]["type"] not in ("function", "method"):
+                continue
+            top = max(counts.values())
+            if top >= FEATURE_ENVY_MIN_REFS and top > 2 * self.own.get(seg, 0):
+                self.hits.add(seg)
+        return self.hits
+
+
+class TemporalCouplingRule(Rule):
+    tag = "temporal_coupling"
+
+    def line(self, ev: LineEvent) -> None:
+        if ev.segment >= 0 and (STATE_GUARD_RE.search(ev.stripped) or ORDER_ERROR_RE.search(ev.stripped)):
+            self.hits.add(ev.segment)
+
+
+RULES: List[Type[Rule]] = [
+    GodObjectRule,
+    HiddenIORule,
+    SharedMutableStateRule,
+    StringlyTypedConfigRule,
+    FeatureEnvyRule,
+    TemporalCouplingRule,
+]
+
+RULE_TAGS = {rule.tag for rule in RULES}
+
+
+def run_rules(
+    lines: List[str],
+    lang: str,
+    symbols: List[Dict[str, Any]],
+    timed: bool = False,
+) -> Tuple[List[List[Any]], Dict[str, float]]:
+    started = time.perf_counter()
+    ctx = FileContext(lang=lang, symbols=symbols, loc=len(lines))
+    rules = [rule(ctx) for rule in RULES if rule.langs is None or lang in rule.langs]
+    needs = set().union(*(rule.needs for rule in rules)) if rules else set()
+    costs = {rule.tag: 0.0 for rule in rules}
+
+    starts: Dict[int, int] = {}
+    for i, sym in enumerate(symbols):
+        starts.setdefault(sym["line"], i)
+    order = sorted(starts)
+    segment = -1
+    k = 0
+    stream_cost = time.perf_counter() - started
+    for lineno, text in enumerate(lines, 1):
+        tick = time.perf_counter() if timed else 0.0
+        symbol = starts.get(lineno, -1)
+        while k < len(order) and order[k] <= lineno:
+            segment = starts[order[k]]
+            k += 1
+        stripped = text.strip()
+        ev = LineEvent(
+            lineno=lineno,
+            text=text,
+            stripped=stripped,
+            indent=len(text) - len(text.lstrip()),
+            segment=segment,
+            symbol=symbol,
+        )
+        if stripped and IMPORT_LINE_RE.search(text):
+            ctx.module_names.update(IDENT_RE.findall(stripped))
+        if "tokens" in needs:
+            ev.tokens = IDENT_RE.findall(stripped)
+        if "calls" in needs:
+            ev.calls = CALL_RE.findall(stripped)
+        if "attributes" in needs:
+            ev.attributes = ATTRIBUTE_RE.findall(stripped)
+        if not timed:
+            for rule in rules:
+                rule.line(ev)
+            continue
+        tock = time.perf_counter()
+        stream_cost += tock - tick
+        for rule in rules:
+            rule.line(ev)
+            now = time.perf_counter()
+            costs[rule.tag] += now - tock
+            tock = now
+
+    tags: List[List[Any]] = []
+    for rule in rules:
+        tick = time.perf_counter()
+        hits = rule.finish()
+        costs[rule.tag] += time.perf_counter() - tick
+        tags.extend([seg, rule.tag] for seg in sorted(hits))
+    if not timed:
+        return tags, {}
+    costs["stream"] = stream_cost
+    return tags, costs
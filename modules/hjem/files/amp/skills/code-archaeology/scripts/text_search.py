@@ -0,0 +1,288 @@
+from __future__ import annotations
+
+import heapq
+import json
+import math
+import os
+import re
+import shutil
+import tempfile
+import zlib
+from array import array
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, BinaryIO, Iterable
+
+
+SEARCH_DIR = "search"
+SEARCH_VERSION = "1"
+HASH_BITS = 18
+FIELD_WEIGHTS = {"name": 3.0, "path": 1.0, "summary": 1.0}
+MIN_TOKEN_LEN = 2
+NUMPY_MIN_POSTINGS = 20_000
+
+WORD_SPLIT_RE = re.compile(r"[^A-Za-z0-9]+")
+SUBTOKEN_RE = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|\d+")
+
+
+def stem(token: str) -> str:
+    if len(token) > 4 and token.endswith("ies"):
+        return token[:-3] + "y"
+    if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+        return token[:-1]
+    return token
+
+
+@lru_cache(maxsize=1 << 16)
+def word_tokens(word: str) -> tuple[str, ...]:
+    tokens = (stem(part.lower()) for part in SUBTOKEN_RE.findall(word))
+    return tuple(t for t in tokens if len(t) >= MIN_TOKEN_LEN)
+
+
+def subtokens(text: str) -> list[str]:
+    tokens: list[str] = []
+    for word in WORD_SPLIT_RE.split(text):
+        tokens.extend(word_tokens(word))
+    return tokens
+
+
+def bucket(token: str, hash_bits: int = HASH_BITS) -> int:
+    return zlib.crc32(token.encode()) & ((1 << hash_bits) - 1)
+
+
+def term_counts(
+    fields: Iterable[tuple[str, float]],
+    hash_bits: int = HASH_BITS,
+    cache: dict[str, list[int]] | None = None,
+) -> dict[int, float]:
+    counts: dict[int, float] = {}
+    for text, weight in fields:
+        buckets = cache.get(text) if cache is not None else None
+        if buckets is None:
+            buckets = [bucket(token, hash_bits) for token in subtokens(text)]
+            if cache is not None:
+                cache[text] = buckets
+        for b in buckets:
+            counts[b] = counts.get(b, 0.0) + weight
+    return counts
+
+
+def node_fields(node: Any) -> list[tuple[str, float]]:
+    return [(getattr(node, name, "") or "", weight) for name, weight in FIELD_WEIGHTS.items()]
+
+
+def idf_weight(n: int, df: int) -> float:
+    return math.log((n + 1) / (df + 1)) + 1.0 if df else 0.0
+
+
+def pack_postings_numpy(
+    dim: int,
+    n: int,
+    rows: list[int],
+    cols: list[int],
+    tfs: list[float],
+) -> tuple[array, array, array, array]:
+    import numpy as np
+
+    rows_a = np.asarray(rows, dtype=np.uint32)
+    cols_a = np.asarray(cols, dtype=np.uint32)
+    df = np.bincount(cols_a, minlength=dim)
+    idf = np.where(df > 0, np.log((n + 1) / (df + 1.0)) + 1.0, 0.0).astype(np.float32)
+    weights = (1.0 + np.log(np.asarray(tfs, dtype=np.float64))) * idf[cols_a]
+    norms = np.sqrt(np.bincount(rows_a, weights=weights * weights, minlength=n))
+    norms[norms == 0] = 1.0
+    weights /= norms[rows_a]
+    order = np.argsort(cols_a, kind="stable")
+    colptr = np.zeros(dim + 1, dtype=np.uint32)
+    np.cumsum(df, out=colptr[1:])
+    return (
+        array("f", idf.tobytes()),
+        array("I", colptr.tobytes()),
+        array("I", rows_a[order].tobytes()),
+        array("f", weights[order].astype(np.float32).tobytes()),
+    )
+
+
+def pack_postings_python(
+    dim: int,
+    n: int,
+    rows: list[int],
+    cols: list[int],
+    tfs: list[float],
+) -> tuple[array, array, array, array]:
+    colptr = array("I", bytes(4 * (dim + 1)))
+    for c in cols:
+        colptr[c + 1] += 1
+    idf = array("f", (idf_weight(n, colptr[b + 1]) for b in range(dim)))
+    weights = [(1.0 + math.log(tf)) * idf[c] for c, tf in zip(cols, tfs)]
+    norms = [0.0] * n
+    for r, w in zip(rows, weights):
+        norms[r] += w * w
+    norms = [math.sqrt(s) or 1.0 for s in norms]
+    for i in range(dim):
+        colptr[i + 1] += colptr[i]
+    fill = array("I", colptr[:-1])
+    out_rows = array("I", bytes(4 * len(rows)))
+    out_vals = array("f", bytes(4 * len(rows)))
+    for r, c, w in zip(rows, cols, weights):
+        k = fill[c]
+        out_rows[k] = r
+        out_vals[k] = w / norms[r]
+        fill[c] = k + 1
+    return idf, colptr, out_rows, out_vals
+
+
+def write_search_index(search_dir: Path, nodes: Iterable[Any], hash_bits: int = HASH_BITS) -> int:
+    dim = 1 << hash_bits
+    ids: list[str] = []
+    rows: list[int] = []
+    cols: list[int] = []
+    tfs: list[float] = []
+    cache: dict[str, list[int]] = {}
+    for row, node in enumerate(nodes):
+        counts = term_counts(node_fields(node), hash_bits, cache)
+        ids.append(node.id)
+        rows.extend([row] * len(counts))
+        cols.extend(counts)
+        tfs.extend(counts.values())
+
+    n = len(ids)
+    try:
+        idf, colptr, post_rows, post_vals = pack_postings_numpy(dim, n, rows, cols, tfs)
+    except ImportError:
+        idf, colptr, post_rows, post_vals = pack_postings_python(dim, n, rows, cols, tfs)
+
+    offsets = array("Q", [0])
+    encoded = [nid.encode() + b"\n" for nid in ids]
+    for line in encoded:
+        offsets.append(offsets[-1] + len(line))
+
+    search_dir.parent.mkdir(parents=True, exist_ok=True)
+    staging = Path(tempfile.mkdtemp(dir=str(search_dir.parent), prefix=f".{search_dir.name}."))
+    try:
+        for name, data in (
+            ("idf.f32", idf), ("colptr.u32", colptr), ("rows.u32", post_rows),
+            ("vals.f32", post_vals), ("offsets.u64", offsets),
+        ):
+            with open(staging / name, "wb") as f:
+                data.tofile(f)
+        with open(staging / "ids.txt", "wb") as f:
+            f.writelines(encoded)
+        (staging / "meta.json").write_text(json.dumps({
+            "version": SEARCH_VERSION,
+            "hash_bits": hash_bits,
+            "docs": n,
+            "postings": len(post_rows),
+            "fields": FIELD_WEIGHTS,
+        }, indent=2))
+        shutil.rmtree(search_dir, ignore_errors=True)
+        os.replace(staging, search_dir)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    return len(post_rows)
+
+
+def read_at(f: BinaryIO, typecode: str, start: int, count: int) -> array:
+    out = array(typecode)
+    if count <= 0:
+        return out
+    f.seek(start * out.itemsize)
+    out.frombytes(f.read(count * out.itemsize))
+    return out
+
+
+class SearchIndex:
+    def __init__(self, search_dir: Path) -> None:
+        self.search_dir = search_dir
+        self.meta = json.loads((search_dir / "meta.json").read_text())
+        if self.meta.get("version") != SEARCH_VERSION:
+            raise ValueError(f"search index version {self.meta.get('version')!r} is not {SEARCH_VERSION!r}")
+        self.hash_bits = self.meta["hash_bits"]
+        self.docs = self.meta["docs"]
+        self.postings_scored = 0
+        self.row_index: dict[str, int] | None = None
+
+    def query_vector(self, text: str) -> dict[int, float]:
+        counts = term_counts([(text, 1.0)], self.hash_bits)
+        with open(self.search_dir / "idf.f32", "rb") as f:
+            weights = {b: (1.0 + math.log(c)) * read_at(f, "f", b, 1)[0] for b, c in counts.items()}
+        norm = math.sqrt(sum(w * w for w in weights.values()))
+        return {b: w / norm for b, w in weights.items() if w > 0} if norm else {}
+
+    def postings(self, qvec: dict[int, float]) -> list[tuple[array, array, float]]:
+        lists = []
+        with open(self.search_dir / "colptr.u32", "rb") as fp, \
+                open(self.search_dir / "rows.u32", "rb") as fr, \
+                open(self.search_dir / "vals.f32", "rb") as fv:
+            for b, w in sorted(qvec.items()):
+                start, end = read_at(fp, "I", b, 2)
+                lists.append((read_at(fr, "I", start, end - start), read_at(fv, "f", start, end - start), w))
+                self.postings_scored += end - start
+        return lists
+
+    def rows_for(self, node_ids: Iterable[str]) -> set[int]:
+        if self.row_index is None:
+            names = (self.search_dir / "ids.txt").read_text().splitlines()
+            self.row_index = {nid: i for i, nid in enumerate(names)}
+        return {self.row_index[nid] for nid in node_ids if nid in self.row_index}
+
+    def ids_for(self, rows: list[int]) -> list[str]:
+        ids = []
+        with open(self.search_dir / "offsets.u64", "rb") as fo, open(self.search_dir / "ids.txt", "rb") as fi:
+            for row in rows:
+                start, end = read_at(fo, "Q", row, 2)
+                fi.seek(start)
+                ids.append(fi.read(end - start).decode().rstrip("\n"))
+        return ids
+
+    def search(self, text: str, k: int, allowed: set[int] | None = None) -> list[tuple[int, float]]:
+        qvec = self.query_vector(text)
+        if not qvec or k <= 0:
+            return []
+        lists = self.postings(qvec)
+        if self.postings_scored < NUMPY_MIN_POSTINGS:
+            return top_k_python(lists, k, allowed)
+        try:
+            return top_k_numpy(lists, k, allowed)
+        except ImportError:
+            return top_k_python(lists, k, allowed)
+
+
+def top_k_numpy(
+    lists: list[tuple[array, array, float]],
+    k: int,
+    allowed: set[int] | None,
+) -> list[tuple[int, float]]:
+    import numpy as np
+
+    if not lists:
+        return []
+    rows = np.concatenate([np.frombuffer(r, dtype=np.uint32) for r, _, _ in lists])
+    weights = np.concatenate([np.frombuffer(v, dtype=np.float32).astype(np.float64) * w for _, v, w in lists])
+    if not len(rows):
+        return []
+    uniq, inverse = np.unique(rows, return_inverse=True)
+    scores = np.bincount(inverse, weights=weights)
+    if allowed is not None:
+        keep = np.isin(uniq, np.fromiter(allowed, dtype=np.uint32, count=len(allowed)))
+        uniq, scores = uniq[keep], scores[keep]
+    if len(scores) > k:
+        keep = scores >= -np.partition(-scores, k - 1)[k - 1]
+        uniq, scores = uniq[keep], scores[keep]
+    order = np.lexsort((uniq, -scores))[:k]
+    return [(int(uniq[i]), float(scores[i])) for i in order if scores[i] > 0]
+
+
+def top_k_python(
+    lists: list[tuple[array, array, float]],
+    k: int,
+    allowed: set[int] | None,
+) -> list[tuple[int, float]]:
+    scores: dict[int, float] = {}
+    for rows, vals, w in lists:
+        for r, v in zip(rows, vals):
+            scores[r] = scores.get(r, 0.0) + v * w
+    items = scores.items() if allowed is None else ((r, s) for r, s in scores.items() if r in allowed)
+    top = heapq.nsmallest(k, ((-s, r) for r, s in items if s > 0))
+    return [(r, -s) for s, r in top]
@@ -0,0 +1,72 @@
+import subprocess
+import sys
+from pathlib import Path
+from typing import Optional
+
+import pytest
+
+SCRIPTS = Path(__file__).resolve().parent.parent / "scripts"
+sys.path.insert(0, str(SCRIPTS))
+
+TEST_TREE = {
+    "src/main.py": "from src.api import register\n\n\ndef main():\n    register(None)\n",
+    "src/api/__init__.py": "from .routes import register\n",
+    "src/api/routes.py": "def register(app):\n    return app\n",
+    "src/api/handlers.py": "def parse_edge(raw):\n    return raw.split('->')\n",
+    "tests/test_handlers.py": (
+        "import pytest\nfrom src.api import handlers\n\n\n"
+        "def test_parse_edge():\n    assert handlers.parse_edge('a->b') == ['a', 'b']\n"
+    ),
+}
+
+
+def write_files(root: Path, files: dict) -> None:
+    for rel, text in files.items():
+        path = root / rel
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(text)
+
+
+def run_index(root: Path, *args: str, cache_dir: Optional[Path] = None) -> str:
+    cache = ["--cache-dir", str(cache_dir)] if cache_dir else ["--no-cache"]
+    result = subprocess.run(
+        [sys.executable, str(SCRIPTS / "index.py"), str(root), *cache, "--no-history", *args],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return result.stdout
+
+
+def git(repo: Path, *args: str) -> str:
+    result = subprocess.run(
+        ["git", "-c", "user.name=test", "-c", "user.email=test@example.com", *args],
+        cwd=str(repo),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return result.stdout.strip()
+
+
+@pytest.fixture
+def repo(tmp_path: Path) -> Path:
+    git(tmp_path, "init", "-q")
+    return tmp_path
+
+
+@pytest.fixture(scope="session")
+def sample_kg(tmp_path_factory: pytest.TempPathFactory) -> Path:
+    root = tmp_path_factory.mktemp("sample")
+    write_files(root, TEST_TREE)
+    run_index(root, "--full")
+    return root / "archaeology" / "kg"
+
+
+def run_query(*args: str, stdin: str = "") -> subprocess.CompletedProcess:
+    return subprocess.run(
+        [sys.executable, str(SCRIPTS / "query_graph.py"), *args],
+        input=stdin,
+        capture_output=True,
+        text=True,
+    )
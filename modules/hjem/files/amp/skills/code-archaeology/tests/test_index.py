@@ -0,0 +1,347 @@
+import json
+import re
+from pathlib import Path
+
+import pytest
+
+import index
+from conftest import TEST_TREE, git, run_index, write_files
+from kg_store import load_graph, load_json, view_dir
+
+
+def extracted_counts(output: str) -> tuple:
+    seeds = re.search(r"Extracted (\d+) files from the seeds", output)
+    tests = re.search(r"Extracted (\d+) test files", output)
+    return int(seeds.group(1)), int(tests.group(1))
+
+
+def commit_files(repo: Path, files: dict) -> None:
+    write_files(repo, files)
+    git(repo, "add", "-A")
+    git(repo, "commit", "-qm", "update")
+
+
+def test_git_blob_ids_clean_tree_uses_index_blobs(repo: Path) -> None:
+    commit_files(repo, {"a.py": "x = 1\n"})
+    assert index.git_blob_ids(repo) == {"a.py": git(repo, "rev-parse", "HEAD:a.py")}
+
+
+def test_git_blob_ids_hashes_dirty_files(repo: Path) -> None:
+    commit_files(repo, {"a.py": "x = 1\n"})
+    (repo / "a.py").write_text("x = 2\n")
+    assert index.git_blob_ids(repo) == {"a.py": git(repo, "hash-object", "a.py")}
+
+
+def test_git_blob_ids_hashes_dirty_files_under_subdirectory_root(repo: Path) -> None:
+    commit_files(repo, {"sub/a.py": "x = 1\n", "sub/b.py": "y = 1\n", "c.py": "z = 1\n"})
+    (repo / "sub/a.py").write_text("x = 2\n")
+    blob_ids = index.git_blob_ids(repo / "sub")
+    assert blob_ids == {
+        "a.py": git(repo, "hash-object", "sub/a.py"),
+        "b.py": git(repo, "rev-parse", "HEAD:sub/b.py"),
+    }
+
+
+def test_git_changes_under_subdirectory_root_reports_renames(repo: Path) -> None:
+    commit_files(repo, {"sub/a.py": "def f():\n    return 1\n" * 5, "c.py": "z = 1\n"})
+    base = git(repo, "rev-parse", "HEAD")
+    git(repo, "mv", "sub/a.py", "sub/b.py")
+    commit_files(repo, {"sub/new.py": "n = 1\n", "c.py": "z = 2\n"})
+    paths, renames = index.git_changes(repo / "sub", base)
+    assert sorted(p.name for p in paths) == ["b.py", "new.py"]
+    assert renames == {"b.py": "a.py"}
+
+
+def test_renamed_files_carry_their_graph_over(repo: Path) -> None:
+    helper = "def helper(x):\n    return x + 1\n\n\ndef other():\n    return helper(2)\n"
+    commit_files(repo, {"main.py": "from lib.a import helper\n\nhelper(1)\n", "lib/a.py": helper})
+    run_index(repo, "--full")
+    base = git(repo, "rev-parse", "HEAD")
+    git(repo, "mv", "lib/a.py", "lib/b.py")
+    commit_files(repo, {"main.py": "from lib.b import helper\n\nhelper(1)\n"})
+
+    output = run_index(repo, "--since-git", base, "--verbose")
+    assert "lib/b.py (renamed from lib/a.py, reused)" in output
+    graph = load_graph(repo / "archaeology" / "kg")
+    assert not [nid for nid in graph.nodes if "lib/a.py" in nid]
+    assert graph.nodes["fn:lib/b.py:helper"]["path"] == "lib/b.py"
+    assert ("fn:lib/b.py:other", "fn:lib/b.py:helper", "calls") in graph.edges
+    assert graph.files["lib/b.py"]["hash"] == git(repo, "rev-parse", "HEAD:lib/b.py")
+
+
+def test_pass2_charges_test_files_against_their_own_budget(tmp_path: Path) -> None:
+    write_files(tmp_path, TEST_TREE)
+    for max_test_files, expected in ((0, 0), (1, 1), (200, 3)):
+        output = run_index(tmp_path, "--full", "--max-files", "1", "--max-depth", "0", "--max-test-files", str(max_test_files))
+        assert extracted_counts(output) == (1, expected)
+
+
+def test_git_revision_lists_only_source_candidates(repo: Path) -> None:
+    commit_files(repo, {"a.py": "x = 1\n", "tool": "#!/bin/sh\necho\n", "logo.png": "png", ".env": "A=1\n"})
+    source = index.GitRevision(repo, git(repo, "rev-parse", "HEAD"))
+    try:
+        assert sorted(p.name for p in source.list_files()) == ["a.py", "tool"]
+    finally:
+        source.close()
+
+
+def test_git_revision_read_head_leaves_the_stream_in_sync(repo: Path) -> None:
+    commit_files(repo, {"tool": "#!/usr/bin/env python\n" + "x = 1\n" * 5000, "a.py": "y = 2\n"})
+    source = index.GitRevision(repo, git(repo, "rev-parse", "HEAD"))
+    try:
+        source.list_files()
+        assert source.read_head("tool", 8) == b"#!/usr/b"
+        assert source.read("a.py") == b"y = 2\n"
+        assert index.detect_lang(repo / "tool", lambda: source.read_head("tool")) == "python"
+    finally:
+        source.close()
+
+
+def test_rev_index_skips_oversized_extensionless_blobs(repo: Path) -> None:
+    commit_files(repo, {"a.py": "x = 1\n", "tool": "#!/usr/bin/env python\n" + "x = 1\n" * 400})
+    output = run_index(repo, "--full", "--rev", "HEAD", "--max-file-kb", "1")
+    assert "Found 1 source files" in output
+
+
+def test_collect_refs_keeps_only_call_sites() -> None:
+    lines = [
+        "from b import helper",
+        "def main(value: helper) -> helper:",
+        "    name = 'helper'",
+        "    obj.helper",
+        "    return helper (value)",
+    ]
+    symbols = [{"name": "main", "type": "function", "line": 2}]
+    assert index.collect_refs(lines, symbols) == [["helper", 0, 5]]
+
+
+def test_carried_files_link_to_definitions_added_elsewhere(tmp_path: Path) -> None:
+    write_files(tmp_path, {
+        "a.py": "from b import helper\n\n\ndef main():\n    return helper(1)\n",
+        "b.py": "x = 1\n",
+    })
+    assert "Linked 0 cross-file calls" in run_index(tmp_path)
+    write_files(tmp_path, {"b.py": "def helper(v):\n    return v\n"})
+    output = run_index(tmp_path, "--max-files", "1", "--max-depth", "0", "--verbose")
+    assert "[pass2] a.py" not in output
+    graph = load_graph(tmp_path / "archaeology" / "kg")
+    assert ("fn:a.py:main", "fn:b.py:helper", "calls") in graph.edges
+
+
+def test_rollups_aggregate_centrality_and_stay_out_of_the_symbol_index(tmp_path: Path) -> None:
+    write_files(tmp_path, {
+        "api/api.py": "from lib import db\n\n\ndef api():\n    return db.db()\n",
+        "lib/db.py": "def db():\n    return 1\n",
+    })
+    run_index(tmp_path, "--full")
+    kg = tmp_path / "archaeology" / "kg"
+    graph = load_graph(kg)
+    assert "mod:api" in graph.nodes
+    assert graph.symbol_to_node.get("api") == ["fn:api/api.py:api"]
+
+    centrality = load_json(view_dir(kg) / "indexes" / "centrality.json")
+    files = [nid for nid in centrality if nid.startswith(("file:", "fn:"))]
+    assert centrality["mod:."]["pagerank"] == pytest.approx(sum(centrality[nid]["pagerank"] for nid in files), rel=1e-3)
+    assert centrality["mod:api"]["out_degree"] == 1
+    assert centrality["mod:lib"]["in_degree"] == 1
+
+
+def test_extraction_cache_keys_include_language(tmp_path: Path) -> None:
+    cache = index.ExtractionCache(tmp_path, 1 << 20)
+    cache.put("abc", "regex", "c", {"symbols": [{"name": "f"}]})
+    assert cache.get("abc", "regex", "cpp") is None
+    assert cache.get("abc", "regex", "c") == {"symbols": [{"name": "f"}]}
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_extraction_cache_stores_empty_files(tmp_path: Path) -> None:
+    write_files(tmp_path / "src", {"main.py": "", "a.py": "def f():\n    return 1\n"})
+    assert "0 hits, 2 misses" in run_index(tmp_path / "src", "--full", cache_dir=tmp_path / "cache")
+    assert "2 hits, 0 misses" in run_index(tmp_path / "src", "--full", cache_dir=tmp_path / "cache")
+
+
+def test_prune_pairs_keeps_true_counts_of_survivors() -> None:
+    pairs = {("a", "b"): 5, ("a", "c"): 3, ("b", "c"): 1, ("c", "d"): 1}
+    assert index.prune_pairs(pairs, 2) == 1
+    assert pairs == {("a", "b"): 5, ("a", "c"): 3}
+
+
+def test_count_pair_reports_the_cutoff_when_the_table_overflows() -> None:
+    pairs = {("a", "b"): 4, ("a", "c"): 2}
+    assert index.count_pair(pairs, ("a", "b"), 1) == 0
+    assert index.count_pair(pairs, ("b", "c"), 1) == 2
+    assert pairs == {("a", "b"): 5}
+
+
+def test_history_counts_co_changes(repo: Path) -> None:
+    for i in range(3):
+        commit_files(repo, {"a.py": f"x = {i}\n", "b.py": f"y = {i}\n"})
+    commit_files(repo, {"c.py": "z = 1\n"})
+    history = index.HistoryIndex()
+    processed = index.update_history(repo, history, git(repo, "rev-parse", "HEAD"), "", 100, {"a.py", "b.py", "c.py"})
+    assert processed == 4
+    assert history.pairs == {("a.py", "b.py"): 3}
+    assert history.files["a.py"]["commits"] == 3
+    assert history.pair_error == 0
+
+
+DUPLICATE_BODY = """def {name}(items, limit):
+    total = 0
+    seen = []
+    for item in items:
+        if item.{field} > limit:
+            continue
+        seen.append(item.{field} * 2 + 1)
+        total = total + item.{field}
+    while len(seen) > 10:
+        seen.pop()
+    return total, seen, "done"
+"""
+
+
+def test_normalize_tokens_abstracts_identifiers_and_literals() -> None:
+    tokens = index.normalize_tokens(["# note", "x = count(3, 'a')  ", "", "return self.size"])
+    assert tokens == ["x", "=", "x", "(", "0", ",", "''", ")", "return", "self", ".", "x"]
+
+
+def test_minhash_signature_ignores_renames_and_short_bodies() -> None:
+    a = index.normalize_tokens(DUPLICATE_BODY.format(name="alpha", field="cost").splitlines())
+    b = index.normalize_tokens(DUPLICATE_BODY.format(name="beta", field="weight").splitlines())
+    assert len(a) >= index.MINHASH_MIN_TOKENS
+    assert index.minhash_signature(a) == index.minhash_signature(b)
+    assert len(index.minhash_signature(a)) == index.MINHASH_PERMUTATIONS
+    assert index.minhash_signature(a[:index.MINHASH_MIN_TOKENS - 1]) is None
+
+
+def test_minhash_similarity_tracks_shingle_jaccard() -> None:
+    def shingles(tokens: list) -> set:
+        return {tuple(tokens[i:i + index.MINHASH_SHINGLE]) for i in range(len(tokens) - index.MINHASH_SHINGLE + 1)}
+
+    base = [f"t{i}" for i in range(200)]
+    other = base[:150] + [f"u{i}" for i in range(50)]
+    jaccard = len(shingles(base) & shingles(other)) / len(shingles(base) | shingles(other))
+    sig_a, sig_b = index.minhash_signature(base), index.minhash_signature(other)
+    estimate = sum(1 for x, y in zip(sig_a, sig_b) if x == y) / index.MINHASH_PERMUTATIONS
+    assert abs(estimate - jaccard) < 0.2
+
+
+def test_duplicates_link_renamed_copies_and_tag_them(tmp_path: Path) -> None:
+    write_files(tmp_path, {
+        "main.py": "from a import alpha\nfrom b import beta\nfrom c import gamma\n",
+        "a.py": DUPLICATE_BODY.format(name="alpha", field="cost"),
+        "b.py": DUPLICATE_BODY.format(name="beta", field="weight"),
+        "c.py": "def gamma():\n    return 1\n",
+    })
+    run_index(tmp_path, "--full")
+    graph = load_graph(tmp_path / "archaeology" / "kg")
+    duplicates = [key for key in graph.edges if key[2] == "duplicates"]
+    assert duplicates == [("fn:a.py:alpha", "fn:b.py:beta", "duplicates")]
+    assert "duplicate_logic" in graph.nodes["fn:a.py:alpha"]["tags"]
+    assert "duplicate_logic" not in graph.nodes["fn:c.py:gamma"].get("tags", [])
+
+
+@pytest.mark.parametrize("pattern, rel, is_dir, ignored", [
+    ("*.log", "a/b/debug.log", False, True),
+    ("*.log", "debug.log.py", False, False),
+    ("build/", "src/build", True, True),
+    ("build/", "src/build", False, False),
+    ("/top.py", "top.py", False, True),
+    ("/top.py", "sub/top.py", False, False),
+    ("docs/**/gen.py", "docs/a/b/gen.py", False, True),
+    ("docs/**/gen.py", "docs/gen.py", False, True),
+    ("docs/**/gen.py", "src/docs/gen.py", False, False),
+    ("cache/**", "cache/x/y.py", False, True),
+    ("[!a]bc.py", "xbc.py", False, True),
+    ("[!a]bc.py", "abc.py", False, False),
+    ("fil?.py", "file.py", False, True),
+    ("fil?.py", "fi/e.py", False, False),
+])
+def test_ignore_patterns_follow_gitignore_rules(pattern: str, rel: str, is_dir: bool, ignored: bool) -> None:
+    matcher = index.IgnoreMatcher()
+    matcher.add_lines(["# comment", "", pattern])
+    assert matcher.matches(rel, is_dir) is ignored
+
+
+def test_ignore_negation_and_parent_directories() -> None:
+    matcher = index.IgnoreMatcher()
+    matcher.add_lines(["*.py", "!keep.py", "gen/"])
+    assert matcher.matches("a.py")
+    assert not matcher.matches("keep.py")
+    assert matcher.matches("gen/keep.py")
+    assert not matcher.matches("gen.py.md")
+
+
+def test_file_policy_reports_why_files_are_skipped(tmp_path: Path) -> None:
+    write_files(tmp_path, {
+        "api_pb2.py": "x = 1\n",
+        "app.min.js": "x\n",
+        "marked.py": "# Code generated by protoc. DO NOT EDIT.\nx = 1\n",
+        "wide.js": "x" * 1010 + "\n",
+        "wide.md": "word " * 202 + "\n",
+        "big.py": "x = 1\n" * 400,
+        "vendor/lib.py": "x = 1\n",
+        "ok.py": "x = 1\n",
+    })
+    (tmp_path / "blob.py").write_bytes(b"x = 1\n\0\0")
+    (tmp_path / index.IGNORE_FILE).write_text("vendor/\n")
+    policy = index.load_file_policy(tmp_path, 1)
+    expected = {
+        "api_pb2.py": "generated", "app.min.js": "minified", "marked.py": "generated", "wide.js": "minified",
+        "wide.md": "", "big.py": "oversized", "vendor/lib.py": "ignored", "ok.py": "", "blob.py": "binary",
+    }
+    reasons = {rel: policy.check(tmp_path / rel, rel, "markdown" if rel.endswith(".md") else "python") for rel in expected}
+    assert reasons == expected
+
+
+def test_dir_walker_applies_nested_gitignores(tmp_path: Path) -> None:
+    write_files(tmp_path, {
+        ".gitignore": "*.gen.py\nout/\n",
+        "a.py": "", "b.gen.py": "", "notes.txt": "", "out/c.py": "", "node_modules/d.js": "",
+        "pkg/.gitignore": "local.py\n!keep.gen.py\n",
+        "pkg/local.py": "", "pkg/keep.gen.py": "", "pkg/e.py": "", "pkg/deep/f.py": "", "pkg/deep/local.py": "",
+        "other/local.py": "",
+    })
+    expected = ["a.py", "other/local.py", "pkg/deep/f.py", "pkg/e.py", "pkg/keep.gen.py"]
+    for jobs in (1, 4):
+        walker = index.DirWalker(tmp_path, jobs=jobs)
+        assert [p.relative_to(tmp_path).as_posix() for p in walker.list_files()] == expected
+        assert set(walker.entries) == set(expected)
+
+
+def test_dir_walker_lets_the_archaeology_ignore_win(tmp_path: Path) -> None:
+    write_files(tmp_path, {".gitignore": "!*.py\n", "a.py": "", "b.py": "x = 1\n"})
+    ignore = index.IgnoreMatcher()
+    ignore.add_lines(["a.py"])
+    walker = index.DirWalker(tmp_path, ignore)
+    assert [p.name for p in walker.list_files()] == ["b.py"]
+    assert walker.entries["b.py"] == 6
+
+
+def test_edge_table_round_trips_and_deduplicates() -> None:
+    table = index.EdgeTable(index.IdTable())
+    span = [{"path": "a.py", "start_line": 3, "end_line": 4}]
+    odd = [{"path": "a.py", "start_line": 1, "end_line": 2, "note": "x"}]
+    edges = [
+        index.EdgeRecord("file:a.py", "fn:a.py:f", "defines", span, 0.9),
+        index.EdgeRecord("fn:a.py:f", "fn:b.py:g", "calls", odd, 0.5),
+        index.EdgeRecord("fn:a.py:f", "fn:b.py:g", "imports", [], 0.7),
+    ]
+    assert [table.add(e) for e in edges] == [True, True, True]
+    assert not table.add(index.EdgeRecord("file:a.py", "fn:a.py:f", "defines", [], 0.1))
+    assert len(table) == 3
+    assert list(table) == edges
+    assert list(table.triples()) == [(e.source, e.target, e.type) for e in edges]
+
+
+def test_edge_table_retain_keeps_order_and_evidence() -> None:
+    table = index.EdgeTable(index.IdTable())
+    edges = [
+        index.EdgeRecord(f"n{i}", f"n{i + 1}", "calls", [{"path": f"{i}.py", "start_line": i, "end_line": i}], 0.7)
+        for i in range(5)
+    ]
+    for e in edges:
+        table.add(e)
+    table.retain(i for i in (4, 1, 1, 3))
+    assert list(table) == [edges[4], edges[1], edges[3]]
+    assert table.add(edges[0])
+    assert not table.add(edges[1])
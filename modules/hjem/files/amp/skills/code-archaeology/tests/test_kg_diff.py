@@ -0,0 +1,105 @@
+import json
+import random
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from conftest import SCRIPTS
+from kg_diff import diff_kind, merge_join
+from kg_store import (
+    META_FILE, SORTED_FILE, append_journal, external_sort, iter_jsonl, node_key, publish_snapshot, publish_view,
+    snapshot_dir, stage_view, write_json, write_jsonl,
+)
+
+
+def node(node_id: str, **extra) -> dict:
+    return {"id": node_id, "type": "function", "name": node_id, "path": "a.py", **extra}
+
+
+def edge(source: str, target: str) -> dict:
+    return {"source": source, "target": target, "type": "calls"}
+
+
+def make_kg(kg_dir: Path, nodes: list, edges: list) -> str:
+    version = publish_snapshot(kg_dir, nodes, edges, [], {}, {})
+    staging = stage_view(kg_dir, version)
+    write_json(staging / META_FILE, {"journal_offset": 0})
+    publish_view(kg_dir, staging)
+    return version
+
+
+def test_merge_join_matches_a_dict_diff() -> None:
+    rng = random.Random(3)
+    for _ in range(50):
+        old = {k: {"v": rng.randint(0, 2)} for k in rng.sample(range(30), rng.randint(0, 20))}
+        new = {k: {"v": rng.randint(0, 2)} for k in rng.sample(range(30), rng.randint(0, 20))}
+        joined = list(merge_join(iter(sorted(old.items())), iter(sorted(new.items()))))
+        assert [k for k, _, _ in joined] == sorted(old.keys() | new.keys())
+        assert all(a == old.get(k) and b == new.get(k) for k, a, b in joined)
+
+
+def test_diff_kind_reports_added_removed_and_changed(tmp_path: Path) -> None:
+    make_kg(tmp_path / "old", [node("a"), node("b", summary="x"), node("c", last_indexed=1)], [edge("a", "b")])
+    make_kg(tmp_path / "new", [node("b", summary="y"), node("c", last_indexed=2), node("d")], [edge("a", "b"), edge("b", "d")])
+
+    nodes = list(diff_kind("nodes", tmp_path / "old", tmp_path / "new", tmp_path, {"last_indexed"}))
+    assert [(change, entry.get("id")) for change, entry, _ in nodes] == [("removed", "a"), ("changed", "b"), ("added", "d")]
+    changed = nodes[1][1]
+    assert changed["fields"] == ["summary"]
+    assert (changed["before"], changed["after"]) == ({"summary": "x"}, {"summary": "y"})
+    assert nodes[0][1]["type"] == "function"
+
+    edges = list(diff_kind("edges", tmp_path / "old", tmp_path / "new", tmp_path, set()))
+    assert [(change, entry["source"], entry["target"]) for change, entry, _ in edges] == [("added", "b", "d")]
+
+
+def test_diff_kind_sees_the_journal_overlay(tmp_path: Path) -> None:
+    make_kg(tmp_path / "old", [node("a"), node("b")], [])
+    version = make_kg(tmp_path / "new", [node("a"), node("b")], [])
+    offset = append_journal(tmp_path / "new", [{"op": "del_node", "id": "a"}, {"op": "node", "data": node("e")}], {})
+    staging = stage_view(tmp_path / "new", version)
+    write_json(staging / META_FILE, {"journal_offset": offset})
+    publish_view(tmp_path / "new", staging)
+
+    nodes = list(diff_kind("nodes", tmp_path / "old", tmp_path / "new", tmp_path, set()))
+    assert [(change, entry["id"]) for change, entry, _ in nodes] == [("removed", "a"), ("added", "e")]
+
+
+def test_external_sort_merges_runs_in_key_order(tmp_path: Path) -> None:
+    rng = random.Random(5)
+    records = [node(f"n{rng.randint(0, 10_000):05d}-{i}") for i in range(257)]
+    write_jsonl(tmp_path / "nodes.jsonl", records)
+    runs = tmp_path / "runs"
+    runs.mkdir()
+    keys = [k for k, _ in external_sort(tmp_path / "nodes.jsonl", node_key, runs, run_records=16)]
+    assert keys == sorted(node_key(r) for r in records)
+    assert len(list(runs.iterdir())) == 17
+
+
+def test_unsorted_snapshots_are_sorted_unless_marked(tmp_path: Path) -> None:
+    kg = tmp_path / "old"
+    version = make_kg(kg, [node("a"), node("b")], [])
+    nodes_file = snapshot_dir(kg, version) / "nodes.jsonl"
+    write_jsonl(nodes_file, list(iter_jsonl(nodes_file))[::-1])
+    make_kg(tmp_path / "new", [node("a"), node("b")], [])
+
+    with pytest.raises(ValueError):
+        list(diff_kind("nodes", kg, tmp_path / "new", tmp_path, set()))
+    (snapshot_dir(kg, version) / SORTED_FILE).unlink()
+    assert list(diff_kind("nodes", kg, tmp_path / "new", tmp_path, set())) == []
+
+
+def test_cli_writes_jsonl_entries_and_a_summary(tmp_path: Path) -> None:
+    make_kg(tmp_path / "old", [node("a")], [])
+    make_kg(tmp_path / "new", [node("a", tags=["hot"]), node("b")], [])
+    result = subprocess.run(
+        [sys.executable, str(SCRIPTS / "kg_diff.py"), str(tmp_path / "old"), str(tmp_path / "new"), "--format", "jsonl"],
+        capture_output=True, text=True, check=True,
+    )
+    lines = [json.loads(line) for line in result.stdout.splitlines()]
+    assert [(e["change"], e["id"]) for e in lines[:-1]] == [("changed", "a"), ("added", "b")]
+    assert lines[-1]["kind"] == "summary"
+    assert lines[-1]["kinds"]["nodes"] == {"changed": 1, "added": 1}
+    assert lines[-1]["tags"] == {"hot": {"changed": 1}}
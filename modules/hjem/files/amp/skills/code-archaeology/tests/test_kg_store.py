@@ -0,0 +1,98 @@
+from pathlib import Path
+
+import kg_store
+from kg_store import (
+    JOURNAL_FILE, META_FILE, append_journal, diff_ops, journal_limit, load_graph, publish_snapshot,
+    publish_view, read_current, read_journal, snapshot_dir, stage_view, write_json,
+)
+
+
+def node(node_id: str, name: str, path: str = "a.py") -> dict:
+    return {"id": node_id, "type": "function", "name": name, "path": path}
+
+
+def publish(kg_dir: Path, version: str, journal_offset: int) -> str:
+    staging = stage_view(kg_dir, version)
+    write_json(staging / META_FILE, {"journal_offset": journal_offset})
+    return publish_view(kg_dir, staging)
+
+
+def base_graph(kg_dir: Path) -> str:
+    version = publish_snapshot(kg_dir, [node("f", "f")], [], [{"path": "a.py"}], {"f": ["f"]}, {})
+    publish(kg_dir, version, 0)
+    return version
+
+
+def test_read_journal_ignores_uncommitted_tail(tmp_path: Path) -> None:
+    journal = tmp_path / JOURNAL_FILE
+    journal.write_text(
+        '{"op": "del_node", "id": "a"}\n{"op": "commit"}\n{"op": "del_node", "id": "b"}\n{"op": "commit"'
+    )
+    batches, offset = read_journal(journal)
+    assert batches == [[{"op": "del_node", "id": "a"}]]
+    assert offset == len('{"op": "del_node", "id": "a"}\n{"op": "commit"}\n')
+
+
+def test_read_journal_stops_at_limit(tmp_path: Path) -> None:
+    journal = tmp_path / JOURNAL_FILE
+    first = '{"op": "del_node", "id": "a"}\n{"op": "commit"}\n'
+    journal.write_text(first + '{"op": "del_node", "id": "b"}\n{"op": "commit"}\n')
+    batches, offset = read_journal(journal, len(first))
+    assert len(batches) == 1
+    assert offset == len(first)
+
+
+def test_diff_ops_round_trips_through_load_graph(tmp_path: Path) -> None:
+    base_graph(tmp_path)
+    old = load_graph(tmp_path)
+    new_nodes = [node("g", "g")]
+    ops = diff_ops(old.nodes, new_nodes, old.edges, [], old.files, [{"path": "a.py", "hash": "x"}])
+    version = read_current(tmp_path)[0]
+    offset = append_journal(tmp_path, ops, {"ops": len(ops)}, journal_limit(tmp_path, *read_current(tmp_path)))
+    publish(tmp_path, version, offset)
+
+    graph = load_graph(tmp_path)
+    assert list(graph.nodes) == ["g"]
+    assert graph.symbol_to_node == {"g": ["g"]}
+    assert graph.files == {"a.py": {"path": "a.py", "hash": "x"}}
+    assert graph.journal_commits == 1
+
+
+def test_readers_stop_at_the_published_view(tmp_path: Path) -> None:
+    base_graph(tmp_path)
+    append_journal(tmp_path, [{"op": "del_node", "id": "f"}], {"ops": 1})
+    assert list(load_graph(tmp_path).nodes) == ["f"]
+
+
+def test_append_journal_drops_batches_of_unpublished_runs(tmp_path: Path) -> None:
+    version = base_graph(tmp_path)
+    append_journal(tmp_path, [{"op": "del_node", "id": "f"}], {"ops": 1})
+
+    limit = journal_limit(tmp_path, *read_current(tmp_path))
+    offset = append_journal(tmp_path, [{"op": "node", "data": node("g", "g")}], {"ops": 1}, limit)
+    publish(tmp_path, version, offset)
+
+    batches, _ = read_journal(snapshot_dir(tmp_path) / JOURNAL_FILE)
+    assert batches == [[{"op": "node", "data": node("g", "g")}]]
+    assert sorted(load_graph(tmp_path).nodes) == ["f", "g"]
+
+
+def test_publish_view_keeps_retired_views_within_grace(tmp_path: Path, monkeypatch) -> None:
+    version = base_graph(tmp_path)
+    for _ in range(3):
+        publish(tmp_path, version, 0)
+    views = snapshot_dir(tmp_path) / kg_store.VIEWS_DIR
+    assert len(list(views.iterdir())) == 4
+
+    monkeypatch.setattr(kg_store, "RETIRE_GRACE_SECONDS", 0)
+    publish(tmp_path, version, 0)
+    assert sorted(p.name for p in views.iterdir()) == ["000004", "000005"]
+
+
+def test_iter_sorted_merges_journal_overlay(tmp_path: Path) -> None:
+    version = publish_snapshot(tmp_path, [node("a", "a"), node("c", "c")], [], [], {}, {})
+    publish(tmp_path, version, 0)
+    offset = append_journal(tmp_path, [{"op": "node", "data": node("b", "b")}, {"op": "del_node", "id": "c"}], {})
+    publish(tmp_path, version, offset)
+    keys = [k for k, _ in kg_store.iter_sorted(tmp_path, "nodes", tmp_path)]
+    assert keys == ["a", "b"]
@@ -0,0 +1,153 @@
+import json
+from pathlib import Path
+
+from conftest import run_query
+from query_graph import (
+    Edge, SearchBudget, bidirectional_bfs, build_adjacency, impact_closure, k_shortest_paths, select_tests,
+)
+
+
+GRAPH = [
+    ("a", "b"), ("b", "d"), ("a", "c"), ("c", "d"), ("d", "e"),
+    ("a", "f"), ("f", "g"), ("g", "h"), ("h", "e"), ("c", "e"), ("e", "a"),
+]
+
+
+def edges(pairs) -> list:
+    return [Edge(source=s, target=t, type="calls") for s, t in pairs]
+
+
+def simple_paths(pairs, source: str, target: str) -> list:
+    out = {}
+    for s, t in pairs:
+        out.setdefault(s, []).append(t)
+    found = []
+
+    def walk(path: list) -> None:
+        if path[-1] == target:
+            found.append(path)
+            return
+        for nxt in out.get(path[-1], []):
+            if nxt not in path:
+                walk(path + [nxt])
+
+    walk([source])
+    return found
+
+
+def test_impact_leaves_trailing_kg_dir_positional(sample_kg: Path) -> None:
+    result = run_query("--impact", "src/api/handlers.py", str(sample_kg), "--format", "json")
+    assert result.returncode == 0, result.stderr
+    assert json.loads(result.stdout)["query"] == "impact=src/api/handlers.py"
+
+
+def test_impact_accepts_comma_separated_and_repeated_paths(sample_kg: Path) -> None:
+    result = run_query(
+        "--impact", "src/api/handlers.py,src/main.py", "--impact", "src/api/routes.py", str(sample_kg),
+        "--format", "json",
+    )
+    assert json.loads(result.stdout)["query"] == "impact=src/api/handlers.py,src/api/routes.py,src/main.py"
+
+
+def test_affected_tests_reads_stdin_without_a_value(sample_kg: Path) -> None:
+    result = run_query(str(sample_kg), "--affected-tests", "--format", "json", stdin="./src/api/handlers.py\n")
+    assert result.returncode == 0, result.stderr
+    assert [t["path"] for t in json.loads(result.stdout)["tests"]] == ["tests/test_handlers.py"]
+
+
+def test_affected_tests_exits_nonzero_when_nothing_is_affected(sample_kg: Path) -> None:
+    result = run_query("--affected-tests", "src/main.py", str(sample_kg), "--format", "json")
+    assert result.returncode == 1
+
+
+def test_bidirectional_bfs_finds_a_shortest_path() -> None:
+    forward, backward = build_adjacency(edges(GRAPH), False)
+    path = bidirectional_bfs({"a"}, {"e"}, forward, backward, SearchBudget(1000), set(), set())
+    assert len(path.edges) == 2
+    assert path.nodes[0] == "a" and path.nodes[-1] == "e"
+    assert [(e.source, e.target) for e in path.edges] == list(zip(path.nodes, path.nodes[1:]))
+
+
+def test_k_shortest_paths_match_brute_force_lengths() -> None:
+    forward, backward = build_adjacency(edges(GRAPH), False)
+    expected = sorted(len(p) - 1 for p in simple_paths(GRAPH, "a", "e"))
+    for k in range(1, len(expected) + 2):
+        found = k_shortest_paths({"a"}, {"e"}, forward, backward, k, SearchBudget(10_000))
+        assert [len(p.edges) for p in found] == expected[:k]
+        assert len({tuple(p.nodes) for p in found}) == len(found)
+        for p in found:
+            assert len(set(p.nodes)) == len(p.nodes)
+            assert all((e.source, e.target) in GRAPH for e in p.edges)
+
+
+def test_k_shortest_paths_respect_direction_unless_undirected() -> None:
+    forward, backward = build_adjacency(edges(GRAPH), False)
+    assert k_shortest_paths({"h"}, {"f"}, forward, backward, 1, SearchBudget(1000))[0].nodes == [
+        "h", "e", "a", "f",
+    ]
+    forward, backward = build_adjacency(edges(GRAPH), True)
+    assert k_shortest_paths({"h"}, {"f"}, forward, backward, 1, SearchBudget(1000))[0].nodes == ["h", "g", "f"]
+
+
+def test_path_search_stops_when_the_budget_runs_out() -> None:
+    forward, backward = build_adjacency(edges(GRAPH), False)
+    assert k_shortest_paths({"a"}, {"e"}, forward, backward, 3, SearchBudget(1)) == []
+
+
+def reverse_deps() -> dict:
+    nodes = {
+        "file:lib.py": ["lib.py", "file", "lib.py"],
+        "fn:lib.py:f": ["f", "function", "lib.py"],
+        "file:app.py": ["app.py", "file", "app.py"],
+        "fn:app.py:g": ["g", "function", "app.py"],
+        "file:test_app.py": ["test_app.py", "file", "test_app.py"],
+        "test:test_app.py:test_g": ["test_g", "test", "test_app.py"],
+        "test:test_app.py:test_h": ["test_h", "test", "test_app.py"],
+        "file:test_lib.py": ["test_lib.py", "file", "test_lib.py"],
+        "file:test_other.py": ["test_other.py", "file", "test_other.py"],
+    }
+    edges = [
+        ("file:lib.py", "fn:lib.py:f", "defines"),
+        ("file:app.py", "fn:app.py:g", "defines"),
+        ("file:test_app.py", "test:test_app.py:test_g", "defines"),
+        ("file:test_app.py", "test:test_app.py:test_h", "defines"),
+        ("file:app.py", "file:lib.py", "imports"),
+        ("fn:app.py:g", "fn:lib.py:f", "calls"),
+        ("file:test_app.py", "file:app.py", "imports"),
+        ("test:test_app.py:test_g", "fn:app.py:g", "calls"),
+        ("file:test_lib.py", "fn:lib.py:f", "tests"),
+    ]
+    dependents: dict = {}
+    defines: dict = {}
+    for source, target, edge_type in edges:
+        dependents.setdefault(target, []).append([source, edge_type])
+        if edge_type == "defines":
+            defines.setdefault(source, []).append(target)
+    test_files = ["file:test_app.py", "file:test_lib.py", "file:test_other.py"]
+    return {"nodes": nodes, "dependents": dependents, "defines": defines, "test_files": test_files}
+
+
+def test_impact_closure_walks_dependents_breadth_first() -> None:
+    depths, edges = impact_closure({"file:lib.py"}, reverse_deps())
+    assert depths == {
+        "file:lib.py": 0, "fn:lib.py:f": 0,
+        "file:app.py": 1, "fn:app.py:g": 1, "file:test_lib.py": 1,
+        "file:test_app.py": 2, "test:test_app.py:test_g": 2,
+    }
+    assert ("test:test_app.py:test_g", "fn:app.py:g", "calls") in edges
+
+
+def test_select_tests_narrows_to_reached_cases_unless_the_file_is_hit() -> None:
+    deps = reverse_deps()
+    changed = {"file:lib.py"}
+    depths, edges = impact_closure(changed, deps)
+    assert select_tests(changed, depths, edges, deps) == [
+        {"path": "test_lib.py", "id": "file:test_lib.py", "depth": 1, "cases": []},
+        {"path": "test_app.py", "id": "file:test_app.py", "depth": 2, "cases": ["test_g"]},
+    ]
+
+    changed = {"file:test_app.py"}
+    depths, edges = impact_closure(changed, deps)
+    assert select_tests(changed, depths, edges, deps) == [
+        {"path": "test_app.py", "id": "file:test_app.py", "depth": 0, "cases": []},
+    ]
@@ -0,0 +1,105 @@
+import itertools
+import re
+from types import SimpleNamespace
+
+import pytest
+
+from query_lang import BoolExpr, NodeIndex, QueryError, Term, evaluate, parse_query
+
+
+def node(node_id: str, node_type: str, name: str, path: str, tags=(), lang: str = "python") -> SimpleNamespace:
+    return SimpleNamespace(id=node_id, type=node_type, name=name, path=path, tags=list(tags), lang=lang)
+
+
+NODES = [
+    node("file:src/api/routes.py", "file", "routes.py", "src/api/routes.py"),
+    node("fn:src/api/routes.py:register", "function", "register", "src/api/routes.py"),
+    node("fn:src/api/handlers.py:parse_edge", "function", "parse_edge", "src/api/handlers.py", ["hidden_io"]),
+    node("class:src/apiary/hive.py:Hive", "class", "Hive", "src/apiary/hive.py", ["god_object"]),
+    node("test:tests/test_api.py:test_parse", "test", "test_parse", "tests/test_api.py", ["test"]),
+    node("fn:web/app.ts:render", "function", "render", "web/app.ts", lang="typescript"),
+    node("mod:src/api", "module", "api", "src/api"),
+]
+
+
+@pytest.fixture
+def index() -> NodeIndex:
+    return NodeIndex(NODES, {"register": ["fn:src/api/routes.py:register"]}, {})
+
+
+def test_parse_precedence_and_implicit_and() -> None:
+    expr = parse_query("type:function path:src/api OR NOT tag:test")
+    assert str(expr) == "((type:function AND path:src/api) OR NOT tag:test)"
+
+
+def test_parse_parentheses_quotes_and_modes() -> None:
+    expr = parse_query('(symbol:~Parse OR name:"a b") AND path:src/*.py')
+    assert isinstance(expr, BoolExpr) and expr.op == "and"
+    either, glob = expr.children
+    assert either.children == [Term("name", "parse", "substring"), Term("name", "a b")]
+    assert glob == Term("path", "src/*.py", "glob")
+
+
+def test_parse_lowercases_case_insensitive_fields() -> None:
+    assert parse_query("TYPE:Function") == Term("type", "function")
+    assert parse_query("name:Hive") == Term("name", "Hive")
+
+
+@pytest.mark.parametrize("text, message", [
+    ("", "empty query"),
+    ("type:", "empty value"),
+    ("color:red", "unknown field"),
+    ("(type:function", "missing closing parenthesis"),
+    ("type:function)", "unexpected ')'"),
+    ("AND type:function", "unexpected 'AND'"),
+    ("parse", "expected field:value"),
+])
+def test_parse_errors(text: str, message: str) -> None:
+    with pytest.raises(QueryError, match=re.escape(message)):
+        parse_query(text)
+
+
+def ids(index: NodeIndex, text: str) -> set:
+    return evaluate(parse_query(text), index)
+
+
+def test_path_matches_directory_boundaries(index: NodeIndex) -> None:
+    assert ids(index, "path:src/api AND NOT type:module") == {
+        "file:src/api/routes.py", "fn:src/api/routes.py:register", "fn:src/api/handlers.py:parse_edge",
+    }
+
+
+def test_substring_glob_and_negation(index: NodeIndex) -> None:
+    assert ids(index, "name:~PARSE") == {"fn:src/api/handlers.py:parse_edge", "test:tests/test_api.py:test_parse"}
+    assert ids(index, "path:*.ts") == {"fn:web/app.ts:render"}
+    assert ids(index, "NOT lang:python") == {"fn:web/app.ts:render"}
+
+
+def test_explain_trace_records_each_step(index: NodeIndex) -> None:
+    trace: list = []
+    evaluate(parse_query("type:function AND NOT tag:hidden_io"), index, trace)
+    assert trace[-1] == "and -> 2"
+    assert any(line.startswith("  scan type:function") for line in trace)
+
+
+def brute_force(index: NodeIndex, expr) -> set:
+    return {node_id for node_id in index.universe if index.matches(node_id, expr)}
+
+
+TERMS = ["type:function", "path:src", "tag:test", "name:~e", "lang:typescript", "path:src/api*", "type:module"]
+
+
+@pytest.mark.parametrize("a, b, c", list(itertools.combinations(TERMS, 3)))
+def test_planner_agrees_with_brute_force(index: NodeIndex, a: str, b: str, c: str) -> None:
+    for text in (f"{a} AND {b} AND NOT {c}", f"({a} OR {b}) AND {c}", f"NOT ({a} AND {b}) OR {c}"):
+        expr = parse_query(text)
+        assert evaluate(expr, index) == brute_force(index, expr), text
+
+
+def test_legacy_symbol_lookup_falls_back_to_substring(index: NodeIndex) -> None:
+    assert evaluate(Term("name", "register", "auto"), index) == {"fn:src/api/routes.py:register"}
+    assert evaluate(Term("name", "Hiv", "auto"), index) == {"class:src/apiary/hive.py:Hive"}
+
+
+def test_legacy_path_lookup_prefers_the_directory_rollup(index: NodeIndex) -> None:
+    assert evaluate(Term("path", "src/api/", "auto"), index) == {"mod:src/api"}
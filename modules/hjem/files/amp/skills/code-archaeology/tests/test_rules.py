@@ -0,0 +1,65 @@
+import time
+
+import rules
+from rules import run_rules
+
+
+def function(name: str, line: int) -> dict:
+    return {"name": name, "type": "function", "line": line}
+
+
+def test_hidden_io_flags_io_in_functions_without_an_io_name() -> None:
+    lines = ["def total(items):", "    print(items)", "    return sum(items)", "def load(path):", "    return open(path)"]
+    tags, _ = run_rules(lines, "python", [function("total", 1), function("load", 4)])
+    assert [0, "hidden_io"] in tags
+    assert [1, "hidden_io"] not in tags
+
+
+def test_shared_mutable_state_needs_two_writers() -> None:
+    lines = [
+        "CACHE = {}",
+        "def put(k, v):",
+        "    CACHE[k] = v",
+        "def drop(k):",
+        "    CACHE.pop(k)",
+    ]
+    tags, _ = run_rules(lines, "python", [function("put", 2), function("drop", 4)])
+    assert sorted(seg for seg, tag in tags if tag == "shared_mutable_state") == [-1, 0, 1]
+
+
+def test_stringly_typed_config_counts_lookups_per_symbol() -> None:
+    lines = ["def setup():", "    a = os.environ['A']", "    b = os.getenv('B')"]
+    tags, _ = run_rules(lines, "python", [function("setup", 1)])
+    assert [0, "stringly_typed_config"] in tags
+
+
+def test_temporal_coupling_flags_state_guards() -> None:
+    lines = ["def send(self):", "    if not self._connected:", "        raise RuntimeError('not connected')"]
+    tags, _ = run_rules(lines, "python", [function("send", 1)])
+    assert tags == [[0, "temporal_coupling"]]
+
+
+def test_rules_are_limited_to_their_languages() -> None:
+    lines = ["def total(items):", "    print(items)"]
+    tags, _ = run_rules(lines, "elixir", [function("total", 1)])
+    assert tags == []
+
+
+def test_untimed_runs_make_no_clock_calls_per_line(monkeypatch) -> None:
+    calls = []
+    real = time.perf_counter
+
+    def counting() -> float:
+        calls.append(1)
+        return real()
+
+    monkeypatch.setattr(rules.time, "perf_counter", counting)
+    lines = [f"x{i} = {i}" for i in range(200)]
+    tags, costs = run_rules(lines, "python", [])
+    assert costs == {}
+    assert len(calls) < 20
+
+    calls.clear()
+    _, costs = run_rules(lines, "python", [], timed=True)
+    assert set(costs) == rules.RULE_TAGS | {"stream"}
+    assert len(calls) > 200
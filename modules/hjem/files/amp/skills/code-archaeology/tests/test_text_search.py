@@ -0,0 +1,116 @@
+import json
+import math
+import random
+from array import array
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+import text_search
+from text_search import SearchIndex, subtokens, write_search_index
+
+
+NODES = [
+    SimpleNamespace(id="fn:cfg.py:parseConfig", name="parseConfig", path="src/cfg.py", summary="Reads YAML settings"),
+    SimpleNamespace(id="fn:cfg.py:writeConfig", name="writeConfig", path="src/cfg.py", summary="Persists settings"),
+    SimpleNamespace(id="fn:http.py:parse_request", name="parse_request", path="src/http.py", summary=""),
+    SimpleNamespace(id="class:db.py:HTTPConnectionPool", name="HTTPConnectionPool", path="src/db.py", summary=None),
+    SimpleNamespace(id="file:README.md", name="README.md", path="README.md", summary="Project entries"),
+]
+
+
+def brute_force(nodes: list, text: str, hash_bits: int) -> dict:
+    docs = [text_search.term_counts(text_search.node_fields(n), hash_bits) for n in nodes]
+    df: dict = {}
+    for counts in docs:
+        for b in counts:
+            df[b] = df.get(b, 0) + 1
+
+    def vector(counts: dict) -> dict:
+        weights = {b: (1.0 + math.log(c)) * text_search.idf_weight(len(nodes), df.get(b, 0)) for b, c in counts.items()}
+        norm = math.sqrt(sum(w * w for w in weights.values())) or 1.0
+        return {b: w / norm for b, w in weights.items()}
+
+    query = vector(text_search.term_counts([(text, 1.0)], hash_bits))
+    scores = {}
+    for node, counts in zip(nodes, docs):
+        doc = vector(counts)
+        score = sum(w * doc.get(b, 0.0) for b, w in query.items())
+        if score > 0:
+            scores[node.id] = score
+    return scores
+
+
+def test_subtokens_split_identifiers_and_stem() -> None:
+    assert subtokens("HTTPConnectionPool") == ["http", "connection", "pool"]
+    assert subtokens("parse_request entries class x") == ["parse", "request", "entry", "class"]
+    assert subtokens("load2Files") == ["load", "file"]
+
+
+def test_search_ranks_by_cosine_similarity(tmp_path: Path) -> None:
+    search_dir = tmp_path / "search"
+    postings = write_search_index(search_dir, NODES, hash_bits=12)
+    index = SearchIndex(search_dir)
+    assert index.docs == len(NODES)
+    assert postings == index.meta["postings"]
+
+    for text in ("parse config", "settings", "http connection", "entry"):
+        expected = brute_force(NODES, text, 12)
+        found = index.search(text, len(NODES))
+        ids = index.ids_for([row for row, _ in found])
+        assert dict(zip(ids, (s for _, s in found))) == pytest.approx(expected, rel=1e-4)
+        assert [s for _, s in found] == sorted((s for _, s in found), reverse=True)
+
+    assert index.ids_for([row for row, _ in index.search("parse config", 1)]) == ["fn:cfg.py:parseConfig"]
+    assert index.search("zzz unknown", 3) == []
+
+
+def test_search_restricts_to_allowed_rows(tmp_path: Path) -> None:
+    write_search_index(tmp_path / "search", NODES, hash_bits=12)
+    index = SearchIndex(tmp_path / "search")
+    allowed = index.rows_for(["fn:http.py:parse_request", "missing"])
+    found = index.search("parse config", 5, allowed)
+    assert index.ids_for([row for row, _ in found]) == ["fn:http.py:parse_request"]
+
+
+def test_search_rejects_other_index_versions(tmp_path: Path) -> None:
+    write_search_index(tmp_path / "search", NODES, hash_bits=12)
+    meta = tmp_path / "search" / "meta.json"
+    meta.write_text(json.dumps({**json.loads(meta.read_text()), "version": "0"}))
+    with pytest.raises(ValueError):
+        SearchIndex(tmp_path / "search")
+
+
+def test_numpy_and_python_postings_agree() -> None:
+    pytest.importorskip("numpy")
+    rng = random.Random(7)
+    dim, n = 64, 40
+    rows, cols, tfs = [], [], []
+    for row in range(n):
+        for col in rng.sample(range(dim), rng.randint(0, 6)):
+            rows.append(row)
+            cols.append(col)
+            tfs.append(float(rng.randint(1, 4)))
+    fast = text_search.pack_postings_numpy(dim, n, rows, cols, tfs)
+    slow = text_search.pack_postings_python(dim, n, rows, cols, tfs)
+    assert list(fast[1]) == list(slow[1])
+    assert list(fast[2]) == list(slow[2])
+    assert list(fast[0]) == pytest.approx(list(slow[0]), rel=1e-5)
+    assert list(fast[3]) == pytest.approx(list(slow[3]), rel=1e-5)
+
+
+def test_numpy_and_python_top_k_agree() -> None:
+    pytest.importorskip("numpy")
+    rng = random.Random(11)
+    lists = []
+    for _ in range(5):
+        rows = sorted(rng.sample(range(100), 30))
+        lists.append((array("I", rows), array("f", (rng.choice([0.25, 0.5, 1.0]) for _ in rows)), rng.random()))
+    allowed = set(rng.sample(range(100), 40))
+    for k in (1, 5, 50, 200):
+        for subset in (None, allowed):
+            fast = text_search.top_k_numpy(lists, k, subset)
+            slow = text_search.top_k_python(lists, k, subset)
+            assert [r for r, _ in fast] == [r for r, _ in slow]
+            assert [s for _, s in fast] == pytest.approx([s for _, s in slow], rel=1e-6)